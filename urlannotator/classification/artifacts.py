@@ -0,0 +1,127 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+
+import numpy
+
+# Model artifact layout:
+#   MAGIC (8 bytes)
+#   header length (little-endian unsigned 64-bit integer)
+#   JSON header: model's metadata and name, dtype, shape and offset of every
+#                array
+#   arrays' raw data, each aligned to ALIGNMENT bytes
+MAGIC = 'UAMODEL1'
+ALIGNMENT = 64
+
+_length_struct = struct.Struct('<Q')
+PREAMBLE_SIZE = len(MAGIC) + _length_struct.size
+
+
+class ArtifactError(Exception):
+    """
+        Raised when a file is not a valid model artifact.
+    """
+    pass
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def is_artifact(file_name):
+    """
+        Returns whether given file is a model artifact.
+    """
+    try:
+        with open(file_name, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except IOError:
+        return False
+
+
+def write_artifact(file_name, arrays, meta=None):
+    """
+        Writes NumPy `arrays` (a dictionary name -> array) and JSON-serializable
+        `meta` data to `file_name`. The file is replaced atomically, so that
+        readers never map a partially written model.
+    """
+    arrays = dict((name, numpy.ascontiguousarray(array))
+        for name, array in arrays.iteritems())
+
+    # Array offsets are computed relative to the data section first. The data
+    # section starts after the header, whose length depends on the offsets.
+    layout = {}
+    size = 0
+    for name in sorted(arrays):
+        array = arrays[name]
+        offset = _align(size)
+        layout[name] = {
+            'dtype': array.dtype.str,
+            'shape': list(array.shape),
+            'offset': offset,
+        }
+        size = offset + array.nbytes
+
+    data_start = PREAMBLE_SIZE
+    while True:
+        header = {
+            'meta': meta or {},
+            'arrays': dict((name, dict(entry,
+                offset=entry['offset'] + data_start))
+                for name, entry in layout.iteritems()),
+        }
+        encoded = json.dumps(header, sort_keys=True)
+        needed = _align(PREAMBLE_SIZE + len(encoded))
+        if needed <= data_start:
+            break
+        data_start = needed
+    encoded += ' ' * (data_start - PREAMBLE_SIZE - len(encoded))
+
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(file_name) or '.')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_length_struct.pack(len(encoded)))
+        f.write(encoded)
+        for name in sorted(arrays):
+            f.seek(header['arrays'][name]['offset'])
+            f.write(arrays[name].data)
+        f.truncate(data_start + size)
+    os.rename(tmp_name, file_name)
+
+
+def read_artifact(file_name, use_mmap=True):
+    """
+        Reads an artifact written with `write_artifact`.
+
+        With `use_mmap`, arrays are read-only views of the memory-mapped file.
+        Pages are loaded lazily and shared by all processes mapping the same
+        file. Otherwise arrays are copied into process's memory.
+
+        :rtype: A tuple (meta, arrays)
+    """
+    with open(file_name, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ArtifactError('%s is not a model artifact.' % file_name)
+        length, = _length_struct.unpack(f.read(_length_struct.size))
+        header = json.loads(f.read(length))
+
+        if use_mmap:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            f.seek(0)
+            buf = f.read()
+
+    arrays = {}
+    for name, entry in header['arrays'].iteritems():
+        dtype = numpy.dtype(str(entry['dtype']))
+        shape = tuple(entry['shape'])
+        count = int(numpy.prod(shape)) if shape else 1
+        array = numpy.frombuffer(buf, dtype=dtype, count=count,
+            offset=entry['offset']).reshape(shape)
+        if not use_mmap:
+            array = array.copy()
+        arrays[name] = array
+
+    return header['meta'], arrays
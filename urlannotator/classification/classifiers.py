@@ -1,9 +1,12 @@
 import nltk
+import numpy
 import httplib2
 import os
 import csv
 import json
 import pickle
+import tempfile
+import threading
 import time
 
 from apiclient.discovery import build
@@ -14,12 +17,19 @@ from oauth2client.file import Storage
 from boto.s3.key import Key
 
 from urlannotator.classification.models import (Classifier as ClassifierModel,
-    TrainingSet)
+    TrainingSet, update_classified_samples, BULK_QUERY_SIZE)
+from urlannotator.classification.features import (HashedFeatureMatrix,
+    FeatureStore, FeatureSpace, hash_token, HASHING_DIMENSION)
+from urlannotator.classification.model_cache import model_cache
+from urlannotator.classification.client import notify_reload
+from urlannotator.classification.artifacts import (write_artifact,
+    read_artifact, is_artifact)
+from urlannotator.classification.evaluation import cross_validate
 from urlannotator.tools.synchronization import RWSynchronize247
-from urlannotator.statistics.stat_extraction import update_classifier_stats
 from urlannotator.flow_control import send_event
-from urlannotator.main.models import (Job, LABEL_YES, LABEL_NO, LABEL_BROKEN,
-    make_label)
+from urlannotator.main.models import (Job, Sample, LABEL_YES, LABEL_NO,
+    LABEL_BROKEN, make_label)
+from urlannotator.tools.utils import setting, chunks
 
 import logging
 log = logging.getLogger(__name__)
@@ -32,6 +42,10 @@ CLASS_TRAIN_STATUS_DONE = 'DONE'
 CLASS_TRAIN_STATUS_RUNNING = 'RUNNING'
 CLASS_TRAIN_STATUS_ERROR = 'ERROR'
 
+# Default maximum fraction of the training set that can change to update
+# a classifier incrementally instead of training it from scratch.
+DEFAULT_UPDATE_MAX_DELTA = 0.2
+
 
 class ClassifierTrainingError(Exception):
     """
@@ -48,6 +62,76 @@ class ClassifierTrainingCriticalError(Exception):
     pass
 
 
+class ClassifierLocked(Exception):
+    """
+        Classifier couldn't be locked for classification in time, because
+        it's being switched. It is safe to retry the task.
+    """
+    pass
+
+
+def dump_atomically(obj, file_name):
+    """
+        Pickles `obj` into `file_name`. The file is replaced atomically, so
+        that concurrent readers never load a partially written model.
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(file_name))
+    with os.fdopen(fd, 'wb') as f:
+        pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_name, file_name)
+
+
+def identity_analysis():
+    """
+        Returns performance stats of a perfect classifier. Used when real stats
+        can't be computed.
+    """
+    return {
+        'modelDescription': {
+            'confusionMatrix': {
+                LABEL_YES: {
+                    LABEL_YES: 1,
+                    LABEL_NO: 0,
+                    LABEL_BROKEN: 0,
+                },
+                LABEL_NO: {
+                    LABEL_YES: 0,
+                    LABEL_NO: 1,
+                    LABEL_BROKEN: 0,
+                },
+                LABEL_BROKEN: {
+                    LABEL_YES: 0,
+                    LABEL_NO: 0,
+                    LABEL_BROKEN: 1,
+                }
+            }
+        }
+    }
+
+
+def get_training_data(entry_id):
+    """
+        Returns a tuple (samples, labels) of the training set classifier
+        `entry_id` was trained on. Both lists are empty if it wasn't trained.
+    """
+    entry = ClassifierModel.objects.get(id=entry_id)
+    set_id = entry.parameters.get('training_set')
+    if not set_id:
+        return [], []
+
+    try:
+        training_set = TrainingSet.objects.get(id=set_id)
+    except TrainingSet.DoesNotExist:
+        return [], []
+
+    samples = []
+    labels = []
+    for training_sample in training_set.get_samples():
+        samples.append(training_sample.sample)
+        labels.append(training_sample.label)
+    return samples, labels
+
+
 class Classifier(object):
     def train(self, samples=[], turn_off=True, set_id=0):
         raise NotImplementedError
@@ -64,20 +148,72 @@ class Classifier(object):
     def get_train_status(self):
         raise NotImplementedError
 
+    def get_version(self):
+        """
+            Returns version of classifier's model, which changes whenever
+            the model does, or None if it's unknown. Classification results
+            are cached by the version.
+        """
+        return None
+
+    def get_training_set_id(self):
+        """
+            Returns id of the training set classifier's model was trained on,
+            or None if it wasn't trained.
+        """
+        entry = ClassifierModel.objects.get(id=self.id)
+        return entry.parameters.get('training_set') or None
+
+    def get_model_stats(self):
+        """
+            Returns a dictionary of model's size stats - number of features
+            and memory taken, in bytes. Empty if the classifier has no model
+            or doesn't know them.
+        """
+        return {}
+
+    def save_model_stats(self, entry):
+        """
+            Stores model's stats in classifier's entry, so that they can be
+            read without loading the model.
+        """
+        entry.parameters['model_stats'] = self.get_model_stats()
+        entry.save()
+
     def classify_with_info(self, sample):
         raise NotImplementedError
 
+    def classify_batch(self, samples):
+        """
+            Classifies a list of samples at once and saves results to them.
+            Returns a list of labels, with None for samples that failed.
+        """
+        raise NotImplementedError
+
+
+# Number of seconds between Classifier247 subclassifier's train status checks
+# made right after training.
+CLASS247_TRAIN_STEP = 5
 
-# Number of seconds between steps Classifier247 subclassifier's train status
-# check.
-CLASS247_TRAIN_STEP = 15
+# Number of train status checks made right after training. If the training
+# is still running after them, the switch is left pending and made by
+# the `FinishTrainingManager` task, so that no process waits for remote
+# training.
+CLASS247_TRAIN_CHECKS = 2
 
-# Maxmimum number of seconds to wait between train status check.
-CLASS247_MAX_WAIT = 10 * 60
+
+# Process-wide cache of Classifier247 subclassifiers.
+# Entry id -> (version, writer, reader).
+_subclassifiers = {}
+_subclassifiers_lock = threading.Lock()
 
 
 class Classifier247(Classifier):
 
+    # Number of seconds classification waits for a switch to finish before
+    # ClassifierLocked is raised. None waits as long as it takes.
+    lock_timeout = None
+
     def __init__(self, reader_instance, writer_instance, entry_id, factory):
         """
         Our permanent (24/7) synchronize template can be initialized with
@@ -90,6 +226,26 @@ class Classifier247(Classifier):
         self.sync247 = RWSynchronize247(template_name=str(entry_id))
 
     def update_self(self):
+        """
+        Returns correct classifiers. Subclassifiers are cached in process's
+        scope, and loaded from the DB again only after a switch changes
+        the version.
+        :rtype: A tuple (writer, reader)
+        """
+        version = self.sync247.get_version()
+        if version is not None:
+            with _subclassifiers_lock:
+                cached = _subclassifiers.get(self.id)
+            if cached is not None and cached[0] == version:
+                return cached[1:]
+
+        writer, reader = self.load_subclassifiers()
+        if version is not None:
+            with _subclassifiers_lock:
+                _subclassifiers[self.id] = (version, writer, reader)
+        return (writer, reader)
+
+    def load_subclassifiers(self):
         """
         Loads subclassifiers data from the DB and returns correct classifiers.
         :rtype: A tuple (writer, reader)
@@ -119,16 +275,28 @@ class Classifier247(Classifier):
         res = reader.analyze()
         return res
 
+    def get_version(self):
+        """
+        Returns version of the reader, changed by every switch.
+        """
+        return self.sync247.get_version()
+
+    def get_model_stats(self):
+        writer, reader = self.update_self()
+        return reader.get_model_stats()
+
     def train_lock(self, func, turn_off=True, *args, **kwargs):
         """
-        Locks the classifier during training.
+        Locks the classifier during training. Subclassifiers are switched if
+        the training is done. Returns False if the switch is left pending,
+        True if it has been made.
         """
         self.sync247.modified_lock()
         try:
 
             entry = ClassifierModel.objects.get(id=self.id)
             try:
-                func(*args, **kwargs)
+                done = func(*args, **kwargs)
             except ClassifierTrainingError, e:
                 # Retry-safe error has been propagated up to here whilst
                 # it should've been handled in the `func`. Log it and abort.
@@ -148,46 +316,47 @@ class Classifier247(Classifier):
                 )
                 return
 
-            with self.sync247.switch():
-                writer, reader = self.update_self()
-                self.update_to_db(
-                    writer_id=reader.id,
-                    reader_id=writer.id,
+            if done is False:
+                log.info(
+                    'Classifier247 %d: Training is still running, switch is '
+                    'pending.' % self.id
                 )
+                return False
 
-            try:
-                # Refresh our `entry` object
-                entry = ClassifierModel.objects.get(id=self.id)
-                update_classifier_stats(self, entry.job)
-            except Exception, e:
-                # If we fail during updating classifier stats - log it.
-                send_event(
-                    "EventClassifierCriticalTrainError",
-                    job_id=entry.job_id,
-                    message=e.message,
-                )
-                return
+            return self.switch_subclassifiers()
 
         finally:
             self.sync247.modified_release()
 
-    def _train(self, samples=[], set_id=0):
-        writer, reader = self.update_self()
-
-        # Trains the subclassifier
-        writer.train(
-            samples=[],
-            turn_off=False,
-            set_id=set_id,
-        )
+    def switch_subclassifiers(self):
+        """
+        Switches the reader and the writer. Requires the modified lock.
+        """
+        with self.sync247.switch():
+            writer, reader = self.update_self()
+            self.update_to_db(
+                writer_id=reader.id,
+                reader_id=writer.id,
+            )
 
-        trained = False
-        wait_time = 0
         entry = ClassifierModel.objects.get(id=self.id)
-        job_id = entry.job_id
 
-        while not trained:
-            time.sleep(min(wait_time, CLASS247_MAX_WAIT))
+        # Old reader's model won't be used until it's retrained.
+        model_cache.invalidate(reader.id)
+        notify_reload(entry.job_id)
+        # Performance stats are updated on EventClassifierTrained, outside of
+        # the classifier's locks.
+        return True
+
+    def check_writer(self, writer, job_id, checks=CLASS247_TRAIN_CHECKS):
+        """
+        Checks writer's train status up to `checks` times, CLASS247_TRAIN_STEP
+        seconds apart. Returns whether the training is done. Local
+        subclassifiers are done right after training.
+        """
+        for check in xrange(checks):
+            if check:
+                time.sleep(CLASS247_TRAIN_STEP)
 
             try:
                 status = writer.get_train_status()
@@ -199,16 +368,94 @@ class Classifier247(Classifier):
                     job_id=job_id,
                     message=e.message,
                 )
-            trained = status == CLASS_TRAIN_STATUS_DONE
-            wait_time += CLASS247_TRAIN_STEP
+            if status == CLASS_TRAIN_STATUS_DONE:
+                return True
+        return False
 
-        job = Job.objects.get(id=job_id)
+    def set_pending(self, set_id):
+        """
+        Marks the switch as pending until writer's training on `set_id`
+        finishes.
+        """
+        entry = ClassifierModel.objects.get(id=self.id)
+        entry.parameters['pending_set'] = set_id
+        entry.save()
 
+    def clear_pending(self):
+        entry = ClassifierModel.objects.get(id=self.id)
+        entry.parameters.pop('pending_set', None)
+        entry.save()
+
+    def writer_trained(self, writer, set_id):
+        """
+        Called after writer's training on `set_id` has been started. Returns
+        whether it is done, otherwise marks the switch as pending.
+        """
+        entry = ClassifierModel.objects.get(id=self.id)
+        if not self.check_writer(writer, entry.job_id):
+            self.set_pending(set_id)
+            return False
+
+        entry.parameters.pop('pending_set', None)
+        entry.save()
+
+        job = Job.objects.get(id=entry.job_id)
         if not job.is_classifier_trained():
             job.set_classifier_trained()
+        return True
+
+    def finish_training(self):
+        """
+        Makes the pending switch if writer's training is done. Returns whether
+        the switch has been made. Gives up at once if the classifier is being
+        trained, the switch is retried later.
+        """
+        if not self.sync247.modified_try_lock():
+            log.info(
+                'Classifier247 %d: Classifier is locked, pending switch is '
+                'skipped.' % self.id
+            )
+            return False
+
+        try:
+            entry = ClassifierModel.objects.get(id=self.id)
+            if 'pending_set' not in entry.parameters:
+                return False
+
+            writer, reader = self.update_self()
+            try:
+                if not self.check_writer(writer, entry.job_id, checks=1):
+                    return False
+            except ClassifierTrainingCriticalError, e:
+                self.clear_pending()
+                send_event(
+                    "EventClassifierCriticalTrainError",
+                    job_id=entry.job_id,
+                    message=e.message,
+                )
+                return False
+
+            self.clear_pending()
+            job = Job.objects.get(id=entry.job_id)
+            if not job.is_classifier_trained():
+                job.set_classifier_trained()
+            return self.switch_subclassifiers()
+        finally:
+            self.sync247.modified_release()
+
+    def _train(self, samples=[], set_id=0):
+        writer, reader = self.update_self()
+
+        # Trains the subclassifier
+        writer.train(
+            samples=[],
+            turn_off=False,
+            set_id=set_id,
+        )
+        return self.writer_trained(writer, set_id)
 
     def train(self, samples=[], turn_off=True, set_id=0):
-        self.train_lock(
+        return self.train_lock(
             self._train,
             samples=samples,
             turn_off=turn_off,
@@ -218,15 +465,16 @@ class Classifier247(Classifier):
     def _update(self, samples=[], set_id=0):
         writer, reader = self.update_self()
 
-        # Trains the subclassifier
+        # Updates the subclassifier with changes since its last training
         writer.update(
             samples=[],
             turn_off=False,
             set_id=set_id,
         )
+        return self.writer_trained(writer, set_id)
 
     def update(self, samples=[], turn_off=True, set_id=0):
-        self.train_lock(
+        return self.train_lock(
             self._update,
             samples=samples,
             turn_off=False,
@@ -235,9 +483,12 @@ class Classifier247(Classifier):
 
     def classify_lock(self, func, *args, **kwargs):
         """
-        Locks the classifier during classifying.
+        Locks the classifier during classifying. Raises ClassifierLocked if
+        it can't be locked within `lock_timeout` seconds.
         """
-        self.sync247.reader_lock()
+        if not self.sync247.reader_lock(timeout=self.lock_timeout):
+            raise ClassifierLocked('Classifier %s is being switched.'
+                % self.id)
         try:
             res = func(*args, **kwargs)
 
@@ -269,13 +520,109 @@ class Classifier247(Classifier):
             sample=sample,
         )
 
+    def _classify_batch(self, samples):
+        writer, reader = self.update_self()
+
+        # Classifies all samples with a single reader
+        return reader.classify_batch(samples)
+
+    def classify_batch(self, samples):
+        return self.classify_lock(
+            self._classify_batch,
+            samples=samples,
+        )
+
+
+def tree_leaf(tree, featureset):
+    """
+        Returns the leaf of nltk's decision tree `featureset` is classified
+        by, walking the tree the way `DecisionTreeClassifier.classify` does.
+    """
+    while tree._fname is not None:
+        fval = featureset.get(tree._fname)
+        if fval in tree._decisions:
+            tree = tree._decisions[fval]
+        elif tree._default is not None:
+            tree = tree._default
+        else:
+            break
+    return tree
+
+
+def tree_leaf_counts(tree, train_set, classes):
+    """
+        Returns a list of (leaf, counts) pairs of decision tree's leaves
+        reached by `train_set` samples. Counts are leaf's label frequencies,
+        with add-one smoothing. Pairs keep references to the tree's leaves, so
+        they can be pickled along with the tree.
+    """
+    leaf_counts = {}
+    for featureset, label in train_set:
+        leaf = tree_leaf(tree, featureset)
+        leaf, counts = leaf_counts.setdefault(id(leaf),
+            (leaf, numpy.ones(len(classes))))
+        counts[classes.index(label)] += 1
+    return leaf_counts.values()
+
+
+def tree_leaf_proba(tree, leaf_counts, featuresets, classes):
+    """
+        Returns a (len(featuresets), len(classes)) array of probabilities
+        predicted by a decision tree from its `leaf_counts`. Leaves no
+        training sample reaches give their label.
+    """
+    leaf_counts = dict((id(leaf), counts) for leaf, counts in leaf_counts)
+    probabilities = numpy.zeros((len(featuresets), len(classes)))
+    for idx, featureset in enumerate(featuresets):
+        leaf = tree_leaf(tree, featureset)
+        counts = leaf_counts.get(id(leaf))
+        if counts is None:
+            probabilities[idx, classes.index(leaf._label)] = 1.0
+        else:
+            probabilities[idx] = counts / counts.sum()
+    return probabilities
+
+
+def tree_predict_proba(tree, train_set, featuresets, classes):
+    """
+        Returns a (len(featuresets), len(classes)) array of probabilities
+        predicted by a decision tree trained on `train_set`. Probabilities
+        are label frequencies of training samples in the leaf, with add-one
+        smoothing.
+    """
+    return tree_leaf_proba(tree, tree_leaf_counts(tree, train_set, classes),
+        featuresets, classes)
+
+
+def simple_classifier_fold(state, rows):
+    """
+        Trains a decision tree on all samples but `rows` and predicts
+        probabilities of `rows`.
+    """
+    test_rows = set(rows.tolist())
+    train_set = [
+        (features, label) for row, (features, label)
+        in enumerate(zip(state['features'], state['labels']))
+        if row not in test_rows
+    ]
+    tree = nltk.classify.DecisionTreeClassifier.train(train_set)
+    return tree_predict_proba(tree, train_set,
+        [state['features'][row] for row in rows], state['classes'])
+
 
 class SimpleClassifier(Classifier):
     """
         Simple url classifier using Decision Tree.
         Model parameters:
             training_set - id of the set the was trained on.
+            features - feature space configuration, see `FeatureSpace`.
     """
+    # Labels the tree's probabilities are predicted of.
+    classes = [LABEL_YES, LABEL_NO, LABEL_BROKEN]
+
+    feature_store = FeatureStore(tokenizer='nltk')
+    # Words aren't hashed unless configured otherwise.
+    feature_space = FeatureSpace(dimension=None)
 
     def __init__(self, description, classes, *args, **kwargs):
         """
@@ -290,12 +637,62 @@ class SimpleClassifier(Classifier):
             Creates a set of words the sample's text consists of.
         """
         words = nltk.word_tokenize(sample.text)
-        words = set(words)
+        return SimpleClassifier.tokens_to_features(words)
+
+    @staticmethod
+    def tokens_to_features(words):
         feature_set = {}
         for word in words:
             feature_set[word] = True
         return feature_set
 
+    def get_samples_features(self, samples, model=None):
+        """
+            Creates features of every sample in the feature space of given
+            model, or the configured one, reading samples' words from the
+            feature store.
+        """
+        space = self.feature_space
+        vocabulary = None
+        if model is not None:
+            space = FeatureSpace().configure(model['space'])
+            vocabulary = model['vocabulary']
+
+        texts = (sample.text for sample in samples)
+        tokens = self.feature_store.get_tokens(texts, ngrams=space.ngrams)
+        if space.dimension:
+            tokens = ([hash_token(word) % space.dimension for word in words]
+                for words in tokens)
+        if vocabulary is not None:
+            tokens = ([word for word in words if word in vocabulary]
+                for words in tokens)
+        return [self.tokens_to_features(words) for words in tokens]
+
+    def get_training_features(self, samples):
+        """
+            Creates features of training samples, pruned as configured.
+            :rtype: A tuple (features, vocabulary). Vocabulary is the set of
+                    features kept, or None if features aren't pruned.
+        """
+        features = self.get_samples_features(samples)
+        if not self.feature_space.is_pruned():
+            return features, None
+
+        frequency = {}
+        for sample_features in features:
+            for feature in sample_features:
+                frequency[feature] = frequency.get(feature, 0) + 1
+        names = sorted(frequency)
+        kept = self.feature_space.prune([frequency[name] for name in names])
+        vocabulary = set(names[idx] for idx in kept)
+
+        features = [
+            dict((feature, value) for feature, value
+                in sample_features.iteritems() if feature in vocabulary)
+            for sample_features in features
+        ]
+        return features, vocabulary
+
     def get_file_name(self):
         """
             Returns file name under which the classifier is stored.
@@ -310,37 +707,36 @@ class SimpleClassifier(Classifier):
         if not os.path.exists('simple-classifiers/'):
             os.makedirs('simple-classifiers/')
 
-        with open(self.get_file_name(), 'wb') as f:
-            pickle.dump(self.classifier, f)
+        dump_atomically(self.classifier, self.get_file_name())
+        model_cache.set(self.id, self.get_file_name(), self.classifier)
 
     def analyze(self):
         """
-            Returns classifier performance stats.
-        """
-        res = {
-            'modelDescription': {
-                'confusionMatrix': {
-                    LABEL_YES: {
-                        LABEL_YES: 1,
-                        LABEL_NO: 0,
-                        LABEL_BROKEN: 0,
-                    },
-                    LABEL_NO: {
-                        LABEL_YES: 0,
-                        LABEL_NO: 1,
-                        LABEL_BROKEN: 0,
-                    },
-                    LABEL_BROKEN: {
-                        LABEL_YES: 0,
-                        LABEL_NO: 0,
-                        LABEL_BROKEN: 1,
-                    }
-                }
-            }
-        }
-        return res
+            Returns classifier performance stats of a stratified holdout of
+            the training set the classifier was trained on. A single tree is
+            trained on the rest, as trees are too expensive to train per fold.
+            Features are read from the feature store.
+        """
+        samples, labels = get_training_data(self.id)
+        features, vocabulary = self.get_training_features(samples)
+        analysis = cross_validate(
+            simple_classifier_fold,
+            state={
+                'features': features,
+                'labels': labels,
+                'classes': self.classes,
+            },
+            labels=labels,
+            classes=self.classes,
+            holdout=True,
+        )
+        return analysis or identity_analysis()
 
     def update(self, *args, **kwargs):
+        """
+            Decision trees can't be updated incrementally, hence the classifier
+            is trained from scratch.
+        """
         return self.train(*args, **kwargs)
 
     def train(self, samples=[], turn_off=True, set_id=0):
@@ -355,36 +751,96 @@ class SimpleClassifier(Classifier):
 
         if set_id:
             training_set = TrainingSet.objects.get(id=set_id)
-            samples = training_set.training_samples.all()
+            samples = training_set.get_samples()
             entry.parameters['training_set'] = set_id
             entry.save()
 
-        train_set = []
+        train_samples = []
+        labels = []
         for sample in samples:
-            job = sample.sample.job
             sample.sample.label = sample.label
-            train_set.append((self.get_features(sample.sample), sample.label))
-
-        if train_set:
-            self.classifier = nltk.classify.DecisionTreeClassifier.train(
-                train_set)
+            train_samples.append(sample.sample)
+            labels.append(sample.label)
+
+        if train_samples:
+            features, vocabulary = self.get_training_features(train_samples)
+            train_set = zip(features, labels)
+            tree = nltk.classify.DecisionTreeClassifier.train(train_set)
+            if vocabulary is None:
+                feature_count = len(set(
+                    feature for sample_features in features
+                    for feature in sample_features))
+            else:
+                feature_count = len(vocabulary)
+            self.classifier = {
+                'tree': tree,
+                'space': self.feature_space.to_parameters(),
+                'vocabulary': vocabulary,
+                'features': feature_count,
+                'leaf_counts': tree_leaf_counts(tree, train_set,
+                    self.classes),
+            }
 
             self.dump_classifier()
+            self.save_model_stats(entry)
             job.set_classifier_trained()
 
+    @staticmethod
+    def read_classifier(file_name):
+        with open(file_name, 'rb') as f:
+            model = pickle.load(f)
+        if not isinstance(model, dict):
+            # Older versions dumped bare trees of unhashed words.
+            model = {
+                'tree': model,
+                'space': FeatureSpace(dimension=None).to_parameters(),
+                'vocabulary': None,
+                'features': None,
+            }
+        return model
+
     def load_classifier(self):
         """
-            Loads classifier from file.
+            Loads classifier from file, or the model cache if it's up to date.
         """
-        if os.path.exists(self.get_file_name()):
-            with open(self.get_file_name(), 'rb') as f:
-                self.classifier = pickle.load(f)
-        else:
+        self.classifier = model_cache.load(
+            key=self.id,
+            file_name=self.get_file_name(),
+            loader=self.read_classifier,
+        )
+        if self.classifier is None:
             log.warning('No classifier %s.' % self.get_file_name())
 
     def get_train_status(self):
         return CLASS_TRAIN_STATUS_DONE
 
+    def get_version(self):
+        """
+            Returns modification time of the model's file, which is replaced
+            whenever the model changes.
+        """
+        try:
+            return int(os.path.getmtime(self.get_file_name()) * 1000)
+        except OSError:
+            return None
+
+    def get_model_stats(self):
+        """
+            Returns number of model's features and size of its pickled tree.
+        """
+        self.load_classifier()
+        if self.classifier is None:
+            return {}
+
+        try:
+            memory = os.path.getsize(self.get_file_name())
+        except OSError:
+            memory = None
+        return {
+            'features': self.classifier['features'],
+            'memory': memory,
+        }
+
     def get_default_probabilities(self):
         return {
             LABEL_YES: 0.50,
@@ -392,6 +848,24 @@ class SimpleClassifier(Classifier):
             LABEL_BROKEN: 0.0,
         }
 
+    def get_label_probabilities(self, features):
+        """
+            Returns label probabilities of samples of given features - label
+            frequencies of training samples in tree's leaves they reach.
+        """
+        leaf_counts = self.classifier.get('leaf_counts')
+        if leaf_counts is None:
+            # Models trained before leaves' counts were stored.
+            return [self.get_default_probabilities() for _ in features]
+
+        probabilities = tree_leaf_proba(self.classifier['tree'], leaf_counts,
+            features, self.classes)
+        return [
+            dict((label, round(probability, 3)) for label, probability
+                in zip(self.classes, sample_probabilities))
+            for sample_probabilities in probabilities
+        ]
+
     def classify(self, class_sample):
         """
             Classifies gives sample and saves result to the model.
@@ -401,7 +875,9 @@ class SimpleClassifier(Classifier):
         if self.classifier is None:
             return None
 
-        label = self.classifier.classify(self.get_features(class_sample.sample))
+        features = self.get_samples_features([class_sample.sample],
+            model=self.classifier)[0]
+        label = self.classifier['tree'].classify(features)
 
         entry = ClassifierModel.objects.get(id=self.id)
         train_set_id = entry.parameters['training_set']
@@ -409,7 +885,7 @@ class SimpleClassifier(Classifier):
 
         class_sample.training_set = training_set
         class_sample.label = label
-        label_probability = self.get_default_probabilities()
+        label_probability = self.get_label_probabilities([features])[0]
         class_sample.label_probability = json.dumps(label_probability)
         class_sample.save()
 
@@ -425,7 +901,9 @@ class SimpleClassifier(Classifier):
         if self.classifier is None:
             return None
 
-        label = self.classifier.classify(self.get_features(class_sample.sample))
+        features = self.get_samples_features([class_sample.sample],
+            model=self.classifier)[0]
+        label = self.classifier['tree'].classify(features)
 
         entry = ClassifierModel.objects.get(id=self.id)
         train_set_id = entry.parameters['training_set']
@@ -433,12 +911,526 @@ class SimpleClassifier(Classifier):
 
         class_sample.training_set = training_set
         class_sample.label = label
+        label_probability = self.get_label_probabilities([features])[0]
+        class_sample.label_probability = json.dumps(label_probability)
+        class_sample.save()
+
+        return label
+
+    def classify_batch(self, class_samples):
+        """
+            Classifies given samples with a single model load and saves
+            results with bulk updates.
+        """
+        self.load_classifier()
+
+        if self.classifier is None:
+            return [None] * len(class_samples)
+
+        training_set_id = self.get_training_set_id()
+        features = self.get_samples_features(
+            (class_sample.sample for class_sample in class_samples),
+            model=self.classifier)
+        probabilities = self.get_label_probabilities(features)
+        labels = []
+        for class_sample, sample_features, label_probability in zip(
+                class_samples, features, probabilities):
+            label = self.classifier['tree'].classify(sample_features)
+            class_sample.training_set_id = training_set_id
+            class_sample.label = label
+            class_sample.label_probability = json.dumps(label_probability)
+            labels.append(label)
+
+        update_classified_samples(class_samples)
+        return labels
+
+
+def naive_bayes_fold(state, rows):
+    """
+        Predicts `rows` with a model built on all other samples. The model's
+        counts are the full training set's counts less the fold's ones, so
+        only the fold is counted.
+    """
+    classifier = state['classifier']
+    features = state['features'].take_rows(rows)
+    class_counts, feature_counts = classifier.count(
+        features, [state['labels'][row] for row in rows])
+    model = classifier.build_model(
+        classes=classifier.classes,
+        class_counts=state['class_counts'] - class_counts,
+        feature_counts=state['feature_counts'] - feature_counts,
+    )
+    return classifier.predict_proba(features, model=model)
+
+
+class NaiveBayesClassifier(Classifier):
+    """
+        Multinomial Naive Bayes url classifier working on a hashed, binary
+        word-presence feature matrix. Training and classification are
+        vectorized with NumPy.
+        Model parameters:
+            model - name of the file the model is stored under.
+            training_set - id of the set the classifier was trained on.
+            features - feature space configuration, see `FeatureSpace`.
+    """
+    # Additive (Laplace) smoothing of word counts.
+    alpha = 1.0
+    feature_store = FeatureStore(tokenizer='words')
+    feature_space = FeatureSpace()
+
+    def __init__(self, description, classes, *args, **kwargs):
+        """
+            Description is not used by this classifier.
+        """
+        self.classes = list(classes)
+        self.classifier = None
+        super(NaiveBayesClassifier, self).__init__(*args, **kwargs)
+
+    @classmethod
+    def get_features(cls, samples, dimension=HASHING_DIMENSION, ngrams=1):
+        """
+            Creates a hashed feature matrix of the samples' texts, reading
+            samples' words from the feature store.
+        """
+        return HashedFeatureMatrix.from_token_lists(
+            cls.feature_store.get_tokens(
+                (sample.text for sample in samples), ngrams=ngrams),
+            dimension=dimension,
+        )
+
+    def get_model_features(self, samples, model=None):
+        """
+            Creates a feature matrix of the samples in the feature space of
+            given model, or the classifier's one.
+        """
+        if model is None:
+            model = self.classifier
+        space = model['space']
+        features = self.get_features(samples, dimension=space.dimension,
+            ngrams=space.ngrams)
+        if model.get('vocabulary') is not None:
+            features = features.select_features(model['vocabulary'])
+        return features
+
+    def get_file_name(self):
+        """
+            Returns file name under which the classifier is stored.
+        """
+        path = os.path.join('bayes-classifiers/', self.model)
+        return path
+
+    def dump_classifier(self):
+        """
+            Dumps classifier to a file.
+        """
+        if not os.path.exists('bayes-classifiers/'):
+            os.makedirs('bayes-classifiers/')
+
+        model = self.classifier
+        arrays = {
+            'class_counts': model['class_counts'],
+            'feature_counts': model['feature_counts'],
+            'class_log_prior': model['class_log_prior'],
+            'feature_log_prob': model['feature_log_prob'],
+        }
+        if model.get('vocabulary') is not None:
+            arrays['vocabulary'] = model['vocabulary']
+        write_artifact(
+            self.get_file_name(),
+            arrays=arrays,
+            meta={
+                'type': self.__class__.__name__,
+                'classes': model['classes'],
+                'alpha': self.alpha,
+                'tokenizer': self.feature_store.tokenizer,
+                'hashing': 'crc32',
+                'dimension': model['space'].dimension,
+                'features': model['space'].to_parameters(),
+            },
+        )
+        model_cache.set(self.id, self.get_file_name(), self.classifier,
+            size=self.get_model_size(self.classifier))
+
+    @staticmethod
+    def get_model_size(model):
+        """
+            Returns memory taken by model's arrays, in bytes.
+        """
+        return sum(value.nbytes for value in model.itervalues()
+            if isinstance(value, numpy.ndarray))
+
+    def read_classifier(self, file_name):
+        """
+            Reads model from a memory-mapped artifact, so that its pages are
+            shared by all processes on the host. Models pickled by older
+            versions are still read.
+        """
+        if not is_artifact(file_name):
+            with open(file_name, 'rb') as f:
+                return self.build_model(**pickle.load(f))
+
+        meta, arrays = read_artifact(file_name)
+        model = {'classes': list(meta['classes'])}
+        model.update(arrays)
+        # Older artifacts hold all buckets of words' hashes.
+        model['space'] = FeatureSpace(dimension=meta['dimension']).configure(
+            meta.get('features'))
+        return model
+
+    def load_classifier(self):
+        """
+            Loads classifier from file, or the model cache if it's up to date.
+        """
+        self.classifier = model_cache.load(
+            key=self.id,
+            file_name=self.get_file_name(),
+            loader=self.read_classifier,
+            size_of=self.get_model_size,
+        )
+        if self.classifier is None:
+            log.warning('No classifier %s.' % self.get_file_name())
+
+    def build_model(self, classes, class_counts, feature_counts, space=None,
+            vocabulary=None):
+        """
+            Computes log-probabilities used in classification from raw counts.
+            Counts of pruned models are counts of `vocabulary` features of
+            the feature `space`.
+        """
+        smoothed = feature_counts + self.alpha
+        totals = smoothed.sum(axis=1).reshape(-1, 1)
+        documents = class_counts.sum() or 1
+        with numpy.errstate(divide='ignore'):
+            class_log_prior = numpy.log(class_counts / float(documents))
+        model = {
+            'classes': list(classes),
+            'class_counts': class_counts,
+            'feature_counts': feature_counts,
+            'class_log_prior': class_log_prior,
+            'feature_log_prob': numpy.log(smoothed) - numpy.log(totals),
+            'space': space or FeatureSpace(dimension=feature_counts.shape[1]),
+        }
+        if vocabulary is not None:
+            model['vocabulary'] = vocabulary
+        return model
+
+    def fit(self, features, labels):
+        """
+            Builds a model of given feature matrix, created in classifier's
+            feature space, with corresponding labels. Features are pruned
+            first, if configured.
+        """
+        vocabulary = self.feature_space.prune(features.document_frequency())
+        if vocabulary is not None:
+            features = features.select_features(vocabulary)
+        class_counts, feature_counts = self.count(features, labels)
+        return self.build_model(
+            classes=self.classes,
+            class_counts=class_counts,
+            feature_counts=feature_counts,
+            space=self.feature_space,
+            vocabulary=vocabulary,
+        )
+
+    def predict_proba(self, features, model=None):
+        """
+            Returns a (number of samples, number of classes) array of label
+            probabilities. Classifier's model is used if none is given.
+        """
+        if model is None:
+            model = self.classifier
+        scores = features.row_sums(model['feature_log_prob'])
+        scores += model['class_log_prior'].reshape(-1, 1)
+        scores = scores.T
+        scores -= scores.max(axis=1).reshape(-1, 1)
+        probabilities = numpy.exp(scores)
+        probabilities /= probabilities.sum(axis=1).reshape(-1, 1)
+        return probabilities
+
+    def analyze(self):
+        """
+            Returns classifier performance stats cross-validated on the
+            training set the classifier was trained on. Features are read from
+            the feature store and the training set is counted once, so
+            evaluation costs less than training.
+        """
+        samples, labels = get_training_data(self.id)
+        if not samples:
+            return identity_analysis()
+
+        self.load_classifier()
+        if self.classifier is None:
+            return identity_analysis()
+
+        features = self.get_model_features(samples)
+        class_counts, feature_counts = self.count(features, labels)
+        analysis = cross_validate(
+            naive_bayes_fold,
+            state={
+                'classifier': self,
+                'features': features,
+                'labels': labels,
+                'class_counts': class_counts,
+                'feature_counts': feature_counts,
+            },
+            labels=labels,
+            classes=self.classes,
+        )
+        return analysis or identity_analysis()
+
+    def count(self, features, labels):
+        """
+            Returns per-class document and feature counts of given feature
+            matrix with corresponding labels.
+            :rtype: A tuple (class_counts, feature_counts)
+        """
+        label_ids = numpy.array(
+            [self.classes.index(label) for label in labels],
+            dtype=numpy.int64,
+        )
+        n_classes = len(self.classes)
+        class_counts = numpy.bincount(label_ids,
+            minlength=n_classes).astype(numpy.float64)
+        flat = label_ids[features.row_ids()] * features.dimension + \
+            features.indices
+        feature_counts = numpy.bincount(
+            flat,
+            minlength=n_classes * features.dimension,
+        ).astype(numpy.float64).reshape(n_classes, features.dimension)
+        return class_counts, feature_counts
+
+    def count_samples(self, sample_labels, model):
+        """
+            Returns per-class document and feature counts of samples given as
+            a dictionary sample id -> label, in the feature space of `model`.
+        """
+        samples = []
+        labels = []
+        for ids_chunk in chunks(sample_labels.keys(), BULK_QUERY_SIZE):
+            for sample in Sample.objects.filter(id__in=ids_chunk):
+                samples.append(sample)
+                labels.append(sample_labels[sample.id])
+        return self.count(self.get_model_features(samples, model), labels)
+
+    def update(self, samples=[], turn_off=True, set_id=0):
+        """
+            Updates classifier with changes between the training set it was
+            trained on and set `set_id`. Samples' counts are added to and
+            subtracted from the model, so only changed samples are processed.
+            Falls back to full training if there is no model to update, or
+            the set changed too much.
+        """
+        entry = ClassifierModel.objects.get(id=self.id)
+        previous_id = entry.parameters.get('training_set')
+        if not set_id or not previous_id:
+            return self.train(samples=samples, turn_off=turn_off,
+                set_id=set_id)
+
+        self.load_classifier()
+        model = self.classifier
+        # Vocabulary of a pruned model is kept until the next training, but
+        # a changed feature space needs training from scratch.
+        if model is None or model['classes'] != self.classes or \
+                model['space'] != self.feature_space:
+            return self.train(samples=samples, turn_off=turn_off,
+                set_id=set_id)
+
+        training_set = TrainingSet.objects.get(id=set_id)
+        try:
+            previous = TrainingSet.objects.get(id=previous_id)
+        except TrainingSet.DoesNotExist:
+            return self.train(samples=samples, turn_off=turn_off,
+                set_id=set_id)
+
+        delta = training_set.delta(previous)
+        changed = len(delta['added']) + len(delta['removed']) + \
+            len(delta['relabelled'])
+        max_delta = setting('CLASSIFIER_UPDATE_MAX_DELTA',
+            DEFAULT_UPDATE_MAX_DELTA)
+        size = training_set.count()
+        if changed > max_delta * size:
+            return self.train(samples=samples, turn_off=turn_off,
+                set_id=set_id)
+
+        job = entry.job
+        if turn_off:
+            job.unset_classifier_trained()
+
+        # Relabelled samples are removed with old labels and added with new
+        # ones.
+        added = dict(delta['added'])
+        removed = dict(delta['removed'])
+        for sample_id, labels in delta['relabelled'].iteritems():
+            removed[sample_id], added[sample_id] = labels
+
+        # Cached model is shared, hence it's not modified in place.
+        class_counts = model['class_counts'].copy()
+        feature_counts = model['feature_counts'].copy()
+        if added:
+            added_classes, added_features = self.count_samples(added, model)
+            class_counts += added_classes
+            feature_counts += added_features
+        if removed:
+            removed_classes, removed_features = self.count_samples(removed,
+                model)
+            class_counts -= removed_classes
+            feature_counts -= removed_features
+
+        entry.parameters['training_set'] = set_id
+        entry.save()
+
+        self.classifier = self.build_model(
+            classes=self.classes,
+            class_counts=class_counts,
+            feature_counts=feature_counts,
+            space=model['space'],
+            vocabulary=model.get('vocabulary'),
+        )
+        self.dump_classifier()
+        self.save_model_stats(entry)
+        job.set_classifier_trained()
+
+    def train(self, samples=[], turn_off=True, set_id=0):
+        """
+            Trains classifier on given TrainingSamples' set.
+        """
+        entry = ClassifierModel.objects.get(id=self.id)
+        job = entry.job
+        if turn_off:
+            job.unset_classifier_trained()
+
+        if set_id:
+            training_set = TrainingSet.objects.get(id=set_id)
+            samples = training_set.get_samples()
+            entry.parameters['training_set'] = set_id
+            entry.save()
+
+        texts = []
+        labels = []
+        for sample in samples:
+            texts.append(sample.sample)
+            labels.append(sample.label)
+
+        if texts:
+            features = self.get_features(texts,
+                dimension=self.feature_space.dimension,
+                ngrams=self.feature_space.ngrams)
+            self.classifier = self.fit(features, labels)
+            self.dump_classifier()
+            self.save_model_stats(entry)
+            job.set_classifier_trained()
+
+    def get_train_status(self):
+        return CLASS_TRAIN_STATUS_DONE
+
+    def get_version(self):
+        """
+            Returns modification time of the model's file, which is replaced
+            whenever the model changes.
+        """
+        try:
+            return int(os.path.getmtime(self.get_file_name()) * 1000)
+        except OSError:
+            return None
+
+    def get_model_stats(self):
+        """
+            Returns number of model's features, size of the space they're
+            hashed into and memory taken by model's arrays.
+        """
+        self.load_classifier()
+        if self.classifier is None:
+            return {}
+
+        return {
+            'features': self.classifier['feature_counts'].shape[1],
+            'dimension': self.classifier['space'].dimension,
+            'memory': self.get_model_size(self.classifier),
+        }
+
+    def get_default_probabilities(self):
+        return dict((label, 0.0) for label in self.classes)
+
+    def _classify(self, class_sample):
+        """
+            Classifies given sample and saves result to the model.
+            Returns a tuple (label, label_probability).
+        """
+        self.load_classifier()
+
+        if self.classifier is None:
+            return None, None
+
+        features = self.get_model_features([class_sample.sample])
+        probabilities = self.predict_proba(features)[0]
+
         label_probability = self.get_default_probabilities()
+        for label, probability in zip(self.classifier['classes'],
+                probabilities):
+            label_probability[label] = round(probability, 3)
+        label = self.classifier['classes'][probabilities.argmax()]
+
+        class_sample.training_set_id = self.get_training_set_id()
+        class_sample.label = label
         class_sample.label_probability = json.dumps(label_probability)
         class_sample.save()
 
+        return label, label_probability
+
+    def classify(self, class_sample):
+        """
+            Classifies given sample and saves result to the model.
+        """
+        label, label_probability = self._classify(class_sample)
         return label
 
+    def classify_with_info(self, class_sample):
+        """
+            Classifies given sample and returns more detailed data - label and
+            all labels' probabilities.
+        """
+        label, label_probability = self._classify(class_sample)
+        if label is None:
+            return None
+
+        return {
+            'label': label,
+            'labels_probability': label_probability,
+        }
+
+    def classify_batch(self, class_samples):
+        """
+            Classifies given samples with a single, vectorized model
+            evaluation and saves results with bulk updates.
+        """
+        self.load_classifier()
+
+        if self.classifier is None:
+            return [None] * len(class_samples)
+
+        features = self.get_model_features(
+            class_sample.sample for class_sample in class_samples)
+        probabilities = self.predict_proba(features)
+        classes = self.classifier['classes']
+        training_set_id = self.get_training_set_id()
+
+        labels = []
+        for class_sample, sample_probabilities in zip(class_samples,
+                probabilities):
+            label_probability = self.get_default_probabilities()
+            for label, probability in zip(classes, sample_probabilities):
+                label_probability[label] = round(probability, 3)
+            label = classes[sample_probabilities.argmax()]
+
+            class_sample.training_set_id = training_set_id
+            class_sample.label = label
+            class_sample.label_probability = label_probability
+            labels.append(label)
+
+        update_classified_samples(class_samples)
+        return labels
+
+
 # Google Storage parameters used in GooglePrediction classifier
 GOOGLE_STORAGE_PREFIX = 'gs'
 GOOGLE_BUCKET_NAME = 'urlannotator'
@@ -494,27 +1486,7 @@ class GooglePredictionClassifier(Classifier):
             return status
         except Exception, e:
             print 'Exception caught', e
-            return {
-                'modelDescription': {
-                    'confusionMatrix': {
-                        LABEL_YES: {
-                            LABEL_YES: 1,
-                            LABEL_NO: 0,
-                            LABEL_BROKEN: 0,
-                        },
-                        LABEL_NO: {
-                            LABEL_YES: 0,
-                            LABEL_NO: 1,
-                            LABEL_BROKEN: 0,
-                        },
-                        LABEL_BROKEN: {
-                            LABEL_YES: 0,
-                            LABEL_NO: 0,
-                            LABEL_BROKEN: 1,
-                        }
-                    }
-                }
-            }
+            return identity_analysis()
 
     def get_train_status(self):
         try:
@@ -562,7 +1534,7 @@ class GooglePredictionClassifier(Classifier):
 
         if set_id:
             training_set = TrainingSet.objects.get(id=set_id)
-            samples = training_set.training_samples.all()
+            samples = training_set.get_samples()
             entry.parameters['training_set'] = set_id
 
         train_set = []
@@ -586,6 +1558,13 @@ class GooglePredictionClassifier(Classifier):
         entry.parameters = json.dumps(params)
         entry.save()
 
+    def update(self, samples=[], turn_off=True, set_id=0):
+        """
+            Prediction API models can't be updated incrementally, hence
+            the classifier is trained from scratch.
+        """
+        return self.train(samples=samples, turn_off=turn_off, set_id=set_id)
+
     def _papi_classify(self, sample):
         """
             Executes Google Prediction API call to classify given sample.
@@ -664,3 +1643,25 @@ class GooglePredictionClassifier(Classifier):
             sample.label_probability = json.dumps(self.get_default_probabilities())
             sample.save()
             return None
+
+    def classify_batch(self, samples):
+        """
+            Classifies given samples and saves results with bulk updates.
+            Google Prediction API has no batch prediction call, so samples are
+            sent one by one over a single API connection.
+        """
+        labels = []
+        classified = []
+        for sample in samples:
+            result = self._papi_classify(sample.sample)
+            if not result:
+                labels.append(None)
+                continue
+
+            sample.label_probability = result['labels_probability']
+            sample.label = result['label']
+            classified.append(sample)
+            labels.append(result['label'])
+
+        update_classified_samples(classified)
+        return labels
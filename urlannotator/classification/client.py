@@ -0,0 +1,98 @@
+import json
+import time
+
+import requests
+
+from urlannotator.tools.utils import setting
+
+import logging
+log = logging.getLogger(__name__)
+
+# Default address of the classification server.
+DEFAULT_SERVER_HOST = '127.0.0.1'
+DEFAULT_SERVER_PORT = 12346
+
+# Default number of seconds to wait for the server's response.
+DEFAULT_SERVER_TIMEOUT = 10
+
+# Number of seconds the server isn't contacted after it's been unreachable.
+UNAVAILABLE_BACKOFF = 30
+
+# Kinds of samples the server classifies.
+SAMPLE_CLASSIFIED = 'classified'
+SAMPLE_BTM = 'btm'
+
+_unavailable_until = [0]
+
+
+class ClassificationServerUnavailable(Exception):
+    """
+        The classification server is disabled, unreachable or failed to handle
+        the request. Callers should classify in-process instead.
+    """
+    pass
+
+
+def get_server_address():
+    return (
+        setting('CLASSIFICATION_SERVER_HOST', DEFAULT_SERVER_HOST),
+        setting('CLASSIFICATION_SERVER_PORT', DEFAULT_SERVER_PORT),
+    )
+
+
+def call_server(path, **params):
+    """
+        Posts JSON-encoded `params` to the classification server's `path`.
+        Returns decoded response.
+    """
+    if not setting('CLASSIFICATION_SERVER_ENABLED', False):
+        raise ClassificationServerUnavailable('Server is disabled.')
+
+    if time.time() < _unavailable_until[0]:
+        raise ClassificationServerUnavailable('Server is unreachable.')
+
+    url = 'http://%s:%d%s' % (get_server_address() + (path, ))
+    try:
+        response = requests.post(
+            url,
+            data=json.dumps(params),
+            timeout=setting('CLASSIFICATION_SERVER_TIMEOUT',
+                DEFAULT_SERVER_TIMEOUT),
+        )
+    except requests.RequestException, e:
+        _unavailable_until[0] = time.time() + UNAVAILABLE_BACKOFF
+        log.warning('Classification server is unreachable: %s.' % e)
+        raise ClassificationServerUnavailable(str(e))
+
+    if response.status_code != 200:
+        raise ClassificationServerUnavailable(
+            'Server responded with %d: %s' % (response.status_code,
+                response.content)
+        )
+    return json.loads(response.content)
+
+
+def remote_classify(job_id, sample_id, kind=SAMPLE_CLASSIFIED):
+    """
+        Classifies sample with the server. Returns sample's label.
+    """
+    return call_server('/classify', job_id=job_id, sample_id=sample_id,
+        kind=kind)['label']
+
+
+def remote_classify_batch(job_id, sample_ids):
+    """
+        Classifies ClassifiedSamples with the server. Returns a list of labels.
+    """
+    return call_server('/classify_batch', job_id=job_id,
+        sample_ids=sample_ids)['labels']
+
+
+def notify_reload(job_id):
+    """
+        Notifies the server that job's classifier has changed.
+    """
+    try:
+        call_server('/reload', job_id=job_id)
+    except ClassificationServerUnavailable:
+        pass
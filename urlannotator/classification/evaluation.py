@@ -0,0 +1,143 @@
+import multiprocessing
+
+import numpy
+
+from urlannotator.main.models import LABEL_YES
+from urlannotator.tools.utils import setting
+
+# Default number of cross-validation folds.
+DEFAULT_CV_FOLDS = 5
+
+# Default number of processes folds are evaluated in. None means one process
+# per CPU.
+DEFAULT_CV_PROCESSES = None
+
+# State of the running evaluation. It's set before pool's workers are forked,
+# so that workers inherit it instead of receiving it pickled.
+_worker_state = {}
+
+
+def make_folds(labels, folds):
+    """
+        Splits rows of `labels` into `folds` stratified folds, spreading
+        samples of every label evenly across them. The split is deterministic.
+
+        :rtype: A list of arrays of row numbers
+    """
+    by_label = {}
+    for row, label in enumerate(labels):
+        by_label.setdefault(label, []).append(row)
+
+    assignment = numpy.zeros(len(labels), dtype=numpy.int64)
+    offset = 0
+    for label in sorted(by_label):
+        rows = by_label[label]
+        assignment[rows] = (numpy.arange(len(rows)) + offset) % folds
+        offset += len(rows)
+    return [numpy.flatnonzero(assignment == fold) for fold in xrange(folds)]
+
+
+def confusion_matrix(labels, predicted, classes):
+    """
+        Returns a dictionary true label -> predicted label -> count.
+    """
+    matrix = dict((label, dict((other, 0) for other in classes))
+        for label in classes)
+    for label, prediction in zip(labels, predicted):
+        matrix[label][prediction] += 1
+    return matrix
+
+
+def roc_auc(labels, scores, positive=LABEL_YES):
+    """
+        Returns the area under the ROC curve of `scores` given to samples with
+        true `labels`, computed as the Mann-Whitney statistic. Tied scores get
+        their average rank. Returns None if either class is missing.
+    """
+    is_positive = numpy.array([label == positive for label in labels],
+        dtype=bool)
+    positives = is_positive.sum()
+    negatives = len(is_positive) - positives
+    if not positives or not negatives:
+        return None
+
+    scores = numpy.asarray(scores, dtype=numpy.float64)
+    order = numpy.argsort(scores, kind='mergesort')
+    ordered = scores[order]
+    starts = numpy.concatenate(
+        ([0], numpy.flatnonzero(numpy.diff(ordered)) + 1))
+    ends = numpy.concatenate((starts[1:], [len(scores)]))
+    ranks = numpy.empty(len(scores))
+    ranks[order] = numpy.repeat((starts + ends + 1) / 2.0, ends - starts)
+
+    positive_ranks = ranks[is_positive].sum()
+    return float((positive_ranks - positives * (positives + 1) / 2.0) /
+        (positives * negatives))
+
+
+def _evaluate_fold(rows):
+    return _worker_state['function'](_worker_state['state'], rows)
+
+
+def cross_validate(fold_function, state, labels, classes, folds=None,
+        processes=None, positive=LABEL_YES, holdout=False):
+    """
+        Runs k-fold cross-validation of samples with given `labels`.
+
+        `fold_function(state, rows)` has to return a (len(rows), len(classes))
+        array of probabilities of `rows` predicted by a model built on all
+        other rows. It's called in pool's workers, which share `state` with
+        this process.
+
+        With `holdout` only the first fold is predicted, by a single model,
+        for classifiers whose training is too expensive to repeat per fold.
+
+        Returns classifier performance stats in the format of
+        `Classifier.analyze`, or None if there are too few samples.
+    """
+    folds = min(folds or setting('CLASSIFIER_CV_FOLDS', DEFAULT_CV_FOLDS),
+        len(labels))
+    if folds < 2:
+        return None
+
+    fold_rows = make_folds(labels, folds)
+    if holdout:
+        fold_rows = fold_rows[:1]
+
+    processes = processes or setting('CLASSIFIER_CV_PROCESSES',
+        DEFAULT_CV_PROCESSES) or multiprocessing.cpu_count()
+    processes = min(processes, len(fold_rows))
+    # Daemonic processes (e.g. some task workers) can't have children.
+    if multiprocessing.current_process().daemon:
+        processes = 1
+
+    _worker_state.update(function=fold_function, state=state)
+    try:
+        if processes > 1:
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(_evaluate_fold, fold_rows)
+            finally:
+                pool.terminate()
+        else:
+            results = map(_evaluate_fold, fold_rows)
+    finally:
+        _worker_state.clear()
+
+    rows = numpy.concatenate(fold_rows)
+    probabilities = numpy.concatenate(results)
+    labels = [labels[row] for row in rows]
+    predicted = [classes[idx] for idx in probabilities.argmax(axis=1)]
+
+    description = {
+        'confusionMatrix': confusion_matrix(labels, predicted, classes),
+        'folds': folds,
+    }
+    if holdout:
+        description['holdout'] = len(rows)
+    if positive in classes:
+        auc = roc_auc(labels, probabilities[:, classes.index(positive)],
+            positive=positive)
+        if auc is not None:
+            description['rocAuc'] = auc
+    return {'modelDescription': description}
@@ -1,3 +1,6 @@
+import datetime
+import json
+import time
 from itertools import ifilter, imap
 from multiprocessing.pool import Process
 
@@ -5,20 +8,31 @@ from celery import task, Task, registry
 from celery.task import current
 from django.conf import settings
 from django.db.models import Count
+from django.utils.timezone import now
 
 from urlannotator.flow_control import send_event
 from urlannotator.classification.models import (TrainingSet, ClassifiedSample,
-    TrainingSample)
+    Classifier as ClassifierModel, TrainingRequest, Reclassification,
+    RECLASSIFICATION_RUNNING)
 from urlannotator.classification.factories import classifier_factory
+from urlannotator.classification.classifiers import ClassifierLocked
+from urlannotator.classification.results import (get_cached_result,
+    cache_result)
+from urlannotator.classification.selection import get_selection_strategy
+from urlannotator.classification.client import (remote_classify,
+    remote_classify_batch, ClassificationServerUnavailable, SAMPLE_CLASSIFIED,
+    SAMPLE_BTM)
 from urlannotator.crowdsourcing.models import (TagasaurisJobs,
     BeatTheMachineSample)
 from urlannotator.crowdsourcing.tagasauris_helper import (make_tagapi_client,
     get_hit)
 from urlannotator.crowdsourcing.factories import quality_factory
 from urlannotator.crowdsourcing.job_handlers import get_job_handler
+from urlannotator.statistics import stat_extraction
 from urlannotator.main.models import (Sample, Job, LABEL_BROKEN,
     JOB_STATUS_ACTIVE)
 from urlannotator.tools.synchronization import singleton
+from urlannotator.tools.utils import setting
 
 import logging
 log = logging.getLogger(__name__)
@@ -27,6 +41,38 @@ log = logging.getLogger(__name__)
 # while uploading loads of medias.
 VOTING_MAX_SAMPLES = 100
 
+# Default number of seconds classification tasks wait for a classifier switch
+# before they are rescheduled.
+DEFAULT_CLASSIFY_LOCK_TIMEOUT = 5
+
+# Default number of seconds after which classification tasks that gave up
+# waiting for a switch are retried.
+DEFAULT_CLASSIFY_LOCKED_COUNTDOWN = 30
+
+# Number of pending classification requests classified at once.
+CLASSIFY_BATCH_SIZE = 500
+
+# Default number of seconds after which pending classification requests are
+# picked up by the periodic sweep. Newer ones are classified by the
+# EventClassifyPending sent along with them.
+DEFAULT_CLASSIFY_SWEEP_AGE = 120
+
+# Name of the singleton classifying a job's pending requests.
+CLASSIFY_PENDING_JOB_SINGLETON = 'classify-pending-%d'
+
+# Number of job's samples reclassified at once after a model switch.
+RECLASSIFY_CHUNK_SIZE = 500
+
+# Reclassification runs that haven't advanced for this long are resumed.
+RECLASSIFY_STALL_TIMEOUT = datetime.timedelta(minutes=10)
+
+# Training schedulers breakdown:
+# TRAINING_SCHEDULER_POOL - training sets are queued for the training pool
+#                           (`./manage.py training_pool`),
+# TRAINING_SCHEDULER_PROCESS - every training set is trained in a new process.
+TRAINING_SCHEDULER_POOL = 'pool'
+TRAINING_SCHEDULER_PROCESS = 'process'
+
 
 @task(ignore_result=True)
 class SampleVotingManager(Task):
@@ -36,14 +82,15 @@ class SampleVotingManager(Task):
 
     def get_unmapped_samples(self):
         """ New Samples since last update. We should send those to external
-            voting service. Samples are sorted by job, so we can use an
-            iterator and save loads of memory.
+            voting service. Samples are picked by configured selection
+            strategy and sorted by job, so they can be grouped by `get_jobs`.
         """
         samples = Sample.objects.select_related('job').filter(
             vote_sample=True, samplemapping=None,
             job__status=JOB_STATUS_ACTIVE,
             job__tagasaurisjobs__isnull=False).exclude(screenshot='')
-        return samples.order_by('job')[:VOTING_MAX_SAMPLES].iterator()
+        selected = get_selection_strategy().select(samples, VOTING_MAX_SAMPLES)
+        return sorted(selected, key=lambda sample: (sample.job_id, sample.id))
 
     def get_jobs(self, all_samples):
         """ Auxiliary function for divide samples in job related groups and
@@ -234,42 +281,30 @@ class ProcessVotesManager(Task):
         for job in active_jobs:
             quality_algorithm = quality_factory.create_algorithm(job)
             decisions = quality_algorithm.extract_decisions()
-            ts = TrainingSet.objects.create(job=job)
-            can_train = False
+            labels = {}
             if decisions:
                 log.info(
                     'ProcessVotesManager: Creating training set for job %d.' % job.id
                 )
 
                 dict_decisions = dict(decisions)
-                samples = Sample.objects.filter(id__in=imap(lambda x: x[0],
+                sample_ids = Sample.objects.filter(id__in=imap(lambda x: x[0],
                     ifilter(
                         lambda x: x[1] != LABEL_BROKEN, decisions
-                    )), training=True).defer('id')
+                    )), training=True).values_list('id', flat=True)
 
-                for sample in samples:
-                    TrainingSample.objects.create(
-                        set=ts,
-                        sample=sample,
-                        label=dict_decisions[sample.id],
-                    )
-                    can_train = True
-
-                for sample in Sample.objects.\
-                        filter(job=job, goldsample__isnull=False).\
-                        select_related('goldsample').iterator():
-                    ts_sample, created = TrainingSample.objects.get_or_create(
-                        set=ts,
-                        sample=sample,
-                    )
-                    can_train = True
+                for sample_id in sample_ids:
+                    labels[sample_id] = dict_decisions[sample_id]
 
-                    if not created:
+                gold_samples = Sample.objects.\
+                    filter(job=job, goldsample__isnull=False).\
+                    values_list('id', 'goldsample__label')
+                for sample_id, label in gold_samples:
+                    if sample_id in labels:
                         log.info(
-                            'ProcessVotesManager: Overridden gold sample %d.' % sample.id
+                            'ProcessVotesManager: Overridden gold sample %d.' % sample_id
                         )
-                    ts_sample.label = sample.goldsample.label
-                    ts_sample.save()
+                    labels[sample_id] = label
 
             decisions = quality_algorithm.extract_btm_decisions()
             if decisions:
@@ -289,21 +324,17 @@ class ProcessVotesManager(Task):
                     btms.recalculate_human(label)
 
                     if btms.sample.training:
-                        can_train = True
-                        TrainingSample.objects.create(
-                            set=ts,
-                            sample=btms.sample,
-                            label=label,
-                        )
+                        labels[btms.sample_id] = label
 
-            if can_train:
+            # New training set stores only changes since the previous one.
+            if labels:
+                ts = TrainingSet.objects.create_revision(job=job,
+                    labels=labels)
                 send_event(
                     'EventTrainingSetCompleted',
                     set_id=ts.id,
                     job_id=job.id,
                 )
-            else:
-                ts.delete()
 
 process_votes = registry.tasks[ProcessVotesManager.name]
 
@@ -323,8 +354,9 @@ def update_classified_sample(sample_id, *args, **kwargs):
         url=sample.url,
         sample=sample,
         label=''
-    )
-    for class_sample in classified:
+    ).order_by('id')
+    # Classification of the first request gives result to all of them.
+    for class_sample in classified[:1]:
         send_event("EventNewClassifySample",
             sample_id=class_sample.id,
             from_name='update_classified')
@@ -382,21 +414,22 @@ def train(set_id):
 
     classifier = classifier_factory.create_classifier(job.id)
 
-    samples = (training_sample
-        for training_sample in training_set.training_samples.all())
-
-    classifier.train(samples, set_id=set_id)
+    # Classifiers supporting it are updated with changes since their last
+    # training set instead of being trained from scratch. Samples are read
+    # from the set by the classifier.
+    switched = classifier.update(set_id=set_id)
+    if switched is False:
+        # Training is still running. FinishTrainingManager will announce it.
+        return
 
     job = Job.objects.get(id=job.id)
     if job.is_classifier_trained():
+        # Samples are reclassified with the new model on this event.
         send_event(
             "EventClassifierTrained",
             job_id=job.id,
         )
 
-        # Reclassify samples using new classifier
-        # job.reclassify_samples()
-
 
 @task(ignore_result=True)
 def train_on_set(set_id, *args, **kwargs):
@@ -410,10 +443,187 @@ def train_on_set(set_id, *args, **kwargs):
     if not job.is_classifier_created():
         train_on_set.retry(countdown=30)
 
+    scheduler = setting('TRAINING_SCHEDULER', TRAINING_SCHEDULER_POOL)
+    if scheduler == TRAINING_SCHEDULER_POOL:
+        TrainingRequest.objects.enqueue(training_set)
+        return
+
     process_execute(target=prepare_func,
         kwargs={'func': train, 'set_id': set_id})
 
 
+def create_task_classifier(job):
+    """
+        Returns job's classifier that gives up waiting for a switch after
+        CLASSIFY_LOCK_TIMEOUT seconds, so that the task doesn't keep its
+        worker busy.
+    """
+    classifier = classifier_factory.create_classifier(job.id)
+    classifier.lock_timeout = setting('CLASSIFY_LOCK_TIMEOUT',
+        DEFAULT_CLASSIFY_LOCK_TIMEOUT)
+    return classifier
+
+
+def retry_locked(kind, sample_id):
+    """
+        Reschedules the current classification task, whose classifier is
+        being switched.
+    """
+    log.info('[%s] Classifier is being switched, sample %d rescheduled.'
+        % (kind, sample_id))
+    current.retry(
+        countdown=setting('CLASSIFY_LOCKED_COUNTDOWN',
+            DEFAULT_CLASSIFY_LOCKED_COUNTDOWN),
+        max_retries=None,
+    )
+
+
+def classify_sample(job, sample, kind=SAMPLE_CLASSIFIED, classifier=None):
+    """
+        Classifies given sample with the classification server, or in-process
+        if the server is unavailable. Returns sample's label.
+    """
+    try:
+        return remote_classify(job.id, sample.id, kind=kind)
+    except ClassificationServerUnavailable:
+        if classifier is None:
+            classifier = classifier_factory.create_classifier(job.id)
+        return classifier.classify(sample)
+
+
+def classify_samples(job, class_samples, classifier=None):
+    """
+        Classifies given ClassifiedSamples at once with the classification
+        server, or in-process if the server is unavailable. Returns a list of
+        labels.
+    """
+    try:
+        return remote_classify_batch(job.id,
+            [class_sample.id for class_sample in class_samples])
+    except ClassificationServerUnavailable:
+        if classifier is None:
+            classifier = classifier_factory.create_classifier(job.id)
+        return classifier.classify_batch(class_samples)
+
+
+def reclassify_chunk(job, samples, classifier=None):
+    """
+        Reclassifies the newest classification of every given sample, which
+        is the one the sample's label is read from. Samples that haven't been
+        classified are skipped. Returns number of reclassified samples.
+    """
+    samples = dict((sample.id, sample) for sample in samples)
+    newest = {}
+    classified = ClassifiedSample.objects.filter(job=job,
+        sample__id__in=samples.keys()).exclude(label='').order_by('id')
+    for class_sample in classified:
+        class_sample.sample = samples[class_sample.sample_id]
+        newest[class_sample.sample_id] = class_sample
+
+    if not newest:
+        return 0
+
+    class_samples = [newest[sample_id] for sample_id in sorted(newest)]
+    labels = classify_samples(job, class_samples, classifier)
+    return len([label for label in labels if label is not None])
+
+
+@task(ignore_result=True)
+def reclassify(job_id, version=None, *args, **kwargs):
+    """
+        Reclassifies job's samples with its current classifier, in chunks of
+        RECLASSIFY_CHUNK_SIZE samples. Without `version` a new run is started,
+        which cancels the one in progress. Otherwise run `version` is resumed
+        after its last reclassified sample, unless it's been superseded.
+    """
+    job = Job.objects.get(id=job_id)
+    if version is None:
+        run = Reclassification.objects.start(job)
+    else:
+        run = Reclassification.objects.get(job=job)
+        if run.version != version or run.status != RECLASSIFICATION_RUNNING:
+            return
+
+    classifier = classifier_factory.create_classifier(job.id)
+    started = time.time()
+    processed = 0
+    while run.is_current():
+        samples = list(Sample.objects.filter(job=job,
+            id__gt=run.last_sample).order_by('id')[:RECLASSIFY_CHUNK_SIZE])
+        if not samples:
+            break
+
+        count = reclassify_chunk(job, samples, classifier)
+        processed += count
+        if not run.advance(samples[-1].id, count):
+            break
+
+    if not run.finish():
+        log.info(
+            'Reclassification of job %d cancelled by a newer model.' % job.id
+        )
+        return
+
+    elapsed = time.time() - started
+    log.info(
+        'Reclassified %d samples of job %d in %.1fs (%d samples/min).'
+        % (processed, job.id, elapsed, processed * 60 / (elapsed or 1))
+    )
+
+
+@task(ignore_result=True)
+class ResumeReclassificationManager(Task):
+    """
+        Task periodically executed to resume reclassifications interrupted
+        (e.g. by a worker's restart) before they've finished.
+    """
+
+    @singleton(name='resume-reclassification')
+    def run(self, *args, **kwargs):
+        since = now() - RECLASSIFY_STALL_TIMEOUT
+        for run in Reclassification.objects.stalled(since):
+            log.warning(
+                'ResumeReclassificationManager: Resuming job %d after sample '
+                '%d.' % (run.job_id, run.last_sample)
+            )
+            reclassify.apply_async(
+                kwargs={'job_id': run.job_id, 'version': run.version},
+                queue=settings.CELERY_LONGSCARCE_QUEUE,
+            )
+
+resume_reclassification = registry.tasks[ResumeReclassificationManager.name]
+
+
+@task(ignore_result=True)
+class FinishTrainingManager(Task):
+    """
+        Task periodically executed to make Classifier247 switches left pending
+        until their subclassifier's (remote) training finishes. Classifiers
+        locked by a training are skipped until the next run.
+    """
+
+    @singleton(name='finish-training')
+    def run(self, job_id=None, *args, **kwargs):
+        entries = ClassifierModel.objects.filter(type='Classifier247',
+            parameters__contains='pending_set')
+        if job_id is not None:
+            entries = entries.filter(job__id=job_id)
+
+        for entry in entries:
+            classifier = classifier_factory.create_classifier_from_id(entry.id)
+            if classifier.finish_training():
+                log.info(
+                    'FinishTrainingManager: Classifier of job %d trained.'
+                    % entry.job_id
+                )
+                send_event(
+                    "EventClassifierTrained",
+                    job_id=entry.job_id,
+                )
+
+finish_training = registry.tasks[FinishTrainingManager.name]
+
+
 @task(ignore_result=True)
 def classify(sample_id, from_name='', *args, **kwargs):
     """
@@ -430,26 +640,49 @@ def classify(sample_id, from_name='', *args, **kwargs):
     if not job.is_classifier_trained():
         return
 
-    classifier = classifier_factory.create_classifier(job.id)
-    label = classifier.classify(class_sample)
+    # Version is read before classification, so that a result of a newer
+    # model is never cached as the older one's.
+    classifier = create_task_classifier(job)
+    version = classifier.get_version()
+    text = class_sample.sample.text
+    result = get_cached_result(job.id, version, text)
+    if result is not None:
+        label, label_probability = result
+    else:
+        try:
+            label = classify_sample(job, class_sample, classifier=classifier)
+        except ClassifierLocked:
+            retry_locked('Classification', class_sample.id)
+
+        if label is None:
+            # Something went wrong
+            log.warning(
+                '[Classification] Got None label for sample %d. Retrying.' % class_sample.id
+            )
+            current.retry(
+                countdown=min(60 * 2 ** (current.request.retries % 6), 60 * 60 * 1),
+                max_retries=None,
+            )
+        label_probability = ClassifiedSample.objects.get(
+            id=sample_id).label_probability
+        cache_result(job.id, version, text, label, label_probability)
+
+    # Pending requests for the same sample share the result.
+    class_ids = set(ClassifiedSample.objects.filter(job=job,
+        sample=class_sample.sample, label='').values_list('id', flat=True))
+    class_ids.add(class_sample.id)
+    ClassifiedSample.objects.filter(id__in=class_ids).update(
+        label=label,
+        label_probability=json.dumps(label_probability),
+    )
 
-    if label is None:
-        # Something went wrong
-        log.warning(
-            '[Classification] Got None label for sample %d. Retrying.' % class_sample.id
-        )
-        current.retry(
-            countdown=min(60 * 2 ** (current.request.retries % 6), 60 * 60 * 1),
-            max_retries=None,
+    for class_id in sorted(class_ids):
+        send_event(
+            'EventSampleClassified',
+            job_id=job.id,
+            class_id=class_id,
+            sample_id=class_sample.sample.id,
         )
-    ClassifiedSample.objects.filter(id=sample_id).update(label=label)
-
-    send_event(
-        'EventSampleClassified',
-        job_id=job.id,
-        class_id=class_sample.id,
-        sample_id=class_sample.sample.id,
-    )
 
 
 @task(ignore_result=True)
@@ -471,8 +704,12 @@ def classify_btm(sample_id, from_name='', *args, **kwargs):
         current.retry(countdown=min(60 * 2 ** current.request.retries,
             60 * 60 * 24))
 
-    classifier = classifier_factory.create_classifier(job.id)
-    label = classifier.classify(btm_sample)
+    try:
+        label = classify_sample(job, btm_sample, kind=SAMPLE_BTM,
+            classifier=create_task_classifier(job))
+    except ClassifierLocked:
+        retry_locked('BTMClassification', btm_sample.id)
+
     if label is None:
         # Something went wrong
         log.warning(
@@ -483,6 +720,8 @@ def classify_btm(sample_id, from_name='', *args, **kwargs):
             60 * 60 * 24))
 
     BeatTheMachineSample.objects.filter(id=sample_id).update(label=label)
+    # Classification results might have been saved by the server.
+    btm_sample = BeatTheMachineSample.objects.get(id=sample_id)
     btm_sample.updateBTMStatus()
 
     send_event(
@@ -493,9 +732,119 @@ def classify_btm(sample_id, from_name='', *args, **kwargs):
     )
 
 
-@task
+@task(ignore_result=True)
+class ClassifyPendingManager(Task):
+    """
+        Classifies pending classification requests of a job in batches, on
+        EventClassifyPending sent by bulk submissions. Job's classifier is
+        created and its model loaded once per batch, instead of once per
+        sample.
+
+        Executed periodically without a job as a fallback, classifying
+        requests pending for longer than CLASSIFY_SWEEP_AGE seconds.
+    """
+
+    def get_pending_samples(self, job_id=None, before=None):
+        """
+            Classification requests that have their sample created, but
+            haven't been classified yet.
+        """
+        samples = ClassifiedSample.objects.filter(label='',
+            sample__isnull=False)
+        if job_id is not None:
+            samples = samples.filter(job__id=job_id)
+        if before is not None:
+            samples = samples.filter(added_on__lt=before)
+        return samples
+
+    def classify_job(self, job):
+        """
+            Drains job's pending samples in batches of CLASSIFY_BATCH_SIZE.
+        """
+        classifier = classifier_factory.create_classifier(job.id)
+        version = classifier.get_version()
+        pending = self.get_pending_samples(job.id).select_related('sample')
+
+        last_id = 0
+        while True:
+            batch = list(pending.filter(id__gt=last_id).order_by('id')
+                [:CLASSIFY_BATCH_SIZE])
+            if not batch:
+                break
+
+            last_id = batch[-1].id
+            labels = classifier.classify_batch(batch)
+            log.info(
+                'ClassifyPendingManager: Classified %d samples of job %d.'
+                % (len(filter(None, labels)), job.id)
+            )
+
+            for class_sample, label in zip(batch, labels):
+                if label is None:
+                    continue
+
+                cache_result(job.id, version, class_sample.sample.text, label,
+                    class_sample.label_probability)
+                send_event(
+                    'EventSampleClassified',
+                    job_id=job.id,
+                    class_id=class_sample.id,
+                    sample_id=class_sample.sample_id,
+                )
+
+    def classify_jobs(self, job_ids):
+        for job in Job.objects.filter(id__in=job_ids).iterator():
+            # Untrained classifier - samples will be classified on the next run
+            if not job.is_classifier_trained():
+                continue
+
+            # A job's samples are classified by one task at a time. Samples
+            # added after its last batch are left for the sweep.
+            classify_job = singleton(
+                name=CLASSIFY_PENDING_JOB_SINGLETON % job.id)(self.classify_job)
+            try:
+                classify_job(job)
+            except Exception, e:
+                log.exception(
+                    'ClassifyPendingManager: Error in job %d: %s.' % (job.id, e)
+                )
+
+    @singleton(name='classify-pending')
+    def sweep(self):
+        before = now() - datetime.timedelta(seconds=setting(
+            'CLASSIFY_SWEEP_AGE', DEFAULT_CLASSIFY_SWEEP_AGE))
+        self.classify_jobs(set(self.get_pending_samples(before=before)
+            .values_list('job', flat=True)))
+
+    def run(self, job_id=None, *args, **kwargs):
+        """ Main task function.
+        """
+        if job_id is None:
+            self.sweep()
+        else:
+            self.classify_jobs([job_id])
+
+classify_pending = registry.tasks[ClassifyPendingManager.name]
+
+
+@task(ignore_result=True)
 def update_classifier_stats(job_id, *args, **kwargs):
-    pass
+    """
+        Evaluates job's newly switched classifier and stores its performance
+        stats. Runs outside of classifier's locks, so that evaluation doesn't
+        delay switches or classification.
+    """
+    job = Job.objects.get(id=job_id)
+    classifier = classifier_factory.create_classifier(job.id)
+    try:
+        stat_extraction.update_classifier_stats(classifier, job)
+    except Exception, e:
+        # If we fail during updating classifier stats - log it.
+        send_event(
+            "EventClassifierCriticalTrainError",
+            job_id=job.id,
+            message=e.message,
+        )
 
 
 FLOW_DEFINITIONS = [
@@ -505,8 +854,10 @@ FLOW_DEFINITIONS = [
     (r'^EventProcessVotes$', process_votes, settings.CELERY_LONGSCARCE_QUEUE),
     (r'^EventNewClassifySample$', classify),
     (r'^EventNewClassifyBTMSample$', classify_btm),
+    (r'^EventClassifyPending$', classify_pending, settings.CELERY_LONGSCARCE_QUEUE),
     (r'^EventTrainingSetCompleted$', train_on_set, settings.CELERY_LONGSCARCE_QUEUE),
-    (r'^EventClassifierTrained$', update_classifier_stats),
+    (r'^EventClassifierTrained$', update_classifier_stats, settings.CELERY_LONGSCARCE_QUEUE),
+    (r'^EventClassifierTrained$', reclassify, settings.CELERY_LONGSCARCE_QUEUE),
     (r'^EventSampleGatheringHITChanged$', sample_gathering_hit_change, settings.CELERY_LONGSCARCE_QUEUE),
     (r'^EventVotingHITChanged$', voting_hit_change, settings.CELERY_LONGSCARCE_QUEUE),
     (r'^EventBTMGatheringHITChanged$', btm_gathering_hit_change, settings.CELERY_LONGSCARCE_QUEUE),
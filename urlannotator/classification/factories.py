@@ -5,7 +5,9 @@ from django.conf import settings
 from urlannotator.classification.models import Classifier
 from urlannotator.main.models import Job, LABEL_YES, LABEL_NO, LABEL_BROKEN
 from urlannotator.classification.classifiers import (SimpleClassifier,
-    GooglePredictionClassifier, Classifier247)
+    GooglePredictionClassifier, Classifier247, NaiveBayesClassifier)
+from urlannotator.classification.features import HASHING_DIMENSION
+from urlannotator.tools.utils import setting
 
 classifier_factory = None
 
@@ -19,6 +21,17 @@ def SimpleClassifier_init(entry, prefix, job, *args, **kwargs):
     params = {
         'model': '%sprefix-simple-%d' % (prefix, job.id),
         'training_set': 0,
+        'features': setting('CLASSIFIER_FEATURES', {}),
+    }
+    entry.parameters = json.dumps(params)
+
+
+def NaiveBayesClassifier_init(entry, prefix, job, *args, **kwargs):
+    entry.type = 'NaiveBayesClassifier'
+    params = {
+        'model': '%sbayes-%d' % (prefix, job.id),
+        'training_set': 0,
+        'features': setting('CLASSIFIER_FEATURES', {}),
     }
     entry.parameters = json.dumps(params)
 
@@ -65,6 +78,7 @@ def Classifier247_init(entry, prefix, job, *args, **kwargs):
 # Contains mapping Classifier_name -> initialization_function.
 classifier_inits = {
     'SimpleClassifier': SimpleClassifier_init,
+    'NaiveBayesClassifier': NaiveBayesClassifier_init,
     'GooglePredictionClassifier': GooglePredictionClassifier_init,
     'Classifier247': Classifier247_init,
 }
@@ -77,6 +91,24 @@ def SimpleClassifer_ctor(job, entry, *args, **kwargs):
     )
     classifier.model = entry.parameters['model']
     classifier.id = entry.id
+    classifier.feature_space = classifier.feature_space.configure(
+        entry.parameters.get('features'))
+
+    return classifier
+
+
+def NaiveBayesClassifier_ctor(job, entry, *args, **kwargs):
+    classifier = NaiveBayesClassifier(
+        job.description,
+        [LABEL_YES, LABEL_NO, LABEL_BROKEN],
+    )
+    classifier.model = entry.parameters['model']
+    classifier.id = entry.id
+    classifier.feature_space = classifier.feature_space.configure(
+        entry.parameters.get('features'))
+    # Naive Bayes works on hashed features only.
+    if not classifier.feature_space.dimension:
+        classifier.feature_space.dimension = HASHING_DIMENSION
 
     return classifier
 
@@ -93,21 +125,10 @@ def GooglePredictionClassifer_ctor(job, entry, *args, **kwargs):
 
 
 def Classifier247_ctor(entry, factory, *args, **kwargs):
-    entry_reader = entry.parameters['reader']
-    entry_writer = entry.parameters['writer']
-
-    # First, create subclassfiers.
-    classifier_r = classifier_factory.create_classifier_from_id(
-        class_id=entry_reader,
-        *args, **kwargs
-    )
-    classifier_w = classifier_factory.create_classifier_from_id(
-        class_id=entry_writer,
-        *args, **kwargs
-    )
+    # Subclassifiers are resolved lazily, and cached, by the classifier.
     classifier = Classifier247(
-        reader_instance=classifier_r,
-        writer_instance=classifier_w,
+        reader_instance=None,
+        writer_instance=None,
         entry_id=entry.id,
         factory=factory,
     )
@@ -117,6 +138,7 @@ def Classifier247_ctor(entry, factory, *args, **kwargs):
 # Contains mapping Classifier_name -> constructor_function.
 classifier_ctors = {
     'SimpleClassifier': SimpleClassifer_ctor,
+    'NaiveBayesClassifier': NaiveBayesClassifier_ctor,
     'GooglePredictionClassifier': GooglePredictionClassifer_ctor,
     'Classifier247': Classifier247_ctor,
 }
@@ -0,0 +1,341 @@
+import re
+import zlib
+import hashlib
+
+import nltk
+import numpy
+from django.db import IntegrityError
+
+from urlannotator.classification.models import SampleFeatures, BULK_QUERY_SIZE
+from urlannotator.tools.utils import chunks, savepoint
+
+# Default number of buckets words are hashed into.
+HASHING_DIMENSION = 2 ** 18
+
+# Maximum number of word -> bucket mappings memoized in process's scope.
+HASH_CACHE_SIZE = 500000
+
+# Separator of words joined into an n-gram feature.
+NGRAM_SEPARATOR = '|'
+
+_token_re = re.compile(r'\w+', re.UNICODE)
+_hash_cache = {}
+
+
+def tokenize(text):
+    """
+        Splits given text into a list of lowercase words.
+    """
+    if not text:
+        return []
+    return _token_re.findall(text.lower())
+
+
+def make_ngrams(words, ngrams):
+    """
+        Returns given words followed by their n-grams of length up to
+        `ngrams`.
+    """
+    features = list(words)
+    for size in xrange(2, ngrams + 1):
+        features.extend(
+            NGRAM_SEPARATOR.join(words[idx:idx + size])
+            for idx in xrange(len(words) - size + 1)
+        )
+    return features
+
+
+def text_hash(text):
+    """
+        Returns hex digest of text's SHA1 hash.
+    """
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return hashlib.sha1(text).hexdigest()
+
+
+def hash_token(token):
+    """
+        Returns a stable (across processes and hosts) 32-bit hash of `token`.
+    """
+    value = _hash_cache.get(token)
+    if value is None:
+        if isinstance(token, unicode):
+            value = zlib.crc32(token.encode('utf-8')) & 0xffffffff
+        else:
+            value = zlib.crc32(token) & 0xffffffff
+
+        if len(_hash_cache) >= HASH_CACHE_SIZE:
+            _hash_cache.clear()
+        _hash_cache[token] = value
+    return value
+
+
+def hash_tokens(tokens, dimension=HASHING_DIMENSION):
+    """
+        Returns sorted, unique feature indexes of given tokens hashed into
+        `dimension` buckets.
+    """
+    hashes = numpy.fromiter(
+        (hash_token(token) for token in set(tokens)),
+        dtype=numpy.uint32,
+    )
+    return numpy.unique(hashes % dimension)
+
+
+class HashedFeatureMatrix(object):
+    """
+        Binary sparse document-feature matrix stored in CSR layout. Row `i`
+        features are `indices[indptr[i]:indptr[i + 1]]`.
+    """
+    def __init__(self, indptr, indices, dimension):
+        self.indptr = indptr
+        self.indices = indices
+        self.dimension = dimension
+
+    @classmethod
+    def from_token_lists(cls, token_lists, dimension=HASHING_DIMENSION):
+        """
+            Builds the matrix from an iterable of token lists.
+        """
+        rows = [hash_tokens(tokens, dimension) for tokens in token_lists]
+        indptr = numpy.zeros(len(rows) + 1, dtype=numpy.int64)
+        if rows:
+            numpy.cumsum([len(row) for row in rows], out=indptr[1:])
+            indices = numpy.concatenate(rows).astype(numpy.int64)
+        else:
+            indices = numpy.zeros(0, dtype=numpy.int64)
+        return cls(indptr=indptr, indices=indices, dimension=dimension)
+
+    @classmethod
+    def from_texts(cls, texts, dimension=HASHING_DIMENSION):
+        """
+            Builds the matrix from an iterable of raw texts.
+        """
+        return cls.from_token_lists(
+            (tokenize(text) for text in texts),
+            dimension=dimension,
+        )
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def row_ids(self):
+        """
+            Returns row number of every stored feature.
+        """
+        return numpy.repeat(
+            numpy.arange(len(self), dtype=numpy.int64),
+            numpy.diff(self.indptr),
+        )
+
+    def take_rows(self, rows):
+        """
+            Returns a new matrix consisting of given `rows`.
+        """
+        starts = self.indptr[rows]
+        ends = self.indptr[numpy.asarray(rows) + 1]
+        indptr = numpy.zeros(len(starts) + 1, dtype=numpy.int64)
+        numpy.cumsum(ends - starts, out=indptr[1:])
+        if len(starts):
+            indices = numpy.concatenate(
+                [self.indices[s:e] for s, e in zip(starts, ends)]
+            )
+        else:
+            indices = numpy.zeros(0, dtype=numpy.int64)
+        return HashedFeatureMatrix(indptr=indptr, indices=indices,
+            dimension=self.dimension)
+
+    def document_frequency(self):
+        """
+            Returns number of rows every feature occurs in.
+        """
+        return numpy.bincount(self.indices, minlength=self.dimension)
+
+    def select_features(self, vocabulary):
+        """
+            Returns a new matrix consisting of features given as a sorted
+            array `vocabulary`. Feature `vocabulary[i]` becomes feature `i`,
+            other features are dropped.
+        """
+        vocabulary = numpy.asarray(vocabulary, dtype=numpy.int64)
+        positions = numpy.searchsorted(vocabulary, self.indices)
+        kept = positions < len(vocabulary)
+        kept[kept] = vocabulary[positions[kept]] == self.indices[kept]
+
+        cumulative = numpy.zeros(len(kept) + 1, dtype=numpy.int64)
+        numpy.cumsum(kept, out=cumulative[1:])
+        return HashedFeatureMatrix(indptr=cumulative[self.indptr],
+            indices=positions[kept], dimension=len(vocabulary))
+
+    def row_sums(self, weights):
+        """
+            For every row, sums up `weights` (a 2D array, one column per
+            feature) at the row's features.
+
+            :rtype: An array of shape (weights.shape[0], number of rows)
+        """
+        gathered = weights[:, self.indices]
+        cumulative = numpy.zeros((weights.shape[0], len(self.indices) + 1))
+        numpy.cumsum(gathered, axis=1, out=cumulative[:, 1:])
+        return cumulative[:, self.indptr[1:]] - cumulative[:, self.indptr[:-1]]
+
+
+# Options of FeatureSpace, which can be set in classifier's parameters.
+FEATURE_SPACE_OPTIONS = ('dimension', 'ngrams', 'min_df', 'max_features')
+
+
+class FeatureSpace(object):
+    """
+        Configuration of classifier's features, read from the `features`
+        dictionary of classifier's parameters:
+            dimension - number of buckets features are hashed into. None
+                        means features are not hashed,
+            ngrams - maximum length of word n-grams used as features,
+            min_df - minimum number of training samples a feature has to
+                     occur in to be kept,
+            max_features - maximum number of features kept. The ones
+                           occurring in most training samples are kept.
+        Hashing and pruning bound the model's size regardless of the size of
+        samples' vocabulary.
+    """
+    def __init__(self, dimension=HASHING_DIMENSION, ngrams=1, min_df=1,
+            max_features=None):
+        self.dimension = dimension
+        self.ngrams = max(int(ngrams), 1)
+        self.min_df = max(int(min_df), 1)
+        self.max_features = max_features
+
+    def configure(self, parameters):
+        """
+            Returns a copy of this space with options overridden by given
+            dictionary.
+        """
+        options = self.to_parameters()
+        for name, value in (parameters or {}).iteritems():
+            if name in FEATURE_SPACE_OPTIONS:
+                options[str(name)] = value
+        return FeatureSpace(**options)
+
+    def to_parameters(self):
+        return {
+            'dimension': self.dimension,
+            'ngrams': self.ngrams,
+            'min_df': self.min_df,
+            'max_features': self.max_features,
+        }
+
+    def __eq__(self, other):
+        return isinstance(other, FeatureSpace) and \
+            self.to_parameters() == other.to_parameters()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def is_pruned(self):
+        return self.min_df > 1 or bool(self.max_features)
+
+    def prune(self, document_frequency):
+        """
+            Returns sorted array of features kept, given an array of number
+            of training samples every feature occurs in. Returns None if the
+            space isn't pruned.
+        """
+        if not self.is_pruned():
+            return None
+
+        document_frequency = numpy.asarray(document_frequency)
+        kept = numpy.flatnonzero(document_frequency >= self.min_df)
+        if self.max_features and len(kept) > self.max_features:
+            # Stable sort breaks ties in favour of lower feature indexes.
+            order = numpy.argsort(-document_frequency[kept], kind='mergesort')
+            kept = numpy.sort(kept[order[:self.max_features]])
+        return kept
+
+
+# Tokenizers available to FeatureStore, by name.
+TOKENIZERS = {
+    'words': tokenize,
+    'nltk': nltk.word_tokenize,
+}
+
+
+class FeatureStore(object):
+    """
+        Persistent store of distinct tokens of texts, keyed by text's hash.
+        A text is tokenized only if the store misses it, so retraining on a new
+        training set revision tokenizes only texts that haven't been seen.
+    """
+    def __init__(self, tokenizer='words'):
+        self.tokenizer = tokenizer
+        self.tokenize = TOKENIZERS[tokenizer]
+
+    def get_key(self, ngrams):
+        """
+            Returns name tokens with n-grams of given length are stored under.
+        """
+        if ngrams > 1:
+            return '%s-%d' % (self.tokenizer, ngrams)
+        return self.tokenizer
+
+    def _fetch(self, hashes, key):
+        """
+            Returns stored tokens of texts with given hashes, as a dictionary.
+        """
+        tokens = {}
+        for hashes_chunk in chunks(hashes, BULK_QUERY_SIZE):
+            entries = SampleFeatures.objects.filter(
+                tokenizer=key,
+                text_hash__in=hashes_chunk,
+            ).values_list('text_hash', 'tokens')
+            for hash_value, value in entries:
+                tokens[hash_value] = value.split()
+        return tokens
+
+    def _store(self, tokens, key):
+        """
+            Stores tokens given as a dictionary text hash -> tokens.
+        """
+        entries = [
+            SampleFeatures(
+                text_hash=hash_value,
+                tokenizer=key,
+                tokens=' '.join(text_tokens),
+            ) for hash_value, text_tokens in tokens.iteritems()
+        ]
+        for entries_chunk in chunks(entries, BULK_QUERY_SIZE):
+            try:
+                with savepoint():
+                    SampleFeatures.objects.bulk_create(entries_chunk)
+            except IntegrityError:
+                # Some of texts have been stored by another process in the
+                # meantime. Store the rest one by one.
+                for entry in entries_chunk:
+                    try:
+                        with savepoint():
+                            entry.save()
+                    except IntegrityError:
+                        pass
+
+    def get_tokens(self, texts, ngrams=1):
+        """
+            Returns a list of sorted, distinct tokens of every text, including
+            n-grams of length up to `ngrams`.
+        """
+        key = self.get_key(ngrams)
+        texts = list(texts)
+        hashes = [text_hash(text or '') for text in texts]
+        tokens = self._fetch(set(hashes), key)
+
+        missing = {}
+        for text, hash_value in zip(texts, hashes):
+            if hash_value in tokens or hash_value in missing:
+                continue
+            words = make_ngrams(self.tokenize(text or ''), ngrams)
+            missing[hash_value] = sorted(set(words))
+
+        if missing:
+            self._store(missing, key)
+            tokens.update(missing)
+
+        return [tokens[hash_value] for hash_value in hashes]
@@ -0,0 +1,366 @@
+import datetime
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+from multiprocessing import Process, Queue
+from optparse import make_option
+from Queue import Empty
+
+import numpy
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from urlannotator.classification import classifiers
+from urlannotator.classification.factories import (classifier_factory,
+    classifier_inits)
+from urlannotator.classification.models import ClassifiedSample, TrainingSet
+from urlannotator.main.models import Job, Sample, LABEL_YES, LABEL_NO
+
+# Classifier247 only wraps two classifiers of TWENTYFOUR_DEFAULT_CLASSIFIER
+# type, which are benchmarked on their own.
+WRAPPER_CLASSIFIERS = ('Classifier247', )
+
+# Number of words shared by samples of all labels. The rest of the vocabulary
+# is split between labels.
+COMMON_WORDS_FRACTION = 0.5
+
+# Probability a sample's word is drawn from its label's words rather than from
+# the common ones.
+LABEL_WORD_PROBABILITY = 0.3
+
+# Number of seconds between checks whether a benchmark's process is alive,
+# while waiting for its result.
+RESULT_POLL_INTERVAL = 1
+
+
+def generate_corpus(samples, vocabulary, words, seed=0):
+    """
+        Generates `samples` texts of `words` words drawn from a vocabulary of
+        `vocabulary` words, with Zipf-like frequencies. Every label has its
+        own words, so the corpus can be learned.
+
+        :rtype: A list of (text, label) tuples
+    """
+    rand = random.Random(seed)
+    labels = [LABEL_YES, LABEL_NO]
+    common = int(vocabulary * COMMON_WORDS_FRACTION)
+    label_size = max((vocabulary - common) // len(labels), 1)
+
+    def draw(offset, size):
+        # Paretovariate gives a heavy-tailed rank, like words' frequencies.
+        rank = min(int(rand.paretovariate(1.0)) - 1, size - 1)
+        return 'w%d' % (offset + rank)
+
+    corpus = []
+    for idx in xrange(samples):
+        label = labels[idx % len(labels)]
+        offset = common + labels.index(label) * label_size
+        text = []
+        for _ in xrange(words):
+            if rand.random() < LABEL_WORD_PROBABILITY:
+                text.append(draw(offset, label_size))
+            else:
+                text.append(draw(0, max(common, 1)))
+        corpus.append((' '.join(text), label))
+    return corpus
+
+
+def percentiles(values):
+    """
+        Returns p50 and p99 of given durations, in milliseconds.
+    """
+    if not values:
+        return {'p50': None, 'p99': None}
+    values = numpy.array(values) * 1000
+    return {
+        'p50': round(float(numpy.percentile(values, 50)), 3),
+        'p99': round(float(numpy.percentile(values, 99)), 3),
+    }
+
+
+def get_commit():
+    """
+        Returns hash of the checked out commit, or None outside a repository.
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+            stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class LocalPredictionService(object):
+    """
+        Google Prediction API stand-in predicting a constant label, so that
+        the classifier's own overhead can be measured without network calls.
+    """
+    label = LABEL_YES
+
+    def trainedmodels(self):
+        return self
+
+    def insert(self, body, **kwargs):
+        return LocalCall({})
+
+    def get(self, **kwargs):
+        return LocalCall({'trainingStatus': 'DONE'})
+
+    def analyze(self, **kwargs):
+        return LocalCall(classifiers.identity_analysis())
+
+    def predict(self, body, **kwargs):
+        return LocalCall({
+            'outputLabel': self.label,
+            'outputMulti': [
+                {'label': LABEL_YES, 'score': 1.0},
+                {'label': LABEL_NO, 'score': 0.0},
+            ],
+        })
+
+
+class LocalCall(object):
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self):
+        return self.result
+
+
+class LocalCredentials(object):
+    def authorize(self, http):
+        return http
+
+
+class LocalStorage(object):
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def get(self):
+        return LocalCredentials()
+
+
+def local_upload(file_name):
+    os.remove(file_name)
+
+
+def stub_google_prediction():
+    """
+        Replaces Google Prediction and Storage clients with local stand-ins.
+        Only called in benchmark's child processes.
+    """
+    classifiers.build = lambda *args, **kwargs: LocalPredictionService()
+    classifiers.Storage = LocalStorage
+    classifiers.gs_upload_file = local_upload
+
+
+def get_rss_peak():
+    """
+        Returns peak resident set size of this process, in kilobytes.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def benchmark(name, corpus, options):
+    """
+        Trains classifier `name` on the corpus and measures it.
+    """
+    stub_google_prediction()
+    rss_start = get_rss_peak()
+
+    user = User.objects.create_user(username='benchmark-%s' % name,
+        password='benchmark')
+    job = Job.objects.create_draft(account=user.get_profile(),
+        title='Benchmark', description='Benchmark')
+    Sample.objects.bulk_create(
+        Sample(job=job, url='http://benchmark.com/%d' % idx,
+            domain='benchmark.com', text=text, source_type='owner')
+        for idx, (text, label) in enumerate(corpus)
+    )
+    samples = list(Sample.objects.filter(job=job).order_by('id'))
+    train_count = int(len(samples) * (1 - options['test_fraction']))
+    labels = dict((sample.id, label) for sample, (text, label)
+        in zip(samples[:train_count], corpus))
+    training_set = TrainingSet.objects.create_revision(job, labels)
+
+    entry_id = classifier_factory.initialize_classifier(job_id=job.id,
+        classifier_name=name, main=False)
+    classifier = classifier_factory.create_classifier_from_id(entry_id)
+
+    start = time.time()
+    classifier.train(set_id=training_set.id)
+    train_time = time.time() - start
+    rss_trained = get_rss_peak()
+
+    test_samples = samples[train_count:]
+    expected = [label for text, label in corpus[train_count:]]
+    if not test_samples:
+        test_samples = samples
+        expected = [label for text, label in corpus]
+    ClassifiedSample.objects.bulk_create(
+        ClassifiedSample(job=job, sample=sample, url=sample.url)
+        for sample in test_samples
+    )
+    class_samples = list(ClassifiedSample.objects.filter(job=job)
+        .select_related('sample').order_by('id'))
+
+    single = []
+    for class_sample in class_samples[:options['single']]:
+        start = time.time()
+        classifier.classify(class_sample)
+        single.append(time.time() - start)
+
+    batch = []
+    size = options['batch_size']
+    for idx in xrange(0, len(class_samples), size):
+        start = time.time()
+        classifier.classify_batch(class_samples[idx:idx + size])
+        batch.append(time.time() - start)
+
+    predicted = dict(ClassifiedSample.objects.filter(job=job).values_list(
+        'id', 'label'))
+    correct = sum(1 for class_sample, label in zip(class_samples, expected)
+        if predicted[class_sample.id] == label)
+
+    artifact_size = None
+    if hasattr(classifier, 'get_file_name'):
+        try:
+            artifact_size = os.path.getsize(classifier.get_file_name())
+        except OSError:
+            pass
+
+    return {
+        'train_seconds': round(train_time, 3),
+        'classify_ms': percentiles(single),
+        'batch_ms': percentiles(batch),
+        'batch_size': size,
+        'accuracy': round(correct / float(len(class_samples)), 4),
+        'rss_peak_kb': get_rss_peak(),
+        'rss_training_kb': rss_trained - rss_start,
+        'artifact_bytes': artifact_size,
+        'model': classifier.get_model_stats(),
+    }
+
+
+def run_benchmark(name, corpus, options, results):
+    try:
+        results.put((name, benchmark(name, corpus, options)))
+    except Exception, e:
+        results.put((name, {'error': '%s: %s' % (e.__class__.__name__, e)}))
+
+
+class Command(BaseCommand):
+    args = ''
+    help = """
+        Benchmarks classifiers on a synthetic labelled corpus, in a test
+        database. Every classifier runs in its own process, so that its peak
+        memory is measured alone. Results are written as JSON. Example:
+        ./manage.py benchmark_classifiers --samples 5000 -o bench.json
+    """
+
+    option_list = BaseCommand.option_list + (
+        make_option('--samples', type='int', dest='samples', default=2000,
+            help='Number of samples in the corpus.'),
+        make_option('--vocabulary', type='int', dest='vocabulary',
+            default=20000, help='Number of distinct words in the corpus.'),
+        make_option('--words', type='int', dest='words', default=200,
+            help='Number of words per sample.'),
+        make_option('--test-fraction', type='float', dest='test_fraction',
+            default=0.2, help='Fraction of samples classified.'),
+        make_option('--single', type='int', dest='single', default=100,
+            help='Number of samples classified one by one.'),
+        make_option('--batch-size', type='int', dest='batch_size',
+            default=100),
+        make_option('--seed', type='int', dest='seed', default=0),
+        make_option('-c', '--classifier', action='append',
+            dest='classifiers', default=None,
+            help='Only benchmark given classifier. Can be repeated.'),
+        make_option('-o', '--output', dest='output', default=None,
+            help='File results are written to. Defaults to stdout.'),
+        make_option('--timeout', type='int', dest='timeout', default=3600,
+            help='Number of seconds a classifier\'s benchmark may take.'),
+    )
+
+    def get_classifiers(self, options):
+        names = sorted(name for name in classifier_inits
+            if name not in WRAPPER_CLASSIFIERS)
+        for name in options['classifiers'] or []:
+            if name not in names:
+                raise CommandError('Unknown classifier %s.' % name)
+        return options['classifiers'] or names
+
+    def wait_for_result(self, process, results, timeout):
+        """
+            Returns result of benchmark's `process`, or an error if it died
+            without giving one (e.g. killed when out of memory) or timed out.
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                return results.get(timeout=RESULT_POLL_INTERVAL)[1]
+            except Empty:
+                if not process.is_alive():
+                    break
+        else:
+            process.terminate()
+            return {'error': 'Timed out after %d seconds.' % timeout}
+
+        # The result might have been put right before the process exited.
+        try:
+            return results.get(timeout=RESULT_POLL_INTERVAL)[1]
+        except Empty:
+            return {'error': 'Process exited with code %s without a result.'
+                % process.exitcode}
+
+    def handle(self, *args, **options):
+        names = self.get_classifiers(options)
+        corpus = generate_corpus(options['samples'], options['vocabulary'],
+            options['words'], seed=options['seed'])
+
+        report = {
+            'commit': get_commit(),
+            'date': datetime.datetime.utcnow().isoformat(),
+            'corpus': {
+                'samples': options['samples'],
+                'vocabulary': options['vocabulary'],
+                'words': options['words'],
+                'test_fraction': options['test_fraction'],
+                'seed': options['seed'],
+            },
+            'results': {},
+        }
+
+        # Models are written relative to the working directory.
+        cwd = os.getcwd()
+        work_dir = tempfile.mkdtemp(prefix='benchmark-classifiers-')
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            os.chdir(work_dir)
+            for name in names:
+                # Children must not share the parent's connection.
+                connection.close()
+                results = Queue()
+                process = Process(target=run_benchmark,
+                    args=(name, corpus, options, results))
+                process.start()
+                result = self.wait_for_result(process, results,
+                    options['timeout'])
+                process.join()
+                report['results'][name] = result
+                self.stderr.write('%s: %s\n' % (name, json.dumps(result)))
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(work_dir, ignore_errors=True)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output + '\n')
@@ -0,0 +1,140 @@
+import os
+import pickle
+import tempfile
+import time
+from multiprocessing import Process, Queue, Event
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from urlannotator.classification.artifacts import is_artifact, read_artifact
+
+# Loading modes compared by the benchmark:
+# mmap - arrays are views of the memory-mapped artifact, shared between
+#        processes,
+# copy - artifact's arrays are read into every process's memory,
+# pickle - the same arrays are unpickled, like models stored by older versions.
+MODES = ('mmap', 'copy', 'pickle')
+
+
+def read_memory(pid):
+    """
+        Returns a tuple (RSS, PSS) of process `pid`, in kilobytes. PSS
+        accounts pages shared by several processes proportionally. It is None
+        if the kernel doesn't report it.
+    """
+    rss = pss = None
+    with open('/proc/%d/status' % pid) as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1])
+
+    smaps = '/proc/%d/smaps_rollup' % pid
+    if os.path.exists(smaps):
+        with open(smaps) as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    pss = int(line.split()[1])
+    return rss, pss
+
+
+def load_model(file_name, mode):
+    if mode == 'pickle':
+        with open(file_name, 'rb') as f:
+            return pickle.load(f)
+    meta, arrays = read_artifact(file_name, use_mmap=(mode == 'mmap'))
+    return arrays
+
+
+def worker(file_name, mode, results, done):
+    """
+        Loads the model, touches all its pages and waits until all workers
+        report, so that they are measured while running side by side.
+    """
+    rss_before = read_memory(os.getpid())[0]
+    start = time.time()
+    arrays = load_model(file_name, mode)
+    load_time = time.time() - start
+    for array in arrays.itervalues():
+        float(array.sum())
+    results.put((os.getpid(), load_time, rss_before))
+    done.wait()
+
+
+class Command(BaseCommand):
+    args = '<model artifact>'
+    help = """
+        Measures load time and memory used by model loaded in several worker
+        processes at once. Example:
+        ./manage.py benchmark_model_loading bayes-classifiers/bayes-1 -w 8
+    """
+
+    option_list = BaseCommand.option_list + (
+        make_option('-w', '--workers', type='int', dest='workers', default=4,
+            help='Number of worker processes.'),
+        make_option('-m', '--mode', dest='mode', default=None,
+            help='Only run given mode (%s).' % ', '.join(MODES)),
+    )
+
+    def run_mode(self, file_name, mode, workers):
+        results = Queue()
+        done = Event()
+        processes = [Process(target=worker,
+            args=(file_name, mode, results, done)) for _ in xrange(workers)]
+        for process in processes:
+            process.start()
+
+        stats = []
+        try:
+            for _ in xrange(workers):
+                pid, load_time, rss_before = results.get()
+                rss, pss = read_memory(pid)
+                stats.append((load_time, rss - rss_before, rss, pss))
+        finally:
+            done.set()
+            for process in processes:
+                process.join()
+
+        count = float(len(stats))
+        load_time = sum(stat[0] for stat in stats) / count
+        rss_delta = sum(stat[1] for stat in stats) / count
+        rss = sum(stat[2] for stat in stats) / count
+        if all(stat[3] is not None for stat in stats):
+            pss = '%.1f' % (sum(stat[3] for stat in stats) / count / 1024)
+        else:
+            pss = '-'
+        self.stdout.write('%-8s %8.2f %12.1f %10.1f %10s\n' % (mode,
+            load_time * 1000, rss_delta / 1024, rss / 1024, pss))
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Model artifact file name is required.')
+        file_name = args[0]
+        if not is_artifact(file_name):
+            raise CommandError('%s is not a model artifact. Convert it with '
+                'convert_classifier_models first.' % file_name)
+
+        modes = MODES
+        if options['mode']:
+            if options['mode'] not in MODES:
+                raise CommandError('Unknown mode %s.' % options['mode'])
+            modes = (options['mode'],)
+
+        self.stdout.write('%d workers, %d bytes model.\n' % (
+            options['workers'], os.path.getsize(file_name)))
+        self.stdout.write('%-8s %8s %12s %10s %10s\n' % ('mode', 'load ms',
+            'model RSS MB', 'RSS MB', 'PSS MB'))
+
+        for mode in modes:
+            if mode != 'pickle':
+                self.run_mode(file_name, mode, options['workers'])
+                continue
+
+            meta, arrays = read_artifact(file_name, use_mmap=False)
+            fd, pickle_name = tempfile.mkstemp()
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(arrays, f, pickle.HIGHEST_PROTOCOL)
+                self.run_mode(pickle_name, mode, options['workers'])
+            finally:
+                os.remove(pickle_name)
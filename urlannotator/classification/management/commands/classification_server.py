@@ -0,0 +1,33 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from urlannotator.classification.client import get_server_address
+from urlannotator.classification.server import ClassificationServer
+
+
+class Command(BaseCommand):
+    args = ''
+    help = """
+        Starts the classification server keeping trained models in memory.
+        Host and port default to CLASSIFICATION_SERVER_HOST and
+        CLASSIFICATION_SERVER_PORT settings.
+    """
+
+    option_list = BaseCommand.option_list + (
+        make_option('--host', dest='host', default=None),
+        make_option('--port', type='int', dest='port', default=None),
+    )
+
+    def handle(self, *args, **options):
+        host, port = get_server_address()
+        address = (options['host'] or host, options['port'] or port)
+        server = ClassificationServer(address)
+        self.stdout.write('Classification server listening on %s:%d.\n'
+            % address)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,35 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from urlannotator.classification.models import Classifier
+
+
+class Command(BaseCommand):
+    args = ''
+    help = """
+        Prints number of features and memory taken by trained classifiers'
+        models, as stored when they were trained. Example:
+        ./manage.py classifier_stats --job 12
+    """
+
+    option_list = BaseCommand.option_list + (
+        make_option('--job', type='int', dest='job', default=None),
+    )
+
+    def handle(self, *args, **options):
+        entries = Classifier.objects.order_by('job', 'id')
+        if options['job']:
+            entries = entries.filter(job__id=options['job'])
+
+        total = 0
+        for entry in entries.iterator():
+            stats = entry.parameters.get('model_stats')
+            if not stats:
+                continue
+
+            total += stats.get('memory') or 0
+            self.stdout.write('job %d, %s %d: %s features, %s bytes\n' % (
+                entry.job_id, entry.type, entry.id, stats.get('features'),
+                stats.get('memory')))
+        self.stdout.write('Total: %d bytes\n' % total)
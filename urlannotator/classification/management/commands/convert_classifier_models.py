@@ -0,0 +1,43 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from urlannotator.classification.artifacts import is_artifact
+from urlannotator.classification.factories import classifier_factory
+from urlannotator.classification.models import Classifier
+
+
+class Command(BaseCommand):
+    args = ''
+    help = """
+        Converts pickled NaiveBayesClassifier models into memory-mappable
+        model artifacts. Example:
+        ./manage.py convert_classifier_models --dry-run
+    """
+
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run', action='store_true', dest='dry_run',
+            default=False, help='Only list models that would be converted.'),
+    )
+
+    def handle(self, *args, **options):
+        converted = 0
+        entries = Classifier.objects.filter(type='NaiveBayesClassifier')
+        for entry in entries.iterator():
+            classifier = classifier_factory.create_classifier_from_id(entry.id)
+            file_name = classifier.get_file_name()
+            try:
+                if is_artifact(file_name):
+                    continue
+                model = classifier.read_classifier(file_name)
+            except IOError:
+                # Not trained yet.
+                continue
+
+            self.stdout.write('Converting %s.\n' % file_name)
+            if not options['dry_run']:
+                classifier.classifier = model
+                classifier.dump_classifier()
+            converted += 1
+
+        self.stdout.write('Converted %d models.\n' % converted)
@@ -0,0 +1,37 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from urlannotator.classification.models import TrainingRequest
+from urlannotator.classification.training import TrainingPool
+
+
+class Command(BaseCommand):
+    args = ''
+    help = """
+        Starts a pool of workers training classifiers on queued training sets.
+        Number of workers defaults to TRAINING_WORKERS setting. Run a single
+        pool per host. With --stats, prints training queue's stats instead.
+    """
+
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', type='int', dest='workers', default=None),
+        make_option('--max-tasks', type='int', dest='max_tasks',
+            default=None),
+        make_option('--stats', action='store_true', dest='stats',
+            default=False),
+    )
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            stats = TrainingRequest.objects.stats()
+            for name in sorted(stats):
+                self.stdout.write('%s: %s\n' % (name, stats[name]))
+            return
+
+        pool = TrainingPool(
+            workers=options['workers'],
+            max_tasks=options['max_tasks'],
+        )
+        self.stdout.write('Starting %d training workers.\n' % pool.size)
+        pool.run()
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'TrainingRequest'
+        db.create_table('classification_trainingrequest', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('job', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['main.Job'])),
+            ('training_set', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['classification.TrainingSet'])),
+            ('status', self.gf('django.db.models.fields.IntegerField')(default=0)),
+            ('priority', self.gf('django.db.models.fields.IntegerField')(default=1)),
+            ('superseded', self.gf('django.db.models.fields.IntegerField')(default=0)),
+            ('worker', self.gf('django.db.models.fields.CharField')(max_length=100, blank=True)),
+            ('error', self.gf('django.db.models.fields.TextField')(blank=True)),
+            ('created', self.gf('django.db.models.fields.DateTimeField')(auto_now_add=True, blank=True)),
+            ('started', self.gf('django.db.models.fields.DateTimeField')(null=True, blank=True)),
+            ('finished', self.gf('django.db.models.fields.DateTimeField')(null=True, blank=True)),
+        ))
+        db.send_create_signal('classification', ['TrainingRequest'])
+
+
+    def backwards(self, orm):
+        # Deleting model 'TrainingRequest'
+        db.delete_table('classification_trainingrequest')
+
+
+    models = {
+        'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'ordering': "('content_type__app_label', 'content_type__model', 'codename')", 'unique_together': "(('content_type', 'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        'classification.classifiedsample': {
+            'Meta': {'object_name': 'ClassifiedSample'},
+            'added_on': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'job': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['main.Job']"}),
+            'label': ('django.db.models.fields.CharField', [], {'max_length': '10'}),
+            'label_probability': ('tenclouds.django.jsonfield.fields.JSONField', ['{}'], {'blank': 'True'}),
+            'sample': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['main.Sample']", 'null': 'True', 'blank': 'True'}),
+            'source_type': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'source_val': ('django.db.models.fields.CharField', [], {'max_length': '100', 'null': 'True', 'blank': 'True'}),
+            'url': ('django.db.models.fields.URLField', [], {'max_length': '500'})
+        },
+        'classification.classifier': {
+            'Meta': {'object_name': 'Classifier'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'job': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['main.Job']"}),
+            'main': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'parameters': ('tenclouds.django.jsonfield.fields.JSONField', ['{}'], {'blank': 'True'}),
+            'type': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'classification.classifierperformance': {
+            'Meta': {'object_name': 'ClassifierPerformance', '_ormbases': ['classification.Statistics']},
+            'date': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'job': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['main.Job']"}),
+            'statistics_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['classification.Statistics']", 'unique': 'True', 'primary_key': 'True'}),
+            'value': ('tenclouds.django.jsonfield.fields.JSONField', ['{}'], {'blank': 'True'})
+        },
+        'classification.samplefeatures': {
+            'Meta': {'unique_together': "(['text_hash', 'tokenizer'],)", 'object_name': 'SampleFeatures'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'text_hash': ('django.db.models.fields.CharField', [], {'max_length': '40'}),
+            'tokenizer': ('django.db.models.fields.CharField', [], {'max_length': '20'}),
+            'tokens': ('django.db.models.fields.TextField', [], {})
+        },
+        'classification.statistics': {
+            'Meta': {'object_name': 'Statistics'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        'classification.trainingrequest': {
+            'Meta': {'object_name': 'TrainingRequest'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'error': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'finished': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'job': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['main.Job']"}),
+            'priority': ('django.db.models.fields.IntegerField', [], {'default': '1'}),
+            'started': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'status': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'superseded': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'training_set': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['classification.TrainingSet']"}),
+            'worker': ('django.db.models.fields.CharField', [], {'max_length': '100', 'blank': 'True'})
+        },
+        'classification.trainingsample': {
+            'Meta': {'unique_together': "(['set', 'sample'],)", 'object_name': 'TrainingSample'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'label': ('django.db.models.fields.CharField', [], {'max_length': '20'}),
+            'removed': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'sample': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['main.Sample']"}),
+            'set': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'training_samples'", 'to': "orm['classification.TrainingSet']"})
+        },
+        'classification.trainingset': {
+            'Meta': {'object_name': 'TrainingSet'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'job': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['main.Job']"}),
+            'lineage': ('tenclouds.django.jsonfield.fields.JSONField', ['[]'], {'blank': 'True'}),
+            'parent': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'children'", 'null': 'True', 'to': "orm['classification.TrainingSet']"}),
+            'revision': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'main.account': {
+            'Meta': {'object_name': 'Account'},
+            'activation_key': ('django.db.models.fields.CharField', [], {'default': "''", 'max_length': '100'}),
+            'alerts': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'email_registered': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'full_name': ('django.db.models.fields.CharField', [], {'default': "''", 'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'odesk_key': ('django.db.models.fields.CharField', [], {'default': "''", 'max_length': '100'}),
+            'odesk_uid': ('django.db.models.fields.CharField', [], {'default': "''", 'max_length': '100'}),
+            'user': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['auth.User']", 'unique': 'True'}),
+            'worker_entry': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['main.Worker']", 'unique': 'True', 'null': 'True', 'blank': 'True'})
+        },
+        'main.job': {
+            'Meta': {'object_name': 'Job'},
+            'account': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['main.Account']"}),
+            'activated': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'btm_active': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'btm_to_gather': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'budget': ('django.db.models.fields.DecimalField', [], {'default': '0', 'max_digits': '10', 'decimal_places': '2'}),
+            'classify_urls': ('tenclouds.django.jsonfield.fields.JSONField', ['{}'], {'blank': 'True'}),
+            'collected_urls': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'data_source': ('django.db.models.fields.IntegerField', [], {'default': '1'}),
+            'description': ('django.db.models.fields.TextField', [], {}),
+            'gold_samples': ('tenclouds.django.jsonfield.fields.JSONField', ['{}'], {'blank': 'True'}),
+            'hourly_rate': ('django.db.models.fields.DecimalField', [], {'default': '0', 'max_digits': '10', 'decimal_places': '2'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'initialization_status': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'no_of_urls': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'progress': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'project_type': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'quality_algorithm': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'remaining_urls': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'same_domain_allowed': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'status': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'votes_storage': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'main.sample': {
+            'Meta': {'unique_together': "(('job', 'url'),)", 'object_name': 'Sample'},
+            'added_on': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'btm_sample': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'domain': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'job': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['main.Job']"}),
+            'screenshot': ('django.db.models.fields.URLField', [], {'max_length': '500'}),
+            'source_type': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'source_val': ('django.db.models.fields.CharField', [], {'max_length': '100', 'null': 'True', 'blank': 'True'}),
+            'text': ('django.db.models.fields.TextField', [], {}),
+            'training': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'url': ('django.db.models.fields.URLField', [], {'max_length': '500'}),
+            'vote_sample': ('django.db.models.fields.BooleanField', [], {'default': 'True'})
+        },
+        'main.worker': {
+            'Meta': {'object_name': 'Worker'},
+            'external_id': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'worker_type': ('django.db.models.fields.IntegerField', [], {'max_length': '100'})
+        }
+    }
+
+    complete_apps = ['classification']
\ No newline at end of file
@@ -0,0 +1,162 @@
+import os
+import threading
+from collections import OrderedDict
+
+from urlannotator.tools.utils import setting
+
+import logging
+log = logging.getLogger(__name__)
+
+# Default memory budget of the cache, in bytes.
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+
+# Cache statistics are logged every that many lookups.
+REPORT_INTERVAL = 1000
+
+
+class ModelCache(object):
+    """
+        Process-wide LRU cache of classifier models loaded from disk.
+
+        Models are keyed by classifier entry id. Every entry is stored with
+        the version (inode, size, mtime) of the file it was loaded from, so a
+        model retrained by any other process is reloaded on the next lookup.
+        Models are written with an atomic rename, hence a retrained model
+        always has a different version.
+
+        Total size of cached models is kept under `max_size` bytes by evicting
+        least recently used entries.
+
+        This class is thread-safe.
+    """
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def get_version(file_name):
+        """
+            Returns version of the model stored under `file_name`, or None if
+            there is no such file.
+        """
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime)
+
+    def _pop(self, key):
+        """
+            Removes an entry from the cache. This is not thread-safe.
+        """
+        version, model, size = self.entries.pop(key)
+        self.size -= size
+
+    def _report(self):
+        lookups = self.hits + self.misses
+        if lookups % REPORT_INTERVAL == 0:
+            log.info('Model cache stats: %s.' % self._stats())
+
+    def _stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self.entries),
+            'size': self.size,
+            'max_size': self.max_size,
+        }
+
+    def stats(self):
+        """
+            Returns a dictionary with cache counters.
+        """
+        with self.lock:
+            return self._stats()
+
+    def _store(self, key, version, model, size):
+        """
+            Stores `model` of given `version` under `key`, evicting least
+            recently used models if needed.
+        """
+        with self.lock:
+            if key in self.entries:
+                self._pop(key)
+
+            # Models bigger than whole cache are not cached at all.
+            if size > self.max_size:
+                return
+
+            while self.entries and self.size + size > self.max_size:
+                evicted_key, evicted = self.entries.popitem(last=False)
+                self.size -= evicted[2]
+                self.evictions += 1
+
+            self.entries[key] = (version, model, size)
+            self.size += size
+
+    def set(self, key, file_name, model, size=None):
+        """
+            Stores `model` freshly written to `file_name` under `key`. If
+            `size` is not given, size of the file is used as the model's size.
+        """
+        version = self.get_version(file_name)
+        if version is None:
+            return
+
+        if size is None:
+            size = version[1]
+        self._store(key, version, model, size)
+
+    def load(self, key, file_name, loader, size_of=None):
+        """
+            Returns model stored under `key`, loading it with
+            `loader(file_name)` if it's missing or out of date.
+            Returns None if there is no model file.
+
+            :param size_of: optional function returning a model's size in
+                            bytes. Defaults to size of the model's file.
+        """
+        version = self.get_version(file_name)
+        if version is None:
+            return None
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                # Mark as the most recently used.
+                self.entries[key] = self.entries.pop(key)
+                self._report()
+                return entry[1]
+
+            self.misses += 1
+            self._report()
+
+        model = loader(file_name)
+        size = size_of(model) if size_of else version[1]
+        self._store(key, version, model, size)
+        return model
+
+    def invalidate(self, key):
+        """
+            Removes model stored under `key`.
+        """
+        with self.lock:
+            if key in self.entries:
+                self._pop(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+model_cache = ModelCache(
+    max_size=setting('CLASSIFIER_CACHE_SIZE', DEFAULT_CACHE_SIZE),
+)
@@ -1,13 +1,20 @@
+import datetime
 import json
 
 from tenclouds.django.jsonfield.fields import JSONField
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import models, IntegrityError
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.utils.timezone import now
 
 from urlannotator.main.models import (Job, Sample, LABEL_CHOICES,
     LABEL_YES, LABEL_NO, LABEL_BROKEN, SAMPLE_SOURCE_OWNER)
-from urlannotator.flow_control import send_event
-from urlannotator.tools.utils import sanitize_url
+from urlannotator.flow_control import send_event, event_transaction
+from urlannotator.tools.utils import (sanitize_url, chunks, setting,
+    savepoint)
+
+# Maximum number of ids passed in a single `IN` clause.
+BULK_QUERY_SIZE = 500
 
 
 class Classifier(models.Model):
@@ -21,6 +28,20 @@ class Classifier(models.Model):
     main = models.BooleanField(default=True)
 
 
+def unlink_classifier_locks(sender, instance, **kwargs):
+    """
+        Removes switch locks of a deleted Classifier247 entry.
+    """
+    if instance.type != 'Classifier247':
+        return
+
+    # Possible loop imports here
+    from urlannotator.tools.synchronization import RWSynchronize247
+    RWSynchronize247(template_name=str(instance.id)).unlink()
+
+post_delete.connect(unlink_classifier_locks, sender=Classifier)
+
+
 class Statistics(models.Model):
     pass
 
@@ -49,6 +70,11 @@ class ClassifierPerformance(Statistics):
     objects = PerformanceManager()
 
 
+# Default maximum number of revisions a training set is built of. Longer chains
+# are compacted by storing a full snapshot.
+DEFAULT_TRAINING_SET_MAX_DEPTH = 20
+
+
 class TrainingSetManager(models.Manager):
     """
         Adds custom methods to TrainingSet model manager.
@@ -58,35 +84,515 @@ class TrainingSetManager(models.Manager):
             Returns newest TrainingSet for given job
         """
         els = super(TrainingSetManager, self).get_query_set().filter(job=job).\
-            order_by('-revision')
+            order_by('-revision', '-id')
         if not els.count():
             return None
 
         return els[0]
 
+    def create_revision(self, job, labels):
+        """
+            Creates a new training set of `job` consisting of samples given as
+            a dictionary sample id -> label.
+
+            Only changes relative to the newest job's set are stored. If the
+            chain of revisions would get longer than TRAINING_SET_MAX_DEPTH,
+            a full snapshot is stored instead.
+        """
+        parent = self.newest_for_job(job)
+        max_depth = setting('TRAINING_SET_MAX_DEPTH',
+            DEFAULT_TRAINING_SET_MAX_DEPTH)
+        if parent is None or len(parent.lineage) + 2 > max_depth:
+            training_set = self.create(job=job)
+            training_set.set_labels(labels)
+            return training_set
+
+        training_set = self.create(
+            job=job,
+            parent=parent,
+            lineage=json.dumps(parent.get_lineage()),
+        )
+        old_labels = parent.get_labels()
+        changed = dict((sample_id, label)
+            for sample_id, label in labels.iteritems()
+            if old_labels.get(sample_id) != label)
+        removed = [sample_id for sample_id in old_labels
+            if sample_id not in labels]
+        training_set.set_labels(changed, removed=removed)
+        return training_set
+
 
 class TrainingSet(models.Model):
     """
         A set of TrainingSamples used to train job's classifier.
+
+        Every set is a revision of its parent set and stores only samples
+        added, relabelled or removed (with `removed` flag) in this revision.
+        `lineage` keeps ids of all ancestors, oldest first, so that whole set
+        can be resolved with a single query.
     """
     job = models.ForeignKey(Job)
     revision = models.DateTimeField(auto_now_add=True)
+    parent = models.ForeignKey('self', null=True, blank=True,
+        related_name='children')
+    lineage = JSONField(default='[]')
 
     objects = TrainingSetManager()
 
+    def get_lineage(self):
+        """
+            Returns ids of sets this revision is built of, oldest first.
+        """
+        return list(self.lineage) + [self.id]
+
+    def get_rows(self, sample_ids=None):
+        """
+            Returns a queryset of all revisions' rows, oldest revision first.
+        """
+        rows = TrainingSample.objects.filter(set__in=self.get_lineage())
+        if sample_ids is not None:
+            rows = rows.filter(sample__in=sample_ids)
+        return rows.order_by('set')
+
+    def get_labels(self, sample_ids=None):
+        """
+            Returns a dictionary sample id -> label of set's samples. If
+            `sample_ids` is given, only those samples are resolved.
+        """
+        if sample_ids is None:
+            id_chunks = [None]
+        else:
+            id_chunks = chunks(sample_ids, BULK_QUERY_SIZE)
+
+        labels = {}
+        for ids_chunk in id_chunks:
+            rows = self.get_rows(ids_chunk).values_list('sample_id', 'label',
+                'removed')
+            for sample_id, label, removed in rows:
+                if removed:
+                    labels.pop(sample_id, None)
+                else:
+                    labels[sample_id] = label
+        return labels
+
+    def get_label(self, sample_id):
+        """
+            Returns label of given sample in this set, or None if the sample is
+            not in the set.
+        """
+        rows = self.get_rows([sample_id]).reverse().values_list('label',
+            'removed')[:1]
+        if not rows or rows[0][1]:
+            return None
+        return rows[0][0]
+
+    def get_samples(self):
+        """
+            Returns a list of set's TrainingSamples with related samples.
+        """
+        samples = {}
+        for row in self.get_rows().select_related('sample').iterator():
+            if row.removed:
+                samples.pop(row.sample_id, None)
+            else:
+                samples[row.sample_id] = row
+        return [samples[sample_id] for sample_id in sorted(samples)]
+
+    def count(self):
+        """
+            Returns number of set's samples.
+        """
+        return len(self.get_labels())
+
+    def set_labels(self, labels, removed=()):
+        """
+            Stores labels of samples given as a dictionary sample id -> label
+            in this revision. Samples listed in `removed` are marked as removed
+            from the set.
+        """
+        rows = dict((sample_id, (label, False))
+            for sample_id, label in labels.iteritems())
+        for sample_id in removed:
+            rows[sample_id] = ('', True)
+
+        with event_transaction():
+            # Rows already stored in this revision are updated in place.
+            if self.training_samples.exists():
+                for ids_chunk in chunks(rows.keys(), BULK_QUERY_SIZE):
+                    existing = self.training_samples.filter(
+                        sample__in=ids_chunk,
+                    ).values_list('sample_id', flat=True)
+                    for sample_id in existing:
+                        label, is_removed = rows.pop(sample_id)
+                        self.training_samples.filter(sample=sample_id).update(
+                            label=label,
+                            removed=is_removed,
+                        )
+
+            new_rows = [
+                TrainingSample(
+                    set=self,
+                    sample_id=sample_id,
+                    label=label,
+                    removed=is_removed,
+                ) for sample_id, (label, is_removed) in rows.iteritems()
+            ]
+            for rows_chunk in chunks(new_rows, BULK_QUERY_SIZE):
+                TrainingSample.objects.bulk_create(rows_chunk)
+
+    def delta(self, previous):
+        """
+            Returns changes between `previous` training set and this one as a
+            dictionary with keys:
+                added - sample id -> label of samples missing in `previous`,
+                removed - sample id -> label of samples missing in this set,
+                relabelled - sample id -> (old label, new label).
+
+            If `previous` is an ancestor of this set, only samples stored in
+            revisions newer than `previous` are compared.
+        """
+        lineage = self.get_lineage()
+        if previous.id in lineage:
+            newer = lineage[lineage.index(previous.id) + 1:]
+            sample_ids = list(set(TrainingSample.objects.filter(
+                set__in=newer).values_list('sample_id', flat=True)))
+            old_labels = previous.get_labels(sample_ids)
+            new_labels = self.get_labels(sample_ids)
+        else:
+            old_labels = previous.get_labels()
+            new_labels = self.get_labels()
+
+        added = {}
+        relabelled = {}
+        for sample_id, label in new_labels.iteritems():
+            old_label = old_labels.pop(sample_id, None)
+            if old_label is None:
+                added[sample_id] = label
+            elif old_label != label:
+                relabelled[sample_id] = (old_label, label)
+
+        return {
+            'added': added,
+            'removed': old_labels,
+            'relabelled': relabelled,
+        }
+
 
 class TrainingSample(models.Model):
     """
         A training sample used in TrainingSet to train job's classifier.
+        `removed` marks samples removed from the set in the set's revision.
     """
     set = models.ForeignKey(TrainingSet, related_name="training_samples")
     sample = models.ForeignKey(Sample)
     label = models.CharField(max_length=20, choices=LABEL_CHOICES)
+    removed = models.BooleanField(default=False)
 
     class Meta:
         unique_together = ['set', 'sample']
 
 
+class SampleFeatures(models.Model):
+    """
+        Distinct tokens extracted from a text by a tokenizer. Keyed by the
+        text's hash, so that every text is tokenized only once.
+    """
+    text_hash = models.CharField(max_length=40)
+    tokenizer = models.CharField(max_length=20)
+    tokens = models.TextField()
+
+    class Meta:
+        unique_together = ['text_hash', 'tokenizer']
+
+
+# Training request statuses breakdown:
+# TRAINING_PENDING - request waits in the queue,
+# TRAINING_RUNNING - request has been claimed by a training worker,
+# TRAINING_DONE - training has been completed,
+# TRAINING_FAILED - error occured while training.
+TRAINING_PENDING = 0
+TRAINING_RUNNING = 1
+TRAINING_DONE = 2
+TRAINING_FAILED = 3
+
+TRAINING_STATUS_CHOICES = (
+    (TRAINING_PENDING, 'Pending'),
+    (TRAINING_RUNNING, 'Running'),
+    (TRAINING_DONE, 'Done'),
+    (TRAINING_FAILED, 'Failed'),
+)
+
+# Training request priorities. Requests with lower values are served first.
+# Jobs without a trained classifier can't classify at all, hence go first.
+TRAINING_PRIORITY_INITIAL = 0
+TRAINING_PRIORITY_UPDATE = 1
+
+# Number of pending requests a worker tries to claim before giving up.
+TRAINING_CLAIM_CANDIDATES = 10
+
+# Default number of workers a training request may kill before it's given up.
+DEFAULT_TRAINING_MAX_ATTEMPTS = 3
+
+
+class TrainingRequestManager(models.Manager):
+    """
+        Queue of classifier trainings served by training workers.
+    """
+    def enqueue(self, training_set):
+        """
+            Queues training of job's classifier on `training_set`. A job has
+            at most one pending request - if there is one, it's pointed at
+            the new set, so that superseded sets aren't trained on.
+        """
+        job = training_set.job
+        pending = self.filter(job=job, status=TRAINING_PENDING)
+        if pending.filter(training_set__id__gte=training_set.id).exists():
+            return
+
+        with event_transaction():
+            superseded = pending.update(
+                training_set=training_set,
+                superseded=F('superseded') + 1,
+            )
+            if not superseded:
+                priority = TRAINING_PRIORITY_INITIAL
+                if job.is_classifier_trained():
+                    priority = TRAINING_PRIORITY_UPDATE
+                self.create(job=job, training_set=training_set,
+                    priority=priority)
+
+    def claim(self, worker):
+        """
+            Claims the next pending request for `worker`. Requests of jobs
+            being trained already are skipped. Returns None if there is
+            nothing to train.
+        """
+        running = self.filter(status=TRAINING_RUNNING).values_list('job_id',
+            flat=True)
+        candidates = self.filter(status=TRAINING_PENDING).exclude(
+            job__id__in=list(running)).order_by('priority', 'created', 'id')
+
+        for request_id in candidates.values_list('id', flat=True)[
+                :TRAINING_CLAIM_CANDIDATES]:
+            # Conditional update makes sure only one worker claims a request.
+            claimed = self.filter(id=request_id,
+                status=TRAINING_PENDING).update(
+                    status=TRAINING_RUNNING,
+                    worker=worker,
+                    started=now(),
+                )
+            if claimed:
+                return self.select_related('training_set').get(id=request_id)
+        return None
+
+    def requeue(self, worker_prefix):
+        """
+            Returns requests left running by dead workers, whose names start
+            with `worker_prefix`, to the queue.
+        """
+        return self.filter(status=TRAINING_RUNNING,
+            worker__startswith=worker_prefix).update(
+                status=TRAINING_PENDING,
+                worker='',
+                started=None,
+            )
+
+    def requeue_worker(self, worker, max_attempts=None):
+        """
+            Returns requests left running by dead `worker` to the queue.
+            Requests that have killed `max_attempts` workers are marked as
+            failed instead, so that they don't take the pool down forever.
+            Returns number of requeued requests and list of failed ones.
+        """
+        if max_attempts is None:
+            max_attempts = setting('TRAINING_MAX_ATTEMPTS',
+                DEFAULT_TRAINING_MAX_ATTEMPTS)
+        lost = self.filter(status=TRAINING_RUNNING, worker=worker)
+        failed_ids = list(lost.filter(attempts__gte=max_attempts - 1)
+            .values_list('id', flat=True))
+
+        lost.filter(id__in=failed_ids).update(
+            status=TRAINING_FAILED,
+            attempts=F('attempts') + 1,
+            error='Training killed %d workers, giving up.' % max_attempts,
+            finished=now(),
+        )
+        requeued = lost.exclude(id__in=failed_ids).update(
+            status=TRAINING_PENDING,
+            attempts=F('attempts') + 1,
+            worker='',
+            started=None,
+        )
+        return requeued, list(self.filter(id__in=failed_ids))
+
+    def stats(self, since=None):
+        """
+            Returns queue's depth and requests' wait times, in seconds.
+            Wait times are computed of requests started after `since`.
+        """
+        current = now()
+        pending = self.filter(status=TRAINING_PENDING)
+        oldest = pending.order_by('created').values_list('created',
+            flat=True)[:1]
+
+        started = self.filter(started__isnull=False)
+        if since is not None:
+            started = started.filter(started__gte=since)
+        waits = [(start - created).total_seconds()
+            for created, start in started.values_list('created', 'started')]
+
+        return {
+            'pending': pending.count(),
+            'running': self.filter(status=TRAINING_RUNNING).count(),
+            'oldest_wait': (current - oldest[0]).total_seconds()
+                if oldest else 0,
+            'started': len(waits),
+            'average_wait': sum(waits) / len(waits) if waits else 0,
+            'max_wait': max(waits) if waits else 0,
+        }
+
+
+class TrainingRequest(models.Model):
+    """
+        Request to train job's classifier on a training set, queued for
+        training workers. `superseded` counts sets replaced by newer ones
+        while the request was pending, `attempts` - workers that died while
+        training it.
+    """
+    job = models.ForeignKey(Job)
+    training_set = models.ForeignKey(TrainingSet)
+    status = models.IntegerField(default=TRAINING_PENDING,
+        choices=TRAINING_STATUS_CHOICES)
+    priority = models.IntegerField(default=TRAINING_PRIORITY_UPDATE)
+    superseded = models.IntegerField(default=0)
+    attempts = models.IntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    objects = TrainingRequestManager()
+
+    def finish(self, error=''):
+        """
+            Marks the request as done, or failed if `error` is given.
+        """
+        self.status = TRAINING_FAILED if error else TRAINING_DONE
+        self.error = error
+        self.finished = now()
+        self.save()
+
+    def get_wait_time(self):
+        """
+            Returns number of seconds the request waited in the queue.
+        """
+        if self.started is None:
+            return None
+        return (self.started - self.created).total_seconds()
+
+
+# Reclassification statuses breakdown:
+# RECLASSIFICATION_RUNNING - job's samples are being reclassified,
+# RECLASSIFICATION_DONE - all samples have been reclassified.
+RECLASSIFICATION_RUNNING = 0
+RECLASSIFICATION_DONE = 1
+
+RECLASSIFICATION_STATUS_CHOICES = (
+    (RECLASSIFICATION_RUNNING, 'Running'),
+    (RECLASSIFICATION_DONE, 'Done'),
+)
+
+
+class ReclassificationManager(models.Manager):
+    def start(self, job):
+        """
+            Starts a new reclassification of job's samples. A run in progress
+            is cancelled, as its version becomes outdated.
+        """
+        try:
+            with savepoint():
+                reclassification, created = self.get_or_create(job=job)
+        except IntegrityError:
+            # Created by another process in the meantime.
+            reclassification = self.get(job=job)
+
+        self.filter(id=reclassification.id).update(
+            version=F('version') + 1,
+            last_sample=0,
+            processed=0,
+            status=RECLASSIFICATION_RUNNING,
+            started=now(),
+            finished=None,
+        )
+        return self.get(id=reclassification.id)
+
+    def stalled(self, since):
+        """
+            Returns runs in progress that haven't advanced since `since`.
+        """
+        return self.filter(status=RECLASSIFICATION_RUNNING, updated__lt=since)
+
+
+class Reclassification(models.Model):
+    """
+        Progress of reclassification of job's samples with a new model.
+        Samples are reclassified in order of their ids, `last_sample` being
+        the last one done, so that an interrupted run can be resumed.
+        Every new run gets a new `version`, which cancels older runs.
+    """
+    job = models.OneToOneField(Job)
+    version = models.IntegerField(default=0)
+    status = models.IntegerField(default=RECLASSIFICATION_DONE,
+        choices=RECLASSIFICATION_STATUS_CHOICES)
+    last_sample = models.IntegerField(default=0)
+    processed = models.IntegerField(default=0)
+    started = models.DateTimeField(null=True, blank=True)
+    updated = models.DateTimeField(auto_now=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    objects = ReclassificationManager()
+
+    def advance(self, last_sample, processed):
+        """
+            Moves run's cursor past `last_sample`. Returns False if the run
+            has been superseded by a newer one, and should stop.
+        """
+        advanced = Reclassification.objects.filter(id=self.id,
+            version=self.version).update(
+                last_sample=last_sample,
+                processed=F('processed') + processed,
+                updated=now(),
+            )
+        if advanced:
+            self.last_sample = last_sample
+            self.processed += processed
+        return bool(advanced)
+
+    def finish(self):
+        """
+            Marks the run as done. Returns False if it has been superseded.
+        """
+        return bool(Reclassification.objects.filter(id=self.id,
+            version=self.version).update(
+                status=RECLASSIFICATION_DONE,
+                finished=now(),
+            ))
+
+    def is_current(self):
+        return Reclassification.objects.filter(id=self.id,
+            version=self.version).exists()
+
+
+# Pending requests older than this aren't joined by new requests for the same
+# url, in case their classification has been lost.
+CLASSIFY_COALESCE_WINDOW = datetime.timedelta(minutes=10)
+
+# Marks that version of job's current classifier is to be resolved by
+# ClassifiedSampleManager.create_by_owner.
+CURRENT_VERSION = object()
+
+
 class ClassifiedSampleManager(models.Manager):
     def _sanitize(self, args, kwargs):
         """
@@ -95,6 +601,17 @@ class ClassifiedSampleManager(models.Manager):
         kwargs['url'] = sanitize_url(kwargs['url'])
 
     def create_by_owner(self, *args, **kwargs):
+        """
+            Creates a classification request. Unless `classify` is False,
+            request of an existing sample is classified at once.
+
+            Callers creating many requests pass `version` of job's current
+            classifier and whether the request is `coalesced`, so that they
+            aren't resolved per request.
+        """
+        classify = kwargs.pop('classify', True)
+        coalesced = kwargs.pop('coalesced', None)
+        version = kwargs.pop('version', CURRENT_VERSION)
         self._sanitize(args, kwargs)
         kwargs['source_type'] = SAMPLE_SOURCE_OWNER
         kwargs['source_val'] = ''
@@ -106,11 +623,36 @@ class ClassifiedSampleManager(models.Manager):
         except Sample.DoesNotExist:
             pass
 
-        classified_sample = self.create(**kwargs)
-        # If sample exists, step immediately to classification
+        # Current classifier's result of the sample's text is reused.
         if 'sample' in kwargs:
-            send_event('EventNewClassifySample',
-                sample_id=classified_sample.id)
+            # Possible loop imports here
+            from urlannotator.classification.results import (
+                get_current_version, get_cached_result)
+            if version is CURRENT_VERSION:
+                version = get_current_version(kwargs['job'])
+            result = get_cached_result(kwargs['job'].id, version,
+                kwargs['sample'].text)
+            if result is not None:
+                kwargs['label'], label_probability = result
+                kwargs['label_probability'] = json.dumps(label_probability)
+
+        classified_sample = self.create(**kwargs)
+        if coalesced is None and not classified_sample.label:
+            coalesced = self.is_coalesced(classified_sample)
+
+        if classified_sample.label:
+            send_event('EventSampleClassified',
+                job_id=classified_sample.job_id,
+                class_id=classified_sample.id,
+                sample_id=classified_sample.sample_id)
+        elif coalesced:
+            # An earlier request's classification gives the result.
+            pass
+        elif 'sample' in kwargs:
+            # If sample exists, step immediately to classification
+            if classify:
+                send_event('EventNewClassifySample',
+                    sample_id=classified_sample.id)
         else:
             Sample.objects.create_by_owner(
                 job_id=kwargs['job'].id,
@@ -121,6 +663,64 @@ class ClassifiedSampleManager(models.Manager):
 
         return classified_sample
 
+    def get_pending_urls(self, job, urls):
+        """
+            Returns a set of given urls that have recent requests of the job
+            pending, which new requests of the urls are coalesced with.
+        """
+        since = now() - CLASSIFY_COALESCE_WINDOW
+        pending = set()
+        for urls_chunk in chunks(urls, BULK_QUERY_SIZE):
+            pending.update(self.filter(
+                job=job,
+                url__in=urls_chunk,
+                label='',
+                added_on__gte=since,
+            ).values_list('url', flat=True))
+        return pending
+
+    def create_many_by_owner(self, job, urls):
+        """
+            Creates classification requests of given urls. Requests of
+            existing samples are classified together, in batches, instead of
+            a task per request. Returns a list of created requests.
+        """
+        # Possible loop imports here
+        from urlannotator.classification.results import get_current_version
+
+        urls = [sanitize_url(url) for url in urls]
+        version = get_current_version(job)
+        pending = self.get_pending_urls(job, urls)
+        with event_transaction():
+            class_samples = []
+            for url in urls:
+                class_sample = self.create_by_owner(job=job, url=url,
+                    label='', classify=False, version=version,
+                    coalesced=url in pending)
+                class_samples.append(class_sample)
+                if not class_sample.label:
+                    # Later requests of the url join this one.
+                    pending.add(url)
+            if any(class_sample.sample_id and not class_sample.label
+                    for class_sample in class_samples):
+                send_event('EventClassifyPending', job_id=job.id)
+        return class_samples
+
+    def is_coalesced(self, classified_sample):
+        """
+            Returns whether a recent, earlier request for the same job's url
+            is still pending. Its classification gives result to all pending
+            requests of the url.
+        """
+        since = now() - CLASSIFY_COALESCE_WINDOW
+        return self.filter(
+            job=classified_sample.job_id,
+            url=classified_sample.url,
+            label='',
+            added_on__gte=since,
+            id__lt=classified_sample.id,
+        ).exists()
+
 # Classified samples' status breakdown:
 # PENDING - The sample is being created or classified. If
 #           ClassifiedSample.sample is not none, the sample is being classified
@@ -145,6 +745,9 @@ class ClassifiedSampleCore(models.Model):
         LABEL_NO: 0.0,
         LABEL_BROKEN: 0.0,
     }))
+    # Training set of the model the sample was classified with.
+    training_set = models.ForeignKey(TrainingSet, blank=True, null=True,
+        on_delete=models.SET_NULL)
     added_on = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -205,3 +808,31 @@ class ClassifiedSampleCore(models.Model):
 
 class ClassifiedSample(ClassifiedSampleCore):
     objects = ClassifiedSampleManager()
+
+
+def update_classified_samples(class_samples):
+    """
+        Stores labels, label probabilities and training sets of given
+        classified samples (ClassifiedSample or BeatTheMachineSample
+        instances) with as few update queries as possible. Samples sharing
+        the same result are updated together.
+    """
+    groups = {}
+    for class_sample in class_samples:
+        probability = class_sample.label_probability
+        if not isinstance(probability, basestring):
+            probability = json.dumps(probability, sort_keys=True)
+
+        key = (class_sample.__class__, class_sample.label, probability,
+            class_sample.training_set_id)
+        groups.setdefault(key, []).append(class_sample.id)
+
+    with event_transaction():
+        for (model, label, probability, training_set_id), ids in \
+                groups.iteritems():
+            for ids_chunk in chunks(ids, BULK_QUERY_SIZE):
+                model.objects.filter(id__in=ids_chunk).update(
+                    label=label,
+                    label_probability=probability,
+                    training_set=training_set_id,
+                )
@@ -0,0 +1,62 @@
+import json
+
+from django.core.cache import get_cache
+
+from urlannotator.classification.features import text_hash
+from urlannotator.tools.utils import setting
+
+# Default number of seconds classification results are cached for. Results
+# are keyed by classifier's version, so they don't need to expire when
+# the model changes.
+DEFAULT_RESULT_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def get_result_cache():
+    return get_cache(setting('CLASSIFICATION_RESULT_CACHE', 'memcache'))
+
+
+def get_current_version(job):
+    """
+        Returns version of job's current classifier, or None if it isn't
+        trained or its version is unknown. Resolve it once for many results
+        of the job - it builds the classifier.
+    """
+    if not job.is_classifier_trained():
+        return None
+
+    # Possible loop imports here
+    from urlannotator.classification.factories import classifier_factory
+    return classifier_factory.create_classifier(job.id).get_version()
+
+
+def result_key(job_id, version, text):
+    return 'classification-result-%d-%s-%s' % (job_id, version,
+        text_hash(text or ''))
+
+
+def get_cached_result(job_id, version, text):
+    """
+        Returns a tuple (label, label_probability) the job's classifier of
+        given version has given to `text`, or None if it's not cached.
+    """
+    if version is None:
+        return None
+    return get_result_cache().get(result_key(job_id, version, text))
+
+
+def cache_result(job_id, version, text, label, label_probability):
+    """
+        Caches the result job's classifier of given version has given to
+        `text`. Results of classifiers with unknown version aren't cached.
+    """
+    if version is None or label is None:
+        return
+
+    if isinstance(label_probability, basestring):
+        label_probability = json.loads(label_probability)
+    get_result_cache().set(
+        result_key(job_id, version, text),
+        (label, label_probability),
+        setting('CLASSIFICATION_RESULT_CACHE_TIMEOUT',
+            DEFAULT_RESULT_CACHE_TIMEOUT),
+    )
@@ -0,0 +1,166 @@
+import json
+import math
+
+from django.db.models import Count
+
+from urlannotator.classification.models import ClassifiedSample, BULK_QUERY_SIZE
+from urlannotator.crowdsourcing.models import SampleMapping
+from urlannotator.tools.utils import setting, chunks
+
+# Default strategy selecting samples sent for voting. Has to be a valid key of
+# SELECTION_STRATEGIES.
+DEFAULT_SELECTION_STRATEGY = 'UncertaintySelection'
+
+# Default measure of sample's uncertainty. Has to be a valid key of
+# UNCERTAINTY_MEASURES.
+DEFAULT_UNCERTAINTY_MEASURE = 'margin'
+
+# Maximum number of job's oldest unmapped samples ranked by uncertainty.
+CANDIDATES_PER_JOB = 500
+
+# Uncertainty of samples that haven't been classified yet. Nothing is known
+# about them, so they are as uncertain as it gets.
+UNKNOWN_UNCERTAINTY = 1.0
+
+
+def margin_uncertainty(probabilities):
+    """
+        Returns 1 less the difference between two most probable labels'
+        probabilities.
+    """
+    values = sorted(probabilities.values(), reverse=True) + [0.0, 0.0]
+    return 1.0 - (values[0] - values[1])
+
+
+def entropy_uncertainty(probabilities):
+    """
+        Returns entropy of labels' probabilities, normalized to [0, 1].
+    """
+    values = [value for value in probabilities.values() if value > 0]
+    if len(probabilities) < 2:
+        return 0.0
+    entropy = -sum(value * math.log(value) for value in values)
+    return entropy / math.log(len(probabilities))
+
+
+UNCERTAINTY_MEASURES = {
+    'margin': margin_uncertainty,
+    'entropy': entropy_uncertainty,
+}
+
+
+class SelectionStrategy(object):
+    """
+        Selects samples sent for voting out of candidates.
+    """
+    def select(self, candidates, limit):
+        """
+            Returns at most `limit` samples out of `candidates` queryset.
+        """
+        raise NotImplementedError
+
+
+class FirstComeSelection(SelectionStrategy):
+    """
+        Selects samples in order of their jobs and creation.
+    """
+    def select(self, candidates, limit):
+        return list(candidates.order_by('job', 'id')[:limit])
+
+
+class UncertaintySelection(SelectionStrategy):
+    """
+        Selects samples the current model of their job is least certain of,
+        as their labels improve the model the most. Jobs take turns, the ones
+        that had fewer samples voted on going first, so that every job gets
+        its share of votes.
+    """
+    def __init__(self, measure=None, candidates_per_job=CANDIDATES_PER_JOB):
+        measure = measure or setting('VOTING_UNCERTAINTY_MEASURE',
+            DEFAULT_UNCERTAINTY_MEASURE)
+        self.measure = UNCERTAINTY_MEASURES[measure]
+        self.candidates_per_job = candidates_per_job
+
+    def get_uncertainty(self, samples):
+        """
+            Returns a dictionary sample id -> uncertainty of the sample's
+            newest classification.
+        """
+        probabilities = {}
+        for ids_chunk in chunks([sample.id for sample in samples],
+                BULK_QUERY_SIZE):
+            classified = ClassifiedSample.objects.filter(
+                sample__id__in=ids_chunk).exclude(label='').order_by(
+                'id').values_list('sample_id', 'label_probability')
+            for sample_id, probability in classified:
+                probabilities[sample_id] = probability
+
+        uncertainty = {}
+        for sample in samples:
+            probability = probabilities.get(sample.id)
+            if isinstance(probability, basestring):
+                probability = json.loads(probability)
+            if probability:
+                uncertainty[sample.id] = self.measure(probability)
+            else:
+                uncertainty[sample.id] = UNKNOWN_UNCERTAINTY
+        return uncertainty
+
+    def rank(self, samples):
+        """
+            Returns samples sorted from the most uncertain one. Ties are
+            broken by age.
+        """
+        uncertainty = self.get_uncertainty(samples)
+        return sorted(samples,
+            key=lambda sample: (-uncertainty[sample.id], sample.id))
+
+    def get_jobs_order(self, job_ids):
+        """
+            Returns job ids sorted by the number of samples sent for voting.
+        """
+        mapped = SampleMapping.objects.filter(
+            sample__job__id__in=job_ids).values('sample__job').annotate(
+            count=Count('id'))
+        counts = dict((entry['sample__job'], entry['count'])
+            for entry in mapped)
+        return sorted(job_ids, key=lambda job_id: (counts.get(job_id, 0),
+            job_id))
+
+    def select(self, candidates, limit):
+        job_ids = set(candidates.order_by().values_list('job', flat=True))
+        ranked = {}
+        for job_id in job_ids:
+            samples = list(candidates.filter(job__id=job_id).order_by('id')
+                [:self.candidates_per_job])
+            ranked[job_id] = self.rank(samples)
+
+        # Jobs take turns in picking their most uncertain sample.
+        order = self.get_jobs_order(list(job_ids))
+        selected = []
+        turn = 0
+        while len(selected) < limit and order:
+            remaining = []
+            for job_id in order:
+                if len(selected) == limit:
+                    break
+                if turn < len(ranked[job_id]):
+                    selected.append(ranked[job_id][turn])
+                    remaining.append(job_id)
+            order = remaining
+            turn += 1
+        return selected
+
+
+SELECTION_STRATEGIES = {
+    'FirstComeSelection': FirstComeSelection,
+    'UncertaintySelection': UncertaintySelection,
+}
+
+
+def get_selection_strategy():
+    """
+        Returns strategy configured with VOTING_SELECTION_STRATEGY setting.
+    """
+    name = setting('VOTING_SELECTION_STRATEGY', DEFAULT_SELECTION_STRATEGY)
+    return SELECTION_STRATEGIES[name]()
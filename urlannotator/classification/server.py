@@ -0,0 +1,132 @@
+import json
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+from django.db import connection
+
+from urlannotator.classification.client import SAMPLE_CLASSIFIED, SAMPLE_BTM
+from urlannotator.classification.factories import classifier_factory
+from urlannotator.classification.model_cache import model_cache
+from urlannotator.classification.models import ClassifiedSample
+from urlannotator.crowdsourcing.models import BeatTheMachineSample
+
+import logging
+log = logging.getLogger(__name__)
+
+SAMPLE_MODELS = {
+    SAMPLE_CLASSIFIED: ClassifiedSample,
+    SAMPLE_BTM: BeatTheMachineSample,
+}
+
+
+class ResidentClassifiers(object):
+    """
+        Keeps jobs' classifiers constructed. Classifier247 looks its reader up
+        under the 24/7 reader lock on every call, so a missed `reload` never
+        leaves the server classifying with a switched out model. A job's
+        classifier is reconstructed after `reload`.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.classifiers = {}
+
+    def get(self, job_id):
+        with self.lock:
+            classifier = self.classifiers.get(job_id)
+        if classifier is None:
+            classifier = classifier_factory.create_classifier(job_id)
+            with self.lock:
+                self.classifiers[job_id] = classifier
+        return classifier
+
+    def reload(self, job_id):
+        with self.lock:
+            self.classifiers.pop(job_id, None)
+
+    def call(self, job_id, method, *args):
+        return getattr(self.get(job_id), method)(*args)
+
+    def jobs(self):
+        with self.lock:
+            return self.classifiers.keys()
+
+
+class ClassificationRequestHandler(BaseHTTPRequestHandler):
+    """
+        Dispatches JSON-encoded POST requests to server's routes.
+    """
+    def respond(self, code, data):
+        body = json.dumps(data)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        route = self.server.routes.get(self.path)
+        if route is None:
+            self.respond(404, {'error': 'Unknown path %s.' % self.path})
+            return
+
+        try:
+            length = int(self.headers.getheader('content-length', 0))
+            params = json.loads(self.rfile.read(length) or '{}')
+            self.respond(200, route(**params))
+        except Exception, e:
+            log.exception('Classification server failed on %s.' % self.path)
+            self.respond(500, {'error': str(e)})
+        finally:
+            # Every request is handled in a new thread, with its own
+            # connection.
+            connection.close()
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+
+class ClassificationServer(ThreadingMixIn, HTTPServer):
+    """
+        HTTP server keeping jobs' classifiers and their models in memory.
+        Routes:
+            /classify - classifies a single sample,
+            /classify_batch - classifies a list of ClassifiedSamples,
+            /reload - drops job's classifier after its model has changed,
+            /status - returns loaded jobs and model cache stats.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        HTTPServer.__init__(self, address, ClassificationRequestHandler)
+        self.classifiers = ResidentClassifiers()
+        self.routes = {
+            '/classify': self.classify,
+            '/classify_batch': self.classify_batch,
+            '/reload': self.reload,
+            '/status': self.status,
+        }
+
+    def classify(self, job_id, sample_id, kind=SAMPLE_CLASSIFIED):
+        sample = SAMPLE_MODELS[kind].objects.select_related('sample').get(
+            id=sample_id)
+        label = self.classifiers.call(job_id, 'classify', sample)
+        return {'label': label}
+
+    def classify_batch(self, job_id, sample_ids):
+        samples = ClassifiedSample.objects.select_related('sample').in_bulk(
+            sample_ids)
+        samples = [samples[sample_id] for sample_id in sample_ids]
+        labels = self.classifiers.call(job_id, 'classify_batch', samples)
+        return {'labels': labels}
+
+    def reload(self, job_id):
+        self.classifiers.reload(job_id)
+        return {}
+
+    def status(self):
+        return {
+            'jobs': self.classifiers.jobs(),
+            'model_cache': model_cache.stats(),
+        }
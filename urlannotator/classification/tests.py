@@ -1,7 +1,14 @@
+import json
+import os
 import shutil
+import tempfile
 import time
 import mock
+import nltk
+import numpy
+import requests
 
+from django.core.cache.backends.locmem import LocMemCache
 from django.test import TestCase, TransactionTestCase
 from django.test.utils import override_settings
 from django.contrib.auth.models import User
@@ -11,15 +18,34 @@ from urlannotator.main.models import (Sample, Job, Worker, LABEL_YES, LABEL_NO,
 from urlannotator.main.factories import JobFactory
 from urlannotator.classification.classifiers import (Classifier247,
     Classifier as ClassifierObject, ClassifierTrainingCriticalError,
-    ClassifierTrainingError, CLASS_TRAIN_STATUS_DONE,
-    CLASS_TRAIN_STATUS_RUNNING)
+    ClassifierTrainingError, ClassifierLocked, NaiveBayesClassifier,
+    CLASS_TRAIN_STATUS_DONE, CLASS_TRAIN_STATUS_RUNNING, tree_predict_proba)
 from urlannotator.classification.models import (TrainingSet, Classifier,
-    ClassifiedSample, ClassifierPerformance)
+    ClassifiedSample, ClassifierPerformance, SampleFeatures, TrainingRequest,
+    TRAINING_PENDING, TRAINING_RUNNING, TRAINING_DONE, TRAINING_FAILED,
+    Reclassification, RECLASSIFICATION_DONE)
+from urlannotator.classification.training import run_request, TrainingPool
 from urlannotator.classification.factories import classifier_factory
-from urlannotator.classification.event_handlers import process_votes
+from urlannotator.tools.synchronization import RWSynchronize247
+from urlannotator.classification.model_cache import ModelCache
+from urlannotator.classification.artifacts import (write_artifact,
+    read_artifact, is_artifact)
+from urlannotator.classification.features import (FeatureStore,
+    FeatureSpace, HashedFeatureMatrix, text_hash)
+from urlannotator.classification.evaluation import (make_folds, roc_auc,
+    cross_validate)
+from urlannotator.classification.selection import (UncertaintySelection,
+    FirstComeSelection, margin_uncertainty, entropy_uncertainty)
+from urlannotator.classification.event_handlers import (process_votes,
+    reclassify, classify, finish_training)
+from urlannotator.classification.client import (call_server,
+    ClassificationServerUnavailable)
+from urlannotator.classification.server import ClassificationServer
+from urlannotator.classification.management.commands.benchmark_classifiers \
+    import generate_corpus
 from urlannotator.crowdsourcing.event_handlers import initialize_external_job
 from urlannotator.crowdsourcing.models import (WorkerQualityVote,
-    BeatTheMachineSample)
+    BeatTheMachineSample, SampleMapping)
 from urlannotator.flow_control.test import FlowControlMixin, ToolsMockedMixin
 from urlannotator.flow_control import send_event
 from urlannotator.logging.models import LogEntry
@@ -72,6 +98,88 @@ class Classifier247Tests(ToolsMockedMixin, TestCase):
         training_set = self.job.trainingset_set.all()[0]
         self.classifier247.update(training_set.training_samples.all())
 
+    def testSubclassifiersCache(self):
+        test_sample = self.classified[0]
+        cache = mock.patch.dict(
+            'urlannotator.classification.classifiers._subclassifiers',
+            clear=True)
+        cache.start()
+        version = mock.patch.object(RWSynchronize247, 'get_version',
+            return_value=1)
+        version.start()
+        load = mock.patch.object(Classifier247, 'load_subclassifiers',
+            autospec=True, side_effect=Classifier247.load_subclassifiers)
+        load_mock = load.start()
+        try:
+            self.classifier247.classify(test_sample)
+            self.classifier247.classify(test_sample)
+            self.assertEqual(load_mock.call_count, 1)
+
+            # Switch changes the version
+            RWSynchronize247.get_version.return_value = 2
+            self.classifier247.classify(test_sample)
+            self.assertEqual(load_mock.call_count, 2)
+
+            # Unknown version is never cached
+            RWSynchronize247.get_version.return_value = None
+            self.classifier247.classify(test_sample)
+            self.classifier247.classify(test_sample)
+            self.assertEqual(load_mock.call_count, 4)
+        finally:
+            load.stop()
+            version.stop()
+            cache.stop()
+
+    def testClassifyLocked(self):
+        test_sample = self.classified[0]
+        sync247 = self.classifier247.sync247
+        self.classifier247.lock_timeout = 0.1
+
+        # Classification gives up while the classifier is being switched.
+        sync247.modified_lock()
+        try:
+            with sync247.switch():
+                with self.assertRaises(ClassifierLocked):
+                    self.classifier247.classify(test_sample)
+        finally:
+            sync247.modified_release()
+        self.assertNotEqual(self.classifier247.classify(test_sample), None)
+
+    def testPendingSwitch(self):
+        training_set = self.job.trainingset_set.all()[0]
+        entry = Classifier.objects.get(id=self.classifier247.id)
+        reader_id = entry.parameters['reader']
+
+        target = 'urlannotator.classification.classifiers.SimpleClassifier.get_train_status'
+        with mock.patch(target, return_value=CLASS_TRAIN_STATUS_RUNNING):
+            with mock.patch(
+                    'urlannotator.classification.classifiers.CLASS247_TRAIN_STEP',
+                    new=0):
+                self.assertFalse(self.classifier247.train(
+                    set_id=training_set.id))
+            entry = Classifier.objects.get(id=self.classifier247.id)
+            self.assertEqual(entry.parameters['pending_set'], training_set.id)
+            self.assertEqual(entry.parameters['reader'], reader_id)
+
+            # Still running
+            self.assertFalse(self.classifier247.finish_training())
+
+        # Locked by a training - skipped instead of waiting for it.
+        sync247 = self.classifier247.sync247
+        sync247.modified_lock()
+        try:
+            self.assertFalse(self.classifier247.finish_training())
+        finally:
+            sync247.modified_release()
+        entry = Classifier.objects.get(id=self.classifier247.id)
+        self.assertEqual(entry.parameters['pending_set'], training_set.id)
+
+        finish_training.delay(job_id=self.job.id)
+        entry = Classifier.objects.get(id=self.classifier247.id)
+        self.assertFalse('pending_set' in entry.parameters)
+        self.assertNotEqual(entry.parameters['reader'], reader_id)
+        self.assertFalse(self.classifier247.finish_training())
+
     def testTrainingErrors(self):
         training_set = self.job.trainingset_set.all()[0]
 
@@ -157,6 +265,25 @@ class Classifier247Tests(ToolsMockedMixin, TestCase):
 
         patch_time.stop()
 
+    def testLocksUnlinkedOnDelete(self):
+        job_id = self.job.id
+        with mock.patch.object(RWSynchronize247, 'unlink') as unlink, \
+                mock.patch('urlannotator.main.models.unlink_locks') as locks, \
+                mock.patch('urlannotator.main.models.unlink_singletons') \
+                as singletons:
+            # Finished jobs are still read, their locks stay.
+            self.job.complete()
+            self.assertFalse(unlink.called)
+            self.assertFalse(locks.called)
+            self.assertFalse(singletons.called)
+
+            self.job.delete()
+            self.assertEqual(unlink.call_count, 1)
+            names = locks.call_args[0][0]
+            self.assertIn('job-%d-mutex' % job_id, names)
+            singletons.assert_called_once_with(
+                ['classify-pending-%d' % job_id])
+
 
 class ClassifierTests(TestCase):
     def testClassifier(self):
@@ -168,6 +295,7 @@ class ClassifierTests(TestCase):
         self.assertRaises(NotImplementedError, classifier.analyze)
         self.assertRaises(NotImplementedError, classifier.get_train_status)
         self.assertRaises(NotImplementedError, classifier.classify_with_info, [0])
+        self.assertRaises(NotImplementedError, classifier.classify_batch, [0])
 
 
 class SimpleClassifierTests(ToolsMockedMixin, TestCase):
@@ -221,6 +349,16 @@ class SimpleClassifierTests(ToolsMockedMixin, TestCase):
         self.assertNotEqual(sc.classify(test_sample), None)
         self.assertNotEqual(sc.classify_with_info(test_sample), None)
 
+        # Probabilities are label frequencies in the tree's leaf, also of
+        # the model read from its file.
+        probability = json.loads(test_sample.label_probability)
+        self.assertNotEqual(probability, sc.get_default_probabilities())
+        self.assertAlmostEqual(sum(probability.values()), 1.0, places=2)
+        sc.classifier = sc.read_classifier(sc.get_file_name())
+        features = sc.get_samples_features([test_sample.sample],
+            model=sc.classifier)
+        self.assertEqual(sc.get_label_probabilities(features), [probability])
+
         shutil.rmtree('simple-classifiers', ignore_errors=True)
         sc = classifier_factory.create_classifier_from_id(sc_id)
 
@@ -265,6 +403,691 @@ class SimpleClassifierTests(ToolsMockedMixin, TestCase):
         self.assertNotEqual(sc.classify_with_info(btm_sample), None)
 
 
+class NaiveBayesClassifierTests(ToolsMockedMixin, TestCase):
+
+    def setUp(self):
+        self.u = User.objects.create_user(username='testing', password='test')
+
+        self.job = Job.objects.create_active(
+            account=self.u.get_profile(),
+            gold_samples=[{'url': '10clouds.com', 'label': LABEL_YES}])
+
+        self.train_data = [
+            Sample.objects.create(job=self.job, source_type='', url='a.com',
+                text='Mechanical squirrel screwdriver over car'),
+            Sample.objects.create(job=self.job, source_type='', url='b.com',
+                text='Screwdriver fix mechanical bike bolts'),
+            Sample.objects.create(job=self.job, source_type='', url='c.com',
+                text='Brown banana apple pinapple potato'),
+            Sample.objects.create(job=self.job, source_type='', url='d.com',
+                text='apple pinapple potato'),
+        ]
+        self.labels = [LABEL_YES, LABEL_YES, LABEL_NO, LABEL_NO]
+        self.training_set = TrainingSet.objects.create(job=self.job)
+        for idx, sample in enumerate(self.train_data):
+            self.training_set.training_samples.create(
+                sample=sample,
+                label=self.labels[idx],
+            )
+
+    def tearDown(self):
+        shutil.rmtree('bayes-classifiers', ignore_errors=True)
+
+    def testNaiveBayesClassifier(self):
+        nb_id = classifier_factory.initialize_classifier(
+            job_id=self.job.id,
+            classifier_name='NaiveBayesClassifier',
+            main=False,
+        )
+        nb = classifier_factory.create_classifier_from_id(nb_id)
+
+        # Not trained yet
+        test_sample = ClassifiedSample.objects.create(
+            job=self.job,
+            sample=self.train_data[0],
+            url=self.train_data[0].url,
+        )
+        self.assertEqual(nb.classify(test_sample), None)
+
+        nb.train(set_id=self.training_set.id)
+        self.assertEqual(nb.get_train_status(), CLASS_TRAIN_STATUS_DONE)
+        self.assertTrue(is_artifact(nb.get_file_name()))
+
+        self.assertEqual(nb.classify(test_sample), LABEL_YES)
+        test_sample = ClassifiedSample.objects.get(id=test_sample.id)
+        self.assertEqual(test_sample.label, LABEL_YES)
+        self.assertEqual(test_sample.training_set_id, self.training_set.id)
+        probability = test_sample.label_probability
+        self.assertAlmostEqual(sum(probability.values()), 1.0, places=2)
+
+        info = nb.classify_with_info(test_sample)
+        self.assertEqual(info['label'], LABEL_YES)
+
+        test_sample = ClassifiedSample.objects.create(
+            job=self.job,
+            sample=self.train_data[3],
+            url=self.train_data[3].url,
+        )
+        self.assertEqual(nb.classify(test_sample), LABEL_NO)
+
+    def testNaiveBayesBatch(self):
+        nb_id = classifier_factory.initialize_classifier(
+            job_id=self.job.id,
+            classifier_name='NaiveBayesClassifier',
+            main=False,
+        )
+        nb = classifier_factory.create_classifier_from_id(nb_id)
+
+        class_samples = [
+            ClassifiedSample.objects.create(
+                job=self.job,
+                sample=sample,
+                url=sample.url,
+            ) for sample in self.train_data
+        ]
+        self.assertEqual(nb.classify_batch(class_samples),
+            [None] * len(class_samples))
+
+        nb.train(set_id=self.training_set.id)
+        self.assertEqual(nb.classify_batch(class_samples), self.labels)
+
+        for class_sample, label in zip(class_samples, self.labels):
+            class_sample = ClassifiedSample.objects.get(id=class_sample.id)
+            self.assertEqual(class_sample.label, label)
+            self.assertEqual(class_sample.training_set_id,
+                self.training_set.id)
+            self.assertTrue(class_sample.label_probability[label] > 0.5)
+
+    def testNaiveBayesAnalyze(self):
+        nb_id = classifier_factory.initialize_classifier(
+            job_id=self.job.id,
+            classifier_name='NaiveBayesClassifier',
+            main=False,
+        )
+        nb = classifier_factory.create_classifier_from_id(nb_id)
+        nb.train(set_id=self.training_set.id)
+
+        # Every sample is predicted by a model trained on the other three.
+        description = nb.analyze()['modelDescription']
+        self.assertEqual(description['folds'], len(self.train_data))
+        matrix = description['confusionMatrix']
+        self.assertEqual(matrix[LABEL_YES][LABEL_YES], 2)
+        self.assertEqual(matrix[LABEL_YES][LABEL_NO], 0)
+        self.assertEqual(matrix[LABEL_NO][LABEL_NO], 2)
+        self.assertEqual(matrix[LABEL_NO][LABEL_YES], 0)
+        self.assertEqual(description['rocAuc'], 1.0)
+
+    def testNaiveBayesFeatureSpace(self):
+        nb_id = classifier_factory.initialize_classifier(
+            job_id=self.job.id,
+            classifier_name='NaiveBayesClassifier',
+            main=False,
+        )
+        entry = Classifier.objects.get(id=nb_id)
+        entry.parameters['features'] = {'dimension': 1024, 'ngrams': 2,
+            'min_df': 2}
+        entry.save()
+
+        nb = classifier_factory.create_classifier_from_id(nb_id)
+        nb.train(set_id=self.training_set.id)
+
+        # Only words and bigrams shared by two samples are kept:
+        # mechanical, screwdriver, apple, pinapple, potato, apple|pinapple,
+        # pinapple|potato.
+        stats = Classifier.objects.get(id=nb_id).parameters['model_stats']
+        self.assertEqual(stats, nb.get_model_stats())
+        self.assertTrue(stats['features'] <= 7)
+        self.assertEqual(stats['dimension'], 1024)
+        self.assertTrue(stats['memory'] < 1024 * 8)
+
+        test_sample = ClassifiedSample.objects.create(
+            job=self.job,
+            sample=self.train_data[3],
+            url=self.train_data[3].url,
+        )
+        nb = classifier_factory.create_classifier_from_id(nb_id)
+        self.assertEqual(nb.classify(test_sample), LABEL_NO)
+
+    @override_settings(CLASSIFIER_UPDATE_MAX_DELTA=1.0)
+    def testNaiveBayesUpdate(self):
+        nb_id = classifier_factory.initialize_classifier(
+            job_id=self.job.id,
+            classifier_name='NaiveBayesClassifier',
+            main=False,
+        )
+        nb = classifier_factory.create_classifier_from_id(nb_id)
+        nb.train(set_id=self.training_set.id)
+
+        new_sample = Sample.objects.create(job=self.job, source_type='',
+            url='e.com', text='Hippo tree over lagoon')
+        new_set = TrainingSet.objects.create(job=self.job)
+        new_set.training_samples.create(sample=new_sample, label=LABEL_NO)
+        new_set.training_samples.create(sample=self.train_data[0],
+            label=LABEL_YES)
+        new_set.training_samples.create(sample=self.train_data[1],
+            label=LABEL_NO)
+        new_set.training_samples.create(sample=self.train_data[2],
+            label=LABEL_NO)
+
+        with mock.patch.object(NaiveBayesClassifier, 'train') as train:
+            nb.update(set_id=new_set.id)
+            self.assertFalse(train.called)
+
+        self.assertEqual(Classifier.objects.get(id=nb_id).parameters[
+            'training_set'], new_set.id)
+        nb.load_classifier()
+        updated = nb.classifier
+
+        # Incremental update gives the same model as training from scratch
+        nb.train(set_id=new_set.id)
+        trained = nb.classifier
+        self.assertTrue(numpy.array_equal(updated['class_counts'],
+            trained['class_counts']))
+        self.assertTrue(numpy.array_equal(updated['feature_counts'],
+            trained['feature_counts']))
+
+    @override_settings(CLASSIFIER_UPDATE_MAX_DELTA=0.1)
+    def testNaiveBayesUpdateFallback(self):
+        nb_id = classifier_factory.initialize_classifier(
+            job_id=self.job.id,
+            classifier_name='NaiveBayesClassifier',
+            main=False,
+        )
+        nb = classifier_factory.create_classifier_from_id(nb_id)
+        nb.train(set_id=self.training_set.id)
+
+        new_set = TrainingSet.objects.create(job=self.job)
+        new_set.training_samples.create(sample=self.train_data[0],
+            label=LABEL_NO)
+
+        with mock.patch.object(NaiveBayesClassifier, 'train') as train:
+            nb.update(set_id=new_set.id)
+            self.assertTrue(train.called)
+
+    @override_settings(TWENTYFOUR_DEFAULT_CLASSIFIER='NaiveBayesClassifier')
+    def testNaiveBayesIn247(self):
+        job = Job.objects.create_active(
+            account=self.u.get_profile(),
+            gold_samples=[{'url': '10clouds.com', 'label': LABEL_YES}],
+        )
+        classifier = classifier_factory.create_classifier(job.id)
+        self.assertEqual(classifier.__class__, Classifier247)
+        self.assertEqual(Classifier.objects.filter(
+            job=job,
+            type='NaiveBayesClassifier',
+        ).count(), 2)
+
+        cs = ClassifiedSample.objects.create_by_owner(
+            job=job,
+            url='http://google.com',
+        )
+        cs = ClassifiedSample.objects.get(id=cs.id)
+        self.assertTrue(classifier.classify(cs))
+
+
+class ClassifyPendingTests(ToolsMockedMixin, TestCase):
+
+    def testClassifyPending(self):
+        u = User.objects.create_user(username='testing', password='test')
+        job = Job.objects.create_active(
+            account=u.get_profile(),
+            gold_samples=[{'url': '10clouds.com', 'label': LABEL_YES}],
+        )
+        samples = [
+            Sample.objects.create(job=job, source_type='',
+                url='http://google.com/%d' % idx, text='test')
+            for idx in xrange(5)
+        ]
+        ClassifiedSample.objects.bulk_create(
+            ClassifiedSample(job=job, sample=sample, url=sample.url)
+            for sample in samples
+        )
+        self.assertEqual(ClassifiedSample.objects.filter(job=job,
+            label='').count(), 5)
+
+        with mock.patch(
+                'urlannotator.classification.event_handlers.CLASSIFY_BATCH_SIZE',
+                new=2):
+            send_event('EventClassifyPending', job_id=job.id)
+
+        self.assertEqual(ClassifiedSample.objects.filter(job=job,
+            label='').count(), 0)
+
+    def testCreateManyByOwner(self):
+        u = User.objects.create_user(username='testing', password='test')
+        job = Job.objects.create_active(
+            account=u.get_profile(),
+            gold_samples=[{'url': '10clouds.com', 'label': LABEL_YES}],
+        )
+        urls = ['http://google.com/%d' % idx for idx in xrange(3)]
+        for url in urls:
+            Sample.objects.create(job=job, source_type='', url=url,
+                text='test')
+
+        version = 'urlannotator.classification.results.get_current_version'
+        with mock.patch('urlannotator.classification.models.send_event') \
+                as send, mock.patch(version, return_value=1) as get_version:
+            class_samples = ClassifiedSample.objects.create_many_by_owner(
+                job=job, urls=urls)
+
+        self.assertEqual([class_sample.url for class_sample in class_samples],
+            urls)
+        # A single batch instead of a task per request.
+        send.assert_called_once_with('EventClassifyPending', job_id=job.id)
+        # Classifier's version is resolved once for all requests.
+        self.assertEqual(get_version.call_count, 1)
+
+    def testSweepAge(self):
+        u = User.objects.create_user(username='testing', password='test')
+        job = Job.objects.create_active(
+            account=u.get_profile(),
+            gold_samples=[{'url': '10clouds.com', 'label': LABEL_YES}],
+        )
+        sample = Sample.objects.create(job=job, source_type='',
+            url='http://google.com', text='test')
+        ClassifiedSample.objects.create(job=job, sample=sample,
+            url=sample.url)
+
+        # Fresh requests are left for the tasks sent along with them.
+        with override_settings(CLASSIFY_SWEEP_AGE=60):
+            send_event('EventClassifyPending')
+        self.assertEqual(ClassifiedSample.objects.filter(job=job,
+            label='').count(), 1)
+
+        with override_settings(CLASSIFY_SWEEP_AGE=-60):
+            send_event('EventClassifyPending')
+        self.assertEqual(ClassifiedSample.objects.filter(job=job,
+            label='').count(), 0)
+
+
+class ReclassificationTests(ToolsMockedMixin, TestCase):
+
+    def setUp(self):
+        u = User.objects.create_user(username='testing', password='test')
+        self.job = Job.objects.create_active(
+            account=u.get_profile(),
+            gold_samples=[{'url': '10clouds.com', 'label': LABEL_YES}],
+        )
+        self.samples = [
+            Sample.objects.create(job=self.job, source_type='',
+                url='http://google.com/%d' % idx, text='test')
+            for idx in xrange(5)
+        ]
+        # Labels given by an old model.
+        ClassifiedSample.objects.bulk_create(
+            ClassifiedSample(job=self.job, sample=sample, url=sample.url,
+                label=LABEL_NO)
+            for sample in self.samples + self.samples[:1]
+        )
+
+    def get_labels(self):
+        return [sample.get_classified_label() for sample in self.samples]
+
+    def testReclassify(self):
+        with mock.patch(
+                'urlannotator.classification.event_handlers.RECLASSIFY_CHUNK_SIZE',
+                new=2):
+            reclassify(self.job.id)
+
+        self.assertEqual(self.get_labels(), [LABEL_YES] * 5)
+        # Only the newest classification of a sample is updated.
+        self.assertEqual(ClassifiedSample.objects.filter(
+            sample=self.samples[0]).order_by('id')[0].label, LABEL_NO)
+
+        run = Reclassification.objects.get(job=self.job)
+        self.assertEqual(run.status, RECLASSIFICATION_DONE)
+        self.assertEqual(run.last_sample, self.samples[-1].id)
+        self.assertTrue(run.processed >= 5)
+
+    def testReclassifyResumeAndCancel(self):
+        run = Reclassification.objects.start(self.job)
+        Reclassification.objects.filter(id=run.id).update(
+            last_sample=self.samples[2].id)
+
+        # Run is superseded by a newer model.
+        newer = Reclassification.objects.start(self.job)
+        self.assertEqual(newer.version, run.version + 1)
+        reclassify(self.job.id, version=run.version)
+        self.assertEqual(self.get_labels(), [LABEL_NO] * 5)
+
+        # Run is resumed after its last sample.
+        Reclassification.objects.filter(id=run.id).update(
+            last_sample=self.samples[2].id)
+        reclassify(self.job.id, version=newer.version)
+        self.assertEqual(self.get_labels(), [LABEL_NO] * 3 + [LABEL_YES] * 2)
+        self.assertEqual(Reclassification.objects.get(id=run.id).status,
+            RECLASSIFICATION_DONE)
+
+
+class ClassificationReuseTests(ToolsMockedMixin, TestCase):
+
+    def setUp(self):
+        u = User.objects.create_user(username='testing', password='test')
+        self.job = Job.objects.create_active(
+            account=u.get_profile(),
+            gold_samples=[{'url': '10clouds.com', 'label': LABEL_YES}])
+
+        self.cache = LocMemCache('classification-results', {})
+        self.patches = [
+            mock.patch(
+                'urlannotator.classification.results.get_result_cache',
+                new=lambda: self.cache),
+            mock.patch.object(Classifier247, 'get_version',
+                new=lambda classifier: self.version),
+        ]
+        for patch in self.patches:
+            patch.start()
+        self.version = 1
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def testResultCache(self):
+        first = ClassifiedSample.objects.create_by_owner(
+            job=self.job,
+            url='http://google.com',
+        )
+        first = ClassifiedSample.objects.get(id=first.id)
+        self.assertTrue(first.label)
+
+        target = 'urlannotator.classification.event_handlers.classify_sample'
+        with mock.patch(target) as classify_mock:
+            # Repeated request gets the cached result at once.
+            second = ClassifiedSample.objects.create_by_owner(
+                job=self.job,
+                url='http://google.com',
+            )
+            self.assertEqual(second.label, first.label)
+            self.assertEqual(
+                ClassifiedSample.objects.get(id=second.id).label_probability,
+                first.label_probability)
+            self.assertFalse(classify_mock.called)
+
+            # New model's results aren't cached yet.
+            self.version = 2
+            classify_mock.return_value = LABEL_NO
+            third = ClassifiedSample.objects.create_by_owner(
+                job=self.job,
+                url='http://google.com',
+            )
+            self.assertTrue(classify_mock.called)
+            self.assertEqual(ClassifiedSample.objects.get(id=third.id).label,
+                LABEL_NO)
+
+    def testCoalescing(self):
+        sample = Sample.objects.create(job=self.job, source_type='',
+            url='http://google.com/', text='test')
+        ClassifiedSample.objects.bulk_create(
+            ClassifiedSample(job=self.job, sample=sample, url=sample.url)
+            for idx in xrange(3)
+        )
+        pending = list(ClassifiedSample.objects.filter(sample=sample))
+        self.assertFalse(ClassifiedSample.objects.is_coalesced(pending[0]))
+        self.assertTrue(ClassifiedSample.objects.is_coalesced(pending[2]))
+
+        # Classification of one request gives result to all of them.
+        classify(pending[0].id)
+        labels = ClassifiedSample.objects.filter(sample=sample).values_list(
+            'label', flat=True)
+        self.assertEqual(len(set(labels)), 1)
+        self.assertTrue(labels[0])
+
+
+class SampleSelectionTests(ToolsMockedMixin, TestCase):
+
+    def setUp(self):
+        u = User.objects.create_user(username='testing', password='test')
+        self.jobs = [
+            Job.objects.create_active(
+                account=u.get_profile(),
+                gold_samples=[{'url': '10clouds.com', 'label': LABEL_YES}])
+            for idx in xrange(2)
+        ]
+        self.samples = [
+            Sample.objects.create(job=job, source_type='',
+                url='http://google.com/%d/%d' % (job.id, idx), text='test')
+            for job in self.jobs for idx in xrange(3)
+        ]
+        probabilities = [0.99, 0.6, 0.9, 0.95, 0.7]
+        for sample, yes in zip(self.samples, probabilities):
+            ClassifiedSample.objects.create(job=sample.job, sample=sample,
+                url=sample.url, label=LABEL_YES,
+                label_probability=json.dumps(
+                    {LABEL_YES: yes, LABEL_NO: 1 - yes}))
+        self.candidates = Sample.objects.filter(
+            id__in=[sample.id for sample in self.samples])
+
+    def testUncertainty(self):
+        self.assertAlmostEqual(margin_uncertainty(
+            {LABEL_YES: 0.5, LABEL_NO: 0.5}), 1.0)
+        self.assertAlmostEqual(margin_uncertainty(
+            {LABEL_YES: 0.9, LABEL_NO: 0.1}), 0.2)
+        self.assertAlmostEqual(entropy_uncertainty(
+            {LABEL_YES: 0.5, LABEL_NO: 0.5}), 1.0)
+        self.assertAlmostEqual(entropy_uncertainty(
+            {LABEL_YES: 1.0, LABEL_NO: 0.0}), 0.0)
+
+    def testSelection(self):
+        first, second = self.samples[:3], self.samples[3:]
+
+        selected = FirstComeSelection().select(self.candidates, 2)
+        self.assertEqual(selected, first[:2])
+
+        # The unclassified sample is the most uncertain one. Jobs take turns.
+        selected = UncertaintySelection().select(self.candidates, 4)
+        self.assertEqual(selected, [first[1], second[2], first[2], second[1]])
+
+        # Jobs that had fewer samples voted on go first.
+        SampleMapping.objects.create(sample=first[0], external_id='1',
+            crowscourcing_type=SampleMapping.TAGASAURIS)
+        selected = UncertaintySelection(measure='entropy').select(
+            self.candidates.exclude(id=first[0].id), 1)
+        self.assertEqual(selected, [second[2]])
+
+
+class ClassificationServerTests(ToolsMockedMixin, TestCase):
+
+    def setUp(self):
+        self.u = User.objects.create_user(username='testing', password='test')
+        self.job = Job.objects.create_active(
+            account=self.u.get_profile(),
+            gold_samples=[{'url': '10clouds.com', 'label': LABEL_YES}])
+        self.server = ClassificationServer(('127.0.0.1', 0))
+
+    def tearDown(self):
+        self.server.server_close()
+
+    def testServer(self):
+        cs = ClassifiedSample.objects.create_by_owner(
+            job=self.job,
+            url='http://google.com',
+        )
+        cs = ClassifiedSample.objects.get(id=cs.id)
+        ClassifiedSample.objects.filter(id=cs.id).update(label='')
+
+        res = self.server.classify(job_id=self.job.id, sample_id=cs.id)
+        self.assertTrue(res['label'])
+        self.assertEqual(ClassifiedSample.objects.get(id=cs.id).label,
+            res['label'])
+        self.assertEqual(self.server.status()['jobs'], [self.job.id])
+        # The reader is looked up by the 24/7 classifier on every call.
+        self.assertEqual(self.server.classifiers.get(self.job.id).__class__,
+            Classifier247)
+
+        res = self.server.classify_batch(job_id=self.job.id,
+            sample_ids=[cs.id])
+        self.assertEqual(len(res['labels']), 1)
+
+        self.server.reload(job_id=self.job.id)
+        self.assertEqual(self.server.status()['jobs'], [])
+
+    def testClientFallback(self):
+        self.assertRaises(ClassificationServerUnavailable, call_server,
+            '/status')
+
+        target = 'urlannotator.classification.client._unavailable_until'
+        with override_settings(CLASSIFICATION_SERVER_ENABLED=True):
+            with mock.patch(target, new=[0]):
+                with mock.patch('requests.post',
+                        side_effect=requests.ConnectionError('refused')) as post:
+                    self.assertRaises(ClassificationServerUnavailable,
+                        call_server, '/status')
+                    # Unreachable server is not contacted for a while
+                    self.assertRaises(ClassificationServerUnavailable,
+                        call_server, '/status')
+                    self.assertEqual(post.call_count, 1)
+
+
+class ModelCacheTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.loads = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def write(self, name, content):
+        file_name = os.path.join(self.directory, name)
+        tmp_name = file_name + '.tmp'
+        with open(tmp_name, 'w') as f:
+            f.write(content)
+        os.rename(tmp_name, file_name)
+        return file_name
+
+    def loader(self, file_name):
+        self.loads.append(file_name)
+        with open(file_name) as f:
+            return f.read()
+
+    def testModelCache(self):
+        cache = ModelCache(max_size=10)
+        self.assertEqual(cache.load(1, os.path.join(self.directory, 'none'),
+            self.loader), None)
+
+        first = self.write('first', 'aaaa')
+        self.assertEqual(cache.load(1, first, self.loader), 'aaaa')
+        self.assertEqual(cache.load(1, first, self.loader), 'aaaa')
+        self.assertEqual(len(self.loads), 1)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+        # Retrained model is reloaded
+        first = self.write('first', 'bbbbb')
+        self.assertEqual(cache.load(1, first, self.loader), 'bbbbb')
+        self.assertEqual(len(self.loads), 2)
+        self.assertEqual(cache.stats()['size'], 5)
+
+        # Exceeding the budget evicts least recently used model
+        second = self.write('second', 'cccccc')
+        self.assertEqual(cache.load(2, second, self.loader), 'cccccc')
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.stats()['entries'], 1)
+        cache.load(1, first, self.loader)
+        self.assertEqual(len(self.loads), 4)
+
+        cache.invalidate(1)
+        self.assertEqual(cache.stats()['entries'], 0)
+        self.assertEqual(cache.stats()['size'], 0)
+
+        # Models bigger than the budget are never cached
+        big = self.write('big', 'd' * 11)
+        cache.load(3, big, self.loader)
+        cache.load(3, big, self.loader)
+        self.assertEqual(len(self.loads), 6)
+
+
+class ArtifactTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def testArtifact(self):
+        file_name = os.path.join(self.directory, 'model')
+        arrays = {
+            'counts': numpy.arange(12, dtype=numpy.float64).reshape(3, 4),
+            'prior': numpy.array([0.25, 0.75]),
+            'empty': numpy.zeros(0, dtype=numpy.int64),
+        }
+        write_artifact(file_name, arrays, meta={'classes': [LABEL_YES]})
+        self.assertTrue(is_artifact(file_name))
+
+        for use_mmap in (True, False):
+            meta, loaded = read_artifact(file_name, use_mmap=use_mmap)
+            self.assertEqual(meta, {'classes': [LABEL_YES]})
+            self.assertEqual(sorted(loaded), sorted(arrays))
+            for name, array in arrays.iteritems():
+                self.assertEqual(loaded[name].dtype, array.dtype)
+                self.assertTrue(numpy.array_equal(loaded[name], array))
+
+        # Mapped arrays are read-only
+        meta, loaded = read_artifact(file_name)
+        self.assertFalse(loaded['counts'].flags.writeable)
+
+        pickled = os.path.join(self.directory, 'pickled')
+        with open(pickled, 'wb') as f:
+            f.write('not an artifact')
+        self.assertFalse(is_artifact(pickled))
+
+
+class FeatureStoreTests(TestCase):
+
+    def testFeatureStore(self):
+        tokenize = mock.Mock(side_effect=lambda text: text.lower().split())
+        store = FeatureStore(tokenizer='words')
+        store.tokenize = tokenize
+
+        texts = ['Foo bar foo', u'Za\u017c\u00f3\u0142\u0107 bar', 'Foo bar foo', '']
+        tokens = store.get_tokens(texts)
+        self.assertEqual(tokens[0], ['bar', 'foo'])
+        self.assertEqual(tokens[1], ['bar', u'za\u017c\u00f3\u0142\u0107'])
+        self.assertEqual(tokens[2], ['bar', 'foo'])
+        self.assertEqual(tokens[3], [])
+        self.assertEqual(tokenize.call_count, 3)
+        self.assertEqual(SampleFeatures.objects.count(), 3)
+        self.assertTrue(SampleFeatures.objects.filter(
+            text_hash=text_hash(texts[0]), tokenizer='words').exists())
+
+        # Stored texts are not tokenized again
+        self.assertEqual(store.get_tokens(texts), tokens)
+        self.assertEqual(tokenize.call_count, 3)
+
+        # Tokens are stored per tokenizer
+        other = FeatureStore(tokenizer='nltk')
+        other.get_tokens(texts[:1])
+        self.assertEqual(SampleFeatures.objects.count(), 4)
+
+        # and n-grams length
+        self.assertEqual(store.get_tokens(texts[:1], ngrams=2)[0],
+            ['bar', 'bar|foo', 'foo', 'foo|bar'])
+        self.assertEqual(SampleFeatures.objects.count(), 5)
+
+    def testFeatureSpace(self):
+        matrix = HashedFeatureMatrix(
+            indptr=numpy.array([0, 2, 5, 6]),
+            indices=numpy.array([1, 4, 1, 2, 4, 7]),
+            dimension=8,
+        )
+        space = FeatureSpace(dimension=8, min_df=2)
+        vocabulary = space.prune(matrix.document_frequency())
+        self.assertEqual(list(vocabulary), [1, 4])
+        self.assertEqual(list(FeatureSpace(max_features=1).prune(
+            matrix.document_frequency())), [1])
+        self.assertEqual(FeatureSpace().prune([1, 2]), None)
+
+        pruned = matrix.select_features(vocabulary)
+        self.assertEqual(pruned.dimension, 2)
+        self.assertEqual(list(pruned.indptr), [0, 2, 4, 4])
+        self.assertEqual(list(pruned.indices), [0, 1, 0, 1])
+
+        self.assertEqual(space.configure({'ngrams': 2, 'other': 1}),
+            FeatureSpace(dimension=8, ngrams=2, min_df=2))
+
+
 class TrainingSetManagerTests(ToolsMockedMixin, TestCase):
 
     def testTrainingSet(self):
@@ -282,6 +1105,261 @@ class TrainingSetManagerTests(ToolsMockedMixin, TestCase):
         self.assertEqual(TrainingSet.objects.newest_for_job(job).job.id,
             job.id)
 
+    def testTrainingSetDelta(self):
+        u = User.objects.create_user(username='testing', password='test')
+        job = Job.objects.create_active(
+            account=u.get_profile(),
+            gold_samples=[{'url': '10clouds.com', 'label': LABEL_YES}])
+
+        samples = [Sample.objects.create(job=job, source_type='',
+            url='%d.com' % idx) for idx in xrange(4)]
+        old = TrainingSet.objects.create(job=job)
+        old.training_samples.create(sample=samples[0], label=LABEL_YES)
+        old.training_samples.create(sample=samples[1], label=LABEL_YES)
+        old.training_samples.create(sample=samples[2], label=LABEL_NO)
+        new = TrainingSet.objects.create(job=job)
+        new.training_samples.create(sample=samples[0], label=LABEL_YES)
+        new.training_samples.create(sample=samples[1], label=LABEL_NO)
+        new.training_samples.create(sample=samples[3], label=LABEL_NO)
+
+        self.assertEqual(new.delta(old), {
+            'added': {samples[3].id: LABEL_NO},
+            'removed': {samples[2].id: LABEL_NO},
+            'relabelled': {samples[1].id: (LABEL_YES, LABEL_NO)},
+        })
+        self.assertEqual(new.delta(new), {
+            'added': {},
+            'removed': {},
+            'relabelled': {},
+        })
+
+
+    @override_settings(TRAINING_SET_MAX_DEPTH=3)
+    def testTrainingSetRevisions(self):
+        u = User.objects.create_user(username='testing', password='test')
+        job = Job.objects.create_active(
+            account=u.get_profile(),
+            gold_samples=[{'url': '10clouds.com', 'label': LABEL_YES}])
+
+        samples = [Sample.objects.create(job=job, source_type='',
+            url='%d.com' % idx).id for idx in xrange(4)]
+        labels = {
+            samples[0]: LABEL_YES,
+            samples[1]: LABEL_YES,
+            samples[2]: LABEL_NO,
+        }
+        first = TrainingSet.objects.create_revision(job=job, labels=labels)
+        self.assertEqual(first.get_labels(), labels)
+
+        # Only changes are stored in a child revision
+        labels = {
+            samples[0]: LABEL_YES,
+            samples[1]: LABEL_NO,
+            samples[3]: LABEL_NO,
+        }
+        second = TrainingSet.objects.create_revision(job=job, labels=labels)
+        self.assertEqual(second.parent, first)
+        self.assertEqual(second.training_samples.count(), 3)
+        self.assertEqual(second.get_labels(), labels)
+        self.assertEqual(second.count(), 3)
+        self.assertEqual(second.get_label(samples[2]), None)
+        self.assertEqual(second.get_label(samples[1]), LABEL_NO)
+        self.assertEqual(sorted(ts.sample_id for ts in second.get_samples()),
+            sorted(labels))
+        self.assertEqual(first.get_labels()[samples[1]], LABEL_YES)
+        self.assertEqual(second.delta(first), {
+            'added': {samples[3]: LABEL_NO},
+            'removed': {samples[2]: LABEL_NO},
+            'relabelled': {samples[1]: (LABEL_YES, LABEL_NO)},
+        })
+
+        # Too long chains are compacted into a snapshot
+        third = TrainingSet.objects.create_revision(job=job, labels=labels)
+        self.assertEqual(third.parent, None)
+        self.assertEqual(third.training_samples.count(), 3)
+        self.assertEqual(third.get_labels(), labels)
+
+
+class TrainingQueueTests(ToolsMockedMixin, TestCase):
+
+    def setUp(self):
+        u = User.objects.create_user(username='testing', password='test')
+        self.job = Job.objects.create_active(
+            account=u.get_profile(),
+            gold_samples=[{'url': '10clouds.com', 'label': LABEL_YES}])
+        TrainingRequest.objects.all().delete()
+
+    def testTrainingQueue(self):
+        first = TrainingSet.objects.create(job=self.job)
+        second = TrainingSet.objects.create(job=self.job)
+
+        # Pending request is moved to the newest set.
+        TrainingRequest.objects.enqueue(first)
+        TrainingRequest.objects.enqueue(second)
+        TrainingRequest.objects.enqueue(first)
+        self.assertEqual(TrainingRequest.objects.count(), 1)
+        request = TrainingRequest.objects.get()
+        self.assertEqual(request.training_set, second)
+        self.assertEqual(request.superseded, 1)
+        self.assertEqual(request.status, TRAINING_PENDING)
+        self.assertEqual(TrainingRequest.objects.stats()['pending'], 1)
+
+        request = TrainingRequest.objects.claim('testing:0')
+        self.assertEqual(request.status, TRAINING_RUNNING)
+        self.assertEqual(request.worker, 'testing:0')
+        self.assertTrue(request.get_wait_time() >= 0)
+        self.assertEqual(TrainingRequest.objects.claim('testing:1'), None)
+
+        # Job being trained gets a new request, claimed after the first one
+        # finishes.
+        third = TrainingSet.objects.create(job=self.job)
+        TrainingRequest.objects.enqueue(third)
+        self.assertEqual(TrainingRequest.objects.claim('testing:1'), None)
+
+        target = 'urlannotator.classification.training.train'
+        with mock.patch(target) as train_mock:
+            run_request(request)
+            train_mock.assert_called_once_with(second.id)
+        self.assertEqual(TrainingRequest.objects.get(id=request.id).status,
+            TRAINING_DONE)
+
+        request = TrainingRequest.objects.claim('testing:1')
+        self.assertEqual(request.training_set, third)
+        stats = TrainingRequest.objects.stats()
+        self.assertEqual(stats['pending'], 0)
+        self.assertEqual(stats['running'], 1)
+        self.assertEqual(stats['started'], 2)
+
+        # Requests of dead workers are returned to the queue.
+        self.assertEqual(TrainingRequest.objects.requeue('testing:'), 1)
+        request = TrainingRequest.objects.claim('testing:0')
+        with mock.patch(target, side_effect=Exception):
+            run_request(request)
+        request = TrainingRequest.objects.get(id=request.id)
+        self.assertEqual(request.status, TRAINING_FAILED)
+        self.assertTrue(request.error)
+
+    def testDeadWorkerRequeued(self):
+        TrainingRequest.objects.enqueue(
+            TrainingSet.objects.create(job=self.job))
+        pool = TrainingPool(workers=1)
+        request = TrainingRequest.objects.claim(pool.get_worker_name(0))
+
+        dead = mock.Mock()
+        dead.is_alive.return_value = False
+        pool.workers[0] = dead
+        target = 'urlannotator.classification.training.Process'
+        with mock.patch(target) as process:
+            pool.supervise()
+            self.assertTrue(process.return_value.start.called)
+        self.assertEqual(pool.workers[0], process.return_value)
+
+        # The job can be trained by the replacement.
+        request = TrainingRequest.objects.get(id=request.id)
+        self.assertEqual(request.status, TRAINING_PENDING)
+        self.assertEqual(request.worker, '')
+        self.assertEqual(request.attempts, 1)
+
+    def testKillingTrainingGivenUp(self):
+        TrainingRequest.objects.enqueue(
+            TrainingSet.objects.create(job=self.job))
+        for attempt in xrange(2):
+            request = TrainingRequest.objects.claim('testing:0')
+            requeued, failed = TrainingRequest.objects.requeue_worker(
+                'testing:0', max_attempts=2)
+        self.assertEqual(requeued, 0)
+        self.assertEqual([r.id for r in failed], [request.id])
+
+        request = TrainingRequest.objects.get(id=request.id)
+        self.assertEqual(request.status, TRAINING_FAILED)
+        self.assertEqual(request.attempts, 2)
+        self.assertEqual(TrainingRequest.objects.claim('testing:0'), None)
+
+        # Pool logs the training as given up.
+        pool = TrainingPool(workers=1)
+        request = TrainingRequest.objects.create(job=self.job,
+            training_set=request.training_set, worker=pool.get_worker_name(0),
+            status=TRAINING_RUNNING, attempts=2)
+        dead = mock.Mock()
+        dead.is_alive.return_value = False
+        pool.workers[0] = dead
+        with mock.patch('urlannotator.classification.training.Process'):
+            pool.supervise()
+        self.assertEqual(TrainingRequest.objects.get(id=request.id).status,
+            TRAINING_FAILED)
+        self.assertEqual(LogEntry.objects.filter(
+            job=self.job,
+            log_type=LOG_TYPE_CLASSIFIER_FATAL_TRAINING_ERROR,
+        ).count(), 1)
+
+
+class EvaluationTests(TestCase):
+
+    def testFolds(self):
+        labels = [LABEL_YES, LABEL_YES, LABEL_NO, LABEL_NO, LABEL_NO]
+        folds = make_folds(labels, 2)
+        self.assertEqual(sorted(numpy.concatenate(folds)), range(5))
+        for rows in folds:
+            fold_labels = set(labels[row] for row in rows)
+            self.assertEqual(fold_labels, set([LABEL_YES, LABEL_NO]))
+
+    def testROCAUC(self):
+        labels = [LABEL_YES, LABEL_NO, LABEL_YES, LABEL_NO]
+        self.assertEqual(roc_auc(labels, [0.9, 0.1, 0.8, 0.2]), 1.0)
+        self.assertEqual(roc_auc(labels, [0.1, 0.9, 0.2, 0.8]), 0.0)
+        # Ties count as half.
+        self.assertEqual(roc_auc(labels, [0.9, 0.1, 0.5, 0.5]), 0.875)
+        self.assertEqual(roc_auc([LABEL_YES], [0.5]), None)
+
+    def testHoldout(self):
+        labels = [LABEL_YES, LABEL_NO] * 5
+        classes = [LABEL_YES, LABEL_NO]
+        evaluated = []
+
+        def fold_function(state, rows):
+            evaluated.append(rows)
+            return numpy.array([[1.0, 0.0] if labels[row] == LABEL_YES
+                else [0.0, 1.0] for row in rows])
+
+        analysis = cross_validate(fold_function, None, labels, classes,
+            folds=5, processes=1, holdout=True)
+        # A single model predicts a fifth of samples.
+        self.assertEqual(len(evaluated), 1)
+        description = analysis['modelDescription']
+        self.assertEqual(description['holdout'], 2)
+        self.assertEqual(description['confusionMatrix'][LABEL_YES][LABEL_YES],
+            1)
+        self.assertEqual(description['rocAuc'], 1.0)
+
+    def testTreeProbabilities(self):
+        train_set = [
+            ({'a': True}, LABEL_YES),
+            ({'a': True}, LABEL_YES),
+            ({'a': True}, LABEL_NO),
+            ({'a': False}, LABEL_NO),
+        ]
+        tree = nltk.classify.DecisionTreeClassifier.train(train_set)
+        probabilities = tree_predict_proba(tree, train_set,
+            [{'a': True}, {'a': False}], [LABEL_YES, LABEL_NO])
+        # Leaf frequencies with add-one smoothing.
+        self.assertEqual(probabilities[0].tolist(), [0.6, 0.4])
+        self.assertAlmostEqual(probabilities[1][1], 2 / 3.0)
+
+
+class BenchmarkTests(TestCase):
+
+    def testGenerateCorpus(self):
+        corpus = generate_corpus(samples=10, vocabulary=100, words=20, seed=1)
+        self.assertEqual(corpus, generate_corpus(10, 100, 20, seed=1))
+        self.assertEqual(len(corpus), 10)
+        labels = [label for text, label in corpus]
+        self.assertEqual(labels.count(LABEL_YES), 5)
+        self.assertEqual(labels.count(LABEL_NO), 5)
+        for text, label in corpus:
+            words = text.split()
+            self.assertEqual(len(words), 20)
+            self.assertTrue(all(0 <= int(word[1:]) < 100 for word in words))
+
 
 class ClassifierPerformanceTests(ToolsMockedMixin, TestCase):
     def testPerformance(self):
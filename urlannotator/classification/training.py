@@ -0,0 +1,189 @@
+import os
+import signal
+import socket
+import time
+import traceback
+from multiprocessing import Process
+
+import nltk
+from django.db import connection
+
+from urlannotator.classification.models import TrainingRequest
+from urlannotator.classification.event_handlers import train
+from urlannotator.flow_control import send_event
+from urlannotator.tools.utils import setting
+
+import logging
+log = logging.getLogger(__name__)
+
+# Default number of training workers run by a single pool.
+DEFAULT_TRAINING_WORKERS = 2
+
+# Default number of requests a worker trains on before it's replaced with
+# a fresh one, forked from the preloaded pool process.
+DEFAULT_WORKER_MAX_TASKS = 50
+
+# Number of seconds an idle worker waits before checking the queue again.
+TRAINING_POLL_INTERVAL = 1
+
+# Number of seconds between pool's checks of its workers.
+TRAINING_SUPERVISE_INTERVAL = 1
+
+
+def get_worker_prefix():
+    """
+        Returns prefix of names of workers run on this host.
+    """
+    return '%s:' % socket.gethostname()
+
+
+def preload():
+    """
+        Warms up libraries used in training, so that workers forked afterwards
+        share them instead of loading them on every training.
+    """
+    nltk.word_tokenize('Preloading tokenizers.')
+    # Workers must not share pool's database connection.
+    connection.close()
+
+
+def run_request(request):
+    """
+        Trains job's classifier on the request's training set.
+    """
+    log.info(
+        'Training job %d on set %d, after %.1fs in the queue.'
+        % (request.job_id, request.training_set_id, request.get_wait_time())
+    )
+    try:
+        train(request.training_set_id)
+    except Exception:
+        log.exception('Training job %d failed.' % request.job_id)
+        request.finish(error=traceback.format_exc())
+    else:
+        request.finish()
+
+
+def run_worker(name, max_tasks=DEFAULT_WORKER_MAX_TASKS,
+        poll_interval=TRAINING_POLL_INTERVAL):
+    """
+        Trains on queued requests until `max_tasks` of them are handled.
+    """
+    # The pool's handler is inherited, SIGTERM has to stop the worker.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    done = 0
+    while not max_tasks or done < max_tasks:
+        request = TrainingRequest.objects.claim(name)
+        if request is None:
+            time.sleep(poll_interval)
+            continue
+
+        run_request(request)
+        done += 1
+
+
+class TrainingPool(object):
+    """
+        Fixed-size pool of training workers. Workers are forked from the pool
+        process after libraries are preloaded, and are replaced when they
+        exit, so that at most `workers` trainings run at once.
+
+        Workers aren't daemonic, so that they can evaluate classifiers in
+        child processes. They're stopped by the pool when it exits.
+    """
+    def __init__(self, workers=None, max_tasks=None):
+        self.size = workers or setting('TRAINING_WORKERS',
+            DEFAULT_TRAINING_WORKERS)
+        if max_tasks is None:
+            max_tasks = setting('TRAINING_WORKER_MAX_TASKS',
+                DEFAULT_WORKER_MAX_TASKS)
+        self.max_tasks = max_tasks
+        self.workers = [None] * self.size
+        self.running = False
+
+    def get_pool_prefix(self):
+        """
+            Returns prefix of names of this pool's workers.
+        """
+        return '%s%d:' % (get_worker_prefix(), os.getpid())
+
+    def get_worker_name(self, slot):
+        return '%s%d' % (self.get_pool_prefix(), slot)
+
+    def start_worker(self, slot):
+        worker = Process(target=run_worker,
+            args=(self.get_worker_name(slot), self.max_tasks))
+        worker.start()
+        self.workers[slot] = worker
+
+    def supervise(self):
+        """
+            Restarts workers that have exited. Trainings of workers that died
+            on them are returned to the queue, so that their jobs can be
+            trained again, unless they've killed too many workers already.
+        """
+        for slot, worker in enumerate(self.workers):
+            if worker is None or not worker.is_alive():
+                if worker is not None:
+                    worker.join()
+                    requeued, failed = TrainingRequest.objects.requeue_worker(
+                        self.get_worker_name(slot))
+                    if requeued:
+                        log.warning(
+                            'Training worker %d exited with code %s, '
+                            'requeued its training.' % (slot, worker.exitcode)
+                        )
+                    for request in failed:
+                        log.error(
+                            'Training worker %d exited with code %s, gave up '
+                            'training job %d.'
+                            % (slot, worker.exitcode, request.job_id)
+                        )
+                        send_event(
+                            "EventClassifierCriticalTrainError",
+                            job_id=request.job_id,
+                            message=request.error,
+                        )
+                    # Workers must not share pool's database connection.
+                    connection.close()
+                self.start_worker(slot)
+
+    def stop(self, *args):
+        self.running = False
+
+    def shutdown(self):
+        """
+            Stops workers and returns their interrupted trainings to the queue.
+        """
+        for worker in self.workers:
+            if worker is not None and worker.is_alive():
+                worker.terminate()
+        for worker in self.workers:
+            if worker is not None:
+                worker.join()
+
+        requeued = TrainingRequest.objects.requeue(self.get_pool_prefix())
+        if requeued:
+            log.warning('Requeued %d interrupted trainings.' % requeued)
+
+    def run(self):
+        """
+            Runs the pool until it's stopped with SIGTERM or SIGINT.
+        """
+        preload()
+        # Requests left running by a previous pool on this host won't finish.
+        requeued = TrainingRequest.objects.requeue(get_worker_prefix())
+        if requeued:
+            log.warning('Requeued %d interrupted trainings.' % requeued)
+        connection.close()
+
+        signal.signal(signal.SIGTERM, self.stop)
+        self.running = True
+        try:
+            while self.running:
+                self.supervise()
+                time.sleep(TRAINING_SUPERVISE_INTERVAL)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
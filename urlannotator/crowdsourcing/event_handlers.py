@@ -11,6 +11,7 @@ from urlannotator.main.models import Job, Sample, Worker, LABEL_YES
 from urlannotator.crowdsourcing.odesk_helper import (check_odesk_job,
     add_odesk_teams)
 from urlannotator.crowdsourcing.job_handlers import get_job_handler
+from urlannotator.flow_control.debounce import debounce
 from urlannotator.tools.synchronization import singleton
 
 import logging
@@ -63,28 +64,45 @@ def btm_send_to_human(sample_id, **kwargs):
     handler.update_btm(btm_samples=[btm])
 
 
+def get_vote_job_id(job_id=None, **kwargs):
+    """
+        Returns id of voted sample's job, sent with the event.
+    """
+    return job_id
+
+
 @task(ignore_result=True)
-def update_job_votes_gathered(sample_id, worker_id):
-    sample = Sample.objects.filter(id=sample_id).select_related('job')
-    if not sample:
+@debounce(key=get_vote_job_id)
+def update_job_votes_gathered(sample_id, worker_id, job_id=None, **kwargs):
+    """
+        Updates caches of voted samples, their job and voting workers. Votes
+        are debounced per job - `sample_id` and `worker_id` are lists of ids
+        of all votes that came within the window.
+    """
+    samples = list(Sample.objects.filter(id__in=sample_id)
+        .select_related('job'))
+    if not samples:
         log.warning(
-            'Tried updating votes gathered for not existant sample %d'
+            'Tried updating votes gathered for not existant samples %s'
             % sample_id
         )
         return
 
-    sample = sample[0]
-    sample.update_votes_cache()
-    sample.job.get_progress(cache=False)
-    sample.job.get_btm_votes(cache=False)
+    for sample in samples:
+        sample.update_votes_cache()
+    job = samples[0].job
+    job.get_progress(cache=False)
+    job.get_btm_votes(cache=False)
 
-    worker = Worker.objects.get(id=worker_id)
-    worker.get_votes_added_count_for_job(sample.job, cache=False)
+    workers = list(Worker.objects.filter(id__in=worker_id))
+    for worker in workers:
+        worker.get_votes_added_count_for_job(job, cache=False)
 
     # Update top workers
-    sample.job.get_top_workers(cache=False)
+    job.get_top_workers(cache=False)
 
-    sample.job.workerjobassociation_set.get(worker=worker).get_votes_added()
+    for worker in workers:
+        job.workerjobassociation_set.get(worker=worker).get_votes_added()
 
 
 def _vote_on_new_sample(sample_id, job_id, vote_constructor):
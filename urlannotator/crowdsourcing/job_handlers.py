@@ -9,11 +9,22 @@ from urlannotator.crowdsourcing.models import OdeskMetaJob
 from urlannotator.main.models import (JOB_SOURCE_ODESK_FREE,
     JOB_SOURCE_OWN_WORKFORCE, JOB_SOURCE_ODESK_PAID,
     JOB_SOURCE_MTURK_WORKFORCE)
-from urlannotator.tools.synchronization import POSIXLock
+from urlannotator.tools.synchronization import get_lock
 
 import logging
 log = logging.getLogger(__name__)
 
+# Names of locks taken by job handlers, formatted with job's id. They are
+# removed when the job finishes.
+JOB_HANDLER_LOCKS = (
+    'job_handler_init_job_%d',
+    'job_handler_init_vot_%d',
+    'job_handler_upd_vot_%d',
+    'job_handler_init_btm_%d',
+    'job_handler_init_btm_vot_%d',
+    'job_handler_upd_btm_%d',
+)
+
 
 class CrowdsourcingJobHandler(object):
     def __init__(self, job):
@@ -111,7 +122,7 @@ class TagasaurisHandler(CrowdsourcingJobHandler):
     '''
     def init_job(self, *args, **kwargs):
         lock_name = 'job_handler_init_job_%d' % self.job.id
-        with POSIXLock(lock_name):
+        with get_lock(lock_name):
             try:
                 tagjob = self.job.tagasaurisjobs
             except:
@@ -127,7 +138,7 @@ class TagasaurisHandler(CrowdsourcingJobHandler):
 
     def init_voting(self, tc, samples, *args, **kwargs):
         lock_name = 'job_handler_init_vot_%d' % self.job.id
-        with POSIXLock(lock_name):
+        with get_lock(lock_name):
             if self.job.tagasaurisjobs.voting_hit is not None:
                 log.info(
                     'Tried to create new voting job, but it already exists'
@@ -138,13 +149,13 @@ class TagasaurisHandler(CrowdsourcingJobHandler):
 
     def update_voting(self, tc, samples, *args, **kwargs):
         lock_name = 'job_handler_upd_vot_%d' % self.job.id
-        with POSIXLock(lock_name):
+        with get_lock(lock_name):
             res = update_voting(tc, self.job, samples)
             return res
 
     def init_btm_gather(self, topic, description, no_of_urls, *args, **kwargs):
         lock_name = 'job_handler_init_btm_%d' % self.job.id
-        with POSIXLock(lock_name):
+        with get_lock(lock_name):
             if self.job.tagasaurisjobs.beatthemachine_hit is not None:
                 log.info(
                     'Tried to create new btm gathering job, but it already exists'
@@ -158,7 +169,7 @@ class TagasaurisHandler(CrowdsourcingJobHandler):
 
     def init_btm_voting(self, samples, *args, **kwargs):
         lock_name = 'job_handler_init_btm_vot_%d' % self.job.id
-        with POSIXLock(lock_name):
+        with get_lock(lock_name):
             if self.job.tagasaurisjobs.voting_btm_hit is not None:
                 log.info(
                     'Tried to create new btm voting job, but it already exists'
@@ -169,7 +180,7 @@ class TagasaurisHandler(CrowdsourcingJobHandler):
 
     def update_btm(self, btm_samples, *args, **kwargs):
         lock_name = 'job_handler_upd_btm_%d' % self.job.id
-        with POSIXLock(lock_name):
+        with get_lock(lock_name):
             tc = make_tagapi_client()
             samples = (btm.sample for btm in btm_samples)
 
@@ -6,7 +6,7 @@ from urlannotator.main.models import (Worker, Sample, LABEL_CHOICES, Job,
     LABEL_BROKEN, Account, worker_type_to_sample_source, make_label)
 from urlannotator.classification.models import (ClassifiedSampleCore,
     CLASSIFIED_SAMPLE_PENDING, CLASSIFIED_SAMPLE_SUCCESS)
-from urlannotator.flow_control import send_event
+from urlannotator.flow_control import send_event, event_transaction
 from urlannotator.tools.utils import sanitize_url
 from urlannotator.payments.models import BTMBonusPayment
 
@@ -42,31 +42,34 @@ class WorkerQualityVoteManager(models.Manager):
             return None
 
     def new_vote(self, *args, **kwargs):
-        vote = self._add_vote(**kwargs)
+        with event_transaction():
+            vote = self._add_vote(**kwargs)
 
-        if not vote:
-            return None
+            if not vote:
+                return None
 
-        send_event(
-            'EventNewVoteAdded',
-            worker_id=kwargs['worker'].id,
-            sample_id=kwargs['sample'].id,
-        )
+            send_event(
+                'EventNewVoteAdded',
+                worker_id=kwargs['worker'].id,
+                sample_id=kwargs['sample'].id,
+                job_id=kwargs['sample'].job_id,
+            )
 
         return vote
 
     def new_btm_vote(self, *args, **kwargs):
         kwargs['btm_vote'] = True
-        vote = self._add_vote(**kwargs)
+        with event_transaction():
+            vote = self._add_vote(**kwargs)
 
-        if not vote:
-            return None
+            if not vote:
+                return None
 
-        send_event(
-            'EventNewBTMVoteAdded',
-            worker_id=kwargs['worker'].id,
-            sample_id=kwargs['sample'].id,
-        )
+            send_event(
+                'EventNewBTMVoteAdded',
+                worker_id=kwargs['worker'].id,
+                sample_id=kwargs['sample'].id,
+            )
 
         return vote
 
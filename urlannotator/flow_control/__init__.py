@@ -1,18 +1,119 @@
-from celery import registry
+from contextlib import contextmanager
+
+from celery import registry, group
 from django.conf import settings
+from django.db import transaction, connections, DEFAULT_DB_ALIAS
+
+# Event dispatch modes breakdown:
+# EVENT_DISPATCH_BUS - events are sent to EventBusSender task on the realtime
+#                      queue, which sends tasks handling them,
+# EVENT_DISPATCH_DIRECT - tasks handling events are sent by send_event, saving
+#                         a broker round-trip and a worker slot per event.
+EVENT_DISPATCH_BUS = 'bus'
+EVENT_DISPATCH_DIRECT = 'direct'
 
 
 class EventSystemException(Exception):
     pass
 
 
+class EventOutbox(object):
+    """
+        Events sent inside `event_transaction` blocks on a connection,
+        waiting for the outermost block's transaction to commit.
+    """
+    def __init__(self):
+        self.depth = 0
+        self.events = []
+
+
+def get_outbox(using=None):
+    """
+        Returns event outbox of database connection `using`. Connections are
+        per thread, and so are their outboxes.
+    """
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    outbox = getattr(connection, 'event_outbox', None)
+    if outbox is None:
+        outbox = connection.event_outbox = EventOutbox()
+    return outbox
+
+
 def send_event(event_name, *args, **kwargs):
-    from event_system import EventBusSender
     if args:
         raise EventSystemException("Illegal use of send_event. "
             "Only kwargs allowed.")
 
-    return registry.tasks[EventBusSender.name].apply_async(
-        args=[event_name], kwargs=kwargs,
-        queue=settings.CELERY_REALTIME_QUEUE
-    )
+    outbox = get_outbox()
+    if outbox.depth:
+        # Sent once the transaction commits.
+        outbox.events.append((event_name, kwargs))
+        return None
+
+    return send_events([(event_name, kwargs)])
+
+
+def send_events(events):
+    """
+        Sends a batch of (event_name, kwargs) events at once.
+    """
+    from event_system import EventBusSender
+    bus_sender = registry.tasks[EventBusSender.name]
+    mode = getattr(settings, 'EVENT_DISPATCH_MODE', EVENT_DISPATCH_BUS)
+    if mode == EVENT_DISPATCH_DIRECT:
+        return bus_sender.dispatch_events(events)
+
+    if len(events) == 1:
+        event_name, kwargs = events[0]
+        return bus_sender.apply_async(
+            args=[event_name], kwargs=kwargs,
+            queue=settings.CELERY_REALTIME_QUEUE
+        )
+
+    return group(bus_sender.s(event_name, **kwargs)
+        for event_name, kwargs in events).apply_async(
+        queue=settings.CELERY_REALTIME_QUEUE)
+
+
+@contextmanager
+def event_transaction(using=None):
+    """
+        Runs the block in a transaction, like `transaction.commit_on_success`.
+        Events sent inside are buffered on the connection, and sent in
+        a single batch after the transaction commits, so that their handlers
+        see its changes. They are dropped if it rolls back.
+
+        Nested blocks join the outermost one's transaction - they neither
+        commit it nor send its events. Use event_transaction instead of
+        `commit_on_success` in code that can run inside one.
+
+        A transaction already managed by the caller is joined too, and left
+        for the caller to commit. Events are sent when the block exits.
+    """
+    outbox = get_outbox(using)
+    if outbox.depth:
+        outbox.depth += 1
+        try:
+            yield
+        finally:
+            outbox.depth -= 1
+        return
+
+    outbox.depth = 1
+    try:
+        if transaction.is_managed(using=using):
+            # Committed by the caller.
+            yield
+        else:
+            with transaction.commit_on_success(using=using):
+                yield
+    except:
+        outbox.events = []
+        raise
+    finally:
+        outbox.depth = 0
+
+    events = outbox.events
+    outbox.events = []
+    if events:
+        send_events(events)
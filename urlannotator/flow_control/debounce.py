@@ -0,0 +1,97 @@
+from functools import wraps
+
+from celery import task
+from django.conf import settings
+from django.utils.importlib import import_module
+
+from urlannotator.flow_control.models import PendingEvent, DebounceWindow
+from urlannotator.tools.utils import setting
+
+import logging
+log = logging.getLogger(__name__)
+
+# Default number of seconds events of a debounced handler are collected for,
+# before the handler is called once with all of them.
+DEFAULT_DEBOUNCE_WINDOW = 5
+
+# Debounced functions by their qualified names.
+_debounced = {}
+
+
+def merge_kwargs(events):
+    """
+        Merges kwargs of events into a dictionary name -> list of distinct
+        values, in order they came in.
+    """
+    merged = {}
+    for kwargs in events:
+        for name, value in kwargs.iteritems():
+            values = merged.setdefault(name, [])
+            if value not in values:
+                values.append(value)
+    return merged
+
+
+def get_window_name(name, key):
+    return '%s:%s' % (name, key)
+
+
+def debounce(key, window=None, merge=merge_kwargs):
+    """
+        Decorator of event handlers collapsing events with the same key,
+        that come within `window` seconds of the first one, into a single
+        call. Events are kept in the database until the window is flushed.
+
+        Put it under the task decorator - the task stores the event, and the
+        decorated function is called by `flush_events`.
+
+        :param key: - Function returning key of the event from its kwargs,
+                      e.g. job's id. Events with None key are handled at once.
+        :param window: - Number of seconds events are collected for. Defaults
+                         to EVENT_DEBOUNCE_WINDOW setting.
+        :param merge: - Function merging a list of events' kwargs into kwargs
+                        the function is called with. By default the function
+                        gets lists of distinct values of every argument.
+    """
+    def decorator(func):
+        name = '%s.%s' % (func.__module__, func.__name__)
+        _debounced[name] = (func, merge)
+
+        @wraps(func)
+        def wrapper(**kwargs):
+            event_key = key(**kwargs)
+            if event_key is None:
+                return func(**merge([kwargs]))
+
+            window_name = get_window_name(name, event_key)
+            PendingEvent.objects.add(window_name, kwargs)
+            if DebounceWindow.objects.try_schedule(window_name):
+                flush_events.apply_async(
+                    args=[name, window_name],
+                    countdown=window or setting('EVENT_DEBOUNCE_WINDOW',
+                        DEFAULT_DEBOUNCE_WINDOW),
+                    queue=settings.CELERY_DEFAULT_QUEUE,
+                )
+
+        return wrapper
+    return decorator
+
+
+@task(ignore_result=True)
+def flush_events(name, window_name):
+    """
+        Calls debounced function `name` with merged kwargs of events pending
+        in the window.
+    """
+    # Events coming from now on open a new window.
+    DebounceWindow.objects.unschedule(window_name)
+    events = PendingEvent.objects.take(window_name)
+    if not events:
+        return
+
+    if name not in _debounced:
+        # Registers the function in this process.
+        import_module(name.rsplit('.', 1)[0])
+    func, merge = _debounced[name]
+    log.debug('Debounced %d events of %s' % (len(events), window_name))
+    func(**merge(events))
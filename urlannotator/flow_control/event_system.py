@@ -8,6 +8,14 @@ from django.conf import settings
 
 log = logging.getLogger('EventBus')
 
+# Patterns matching a single event name, like r'^EventNewSample$'.
+LITERAL_PATTERN = re.compile(r'^\^(\w+)\$$')
+
+# Maximum number of event names whose handlers are memoised.
+DISPATCH_MEMO_SIZE = 1024
+
+_default_flags = re.compile('').flags
+
 
 def flow_modules():
     ''' from django admin code '''
@@ -31,6 +39,73 @@ def flow_modules():
     return filter(None, (tmp(app) for app in settings.INSTALLED_APPS))
 
 
+def get_literal(matcher):
+    """
+        Returns the only event name matched by `matcher`, or None if it
+        matches more.
+    """
+    pattern = getattr(matcher, 'pattern', matcher)
+    if getattr(matcher, 'flags', _default_flags) != _default_flags:
+        return None
+    literal = LITERAL_PATTERN.match(pattern)
+    return literal.group(1) if literal else None
+
+
+class DispatchIndex(object):
+    """
+        Finds handlers of events registered as (matcher, task, queue) tuples.
+        Events of literal patterns are looked up in a dictionary. Other
+        patterns are tried one by one only if their combined alternation
+        matches. Handlers are memoised per event name, and keep the order
+        of registration.
+    """
+    def __init__(self, registered):
+        self.registered = registered
+        self.exact = {}
+        self.regexes = []
+        self.memo = {}
+
+        for idx, (matcher, task_func, queue) in enumerate(registered):
+            literal = get_literal(matcher)
+            if literal is None:
+                self.regexes.append(idx)
+            else:
+                self.exact.setdefault(literal, []).append(idx)
+
+        self.combined = None
+        patterns = [registered[idx][0] for idx in self.regexes]
+        if patterns and all(getattr(matcher, 'flags', _default_flags) ==
+                _default_flags for matcher in patterns):
+            try:
+                self.combined = re.compile('|'.join('(?:%s)'
+                    % getattr(matcher, 'pattern', matcher)
+                    for matcher in patterns))
+            except re.error:
+                pass
+
+    def resolve(self, event_name):
+        matched = list(self.exact.get(event_name, ()))
+        if self.regexes and (self.combined is None or
+                self.combined.match(event_name)):
+            matched.extend(idx for idx in self.regexes
+                if self.registered[idx][0].match(event_name))
+
+        return tuple((self.registered[idx][1], self.registered[idx][2])
+            for idx in sorted(matched))
+
+    def handlers(self, event_name):
+        """
+            Returns a tuple of (task, queue) pairs handling `event_name`.
+        """
+        handlers = self.memo.get(event_name)
+        if handlers is None:
+            handlers = self.resolve(event_name)
+            if len(self.memo) >= DISPATCH_MEMO_SIZE:
+                self.memo.clear()
+            self.memo[event_name] = handlers
+        return handlers
+
+
 @task(ignore_result=True)
 class EventBusSender(Task):
     ''' Matching using regexps
@@ -38,37 +113,91 @@ class EventBusSender(Task):
 
     def __init__(self):
         self.registered = []
+        self.index = None
         self.config_yourself()
 
     def config_yourself(self):
         for module in flow_modules():
-            self.update_config(module.FLOW_DEFINITIONS)
-
-    def register(self, event_pattern, fun, queue=settings.CELERY_DEFAULT_QUEUE):
+            self.update_config(module.FLOW_DEFINITIONS, rebuild=False)
+        self.rebuild_index()
+
+    def rebuild_index(self):
+        """
+            Indexes registered handlers. Has to be called whenever they
+            change.
+        """
+        self.index = DispatchIndex(self.registered)
+
+    def register(self, event_pattern, fun, queue=settings.CELERY_DEFAULT_QUEUE,
+            rebuild=True):
         self.registered.append((re.compile(event_pattern), fun, queue))
+        if rebuild:
+            self.rebuild_index()
 
-    def update_config(self, flow_definition):
+    def update_config(self, flow_definition, rebuild=True):
         for flow_entry in flow_definition:
             event_pattern = flow_entry[0]
             fun = flow_entry[1]
             queue = settings.CELERY_DEFAULT_QUEUE
             if len(flow_entry) > 3:
                 queue = flow_entry[2]
-            self.register(event_pattern, fun, queue)
-
-    def run(self, event_name, *args, **kwargs):
-        log.debug('Got event: %s(%s, %s)', event_name, args, kwargs)
-
-        dispatched = {}
-        for matcher, task_func, queue in self.registered:
-            if not matcher.match(event_name):
-                continue
+            self.register(event_pattern, fun, queue, rebuild=False)
+        if rebuild:
+            self.rebuild_index()
+
+    def set_registered(self, registered):
+        """
+            Replaces registered handlers with `registered` ones, e.g. in
+            tests' FlowControlMixin.
+        """
+        self.registered = registered
+        self.rebuild_index()
+
+    def get_handlers(self, event_name):
+        """
+            Returns a tuple of (task, queue) pairs handling `event_name`.
+        """
+        return self.index.handlers(event_name)
+
+    def add_signatures(self, dispatched, event_name, *args, **kwargs):
+        """
+            Adds signatures of tasks handling the event to `dispatched`
+            dictionary queue -> list of signatures.
+        """
+        handlers = self.get_handlers(event_name)
+        if not handlers:
+            log.warning('Event not matched: %s !', event_name)
 
+        for task_func, queue in handlers:
             dispatched.setdefault(queue, [])
             dispatched[queue].append(task_func.s(*args, **kwargs))
 
-        if not dispatched:
-            log.warning('Event not matched: %s !', event_name)
-        else:
-            for queue, disp in dispatched.iteritems():
-                group(disp).apply_async(queue=queue)
+    def send_groups(self, dispatched):
+        """
+            Sends tasks to their queues, one group per queue. Returns a list
+            of the groups' results.
+        """
+        return [group(disp).apply_async(queue=queue)
+            for queue, disp in dispatched.iteritems()]
+
+    def dispatch(self, event_name, *args, **kwargs):
+        """
+            Sends tasks handling the event to their queues.
+        """
+        dispatched = {}
+        self.add_signatures(dispatched, event_name, *args, **kwargs)
+        return self.send_groups(dispatched)
+
+    def dispatch_events(self, events):
+        """
+            Sends tasks handling a batch of (event_name, kwargs) events to
+            their queues, one group per queue.
+        """
+        dispatched = {}
+        for event_name, kwargs in events:
+            self.add_signatures(dispatched, event_name, **kwargs)
+        return self.send_groups(dispatched)
+
+    def run(self, event_name, *args, **kwargs):
+        log.debug('Got event: %s(%s, %s)', event_name, args, kwargs)
+        self.dispatch(event_name, *args, **kwargs)
@@ -0,0 +1,64 @@
+import time
+from optparse import make_option
+
+from celery import registry
+from django.core.management.base import BaseCommand
+
+from urlannotator.flow_control.event_system import (EventBusSender,
+    DispatchIndex, get_literal)
+
+# Event names no handler is registered for, dispatched along the real ones.
+UNMATCHED_EVENTS = ['EventUnknown', 'OtherUnknown']
+
+
+def linear_handlers(registered, event_name):
+    """
+        Finds handlers the way EventBusSender did before it was indexed - by
+        trying every registered pattern.
+    """
+    return [(task_func, queue) for matcher, task_func, queue in registered
+        if matcher.match(event_name)]
+
+
+class Command(BaseCommand):
+    args = ''
+    help = """
+        Measures how many events per second EventBusSender resolves to their
+        handlers, by trying every pattern and with the dispatch index.
+        Handlers aren't called. Example:
+        ./manage.py benchmark_event_dispatch --events 200000
+    """
+
+    option_list = BaseCommand.option_list + (
+        make_option('--events', type='int', dest='events', default=100000,
+            help='Number of events resolved by every method.'),
+    )
+
+    def get_event_names(self, registered):
+        names = set()
+        for matcher, task_func, queue in registered:
+            literal = get_literal(matcher)
+            if literal is not None:
+                names.add(literal)
+        return sorted(names) + UNMATCHED_EVENTS
+
+    def measure(self, name, resolve, event_names, events):
+        start = time.time()
+        for idx in xrange(events):
+            resolve(event_names[idx % len(event_names)])
+        elapsed = time.time() - start
+        self.stdout.write('%-20s %12.0f events/s\n' % (name,
+            events / elapsed))
+
+    def handle(self, *args, **options):
+        registered = registry.tasks[EventBusSender.name].registered
+        event_names = self.get_event_names(registered)
+        self.stdout.write('%d handlers, %d event names.\n' % (
+            len(registered), len(event_names)))
+
+        self.measure('linear', lambda event_name: linear_handlers(
+            registered, event_name), event_names, options['events'])
+        self.measure('index (no memo)', DispatchIndex(registered).resolve,
+            event_names, options['events'])
+        self.measure('index', DispatchIndex(registered).handlers,
+            event_names, options['events'])
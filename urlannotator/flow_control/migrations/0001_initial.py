@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'PendingEvent'
+        db.create_table('flow_control_pendingevent', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('window', self.gf('django.db.models.fields.CharField')(max_length=200, db_index=True)),
+            ('kwargs', self.gf('django.db.models.fields.TextField')()),
+        ))
+        db.send_create_signal('flow_control', ['PendingEvent'])
+
+        # Adding model 'DebounceWindow'
+        db.create_table('flow_control_debouncewindow', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('name', self.gf('django.db.models.fields.CharField')(unique=True, max_length=200)),
+            ('scheduled', self.gf('django.db.models.fields.BooleanField')(default=False)),
+        ))
+        db.send_create_signal('flow_control', ['DebounceWindow'])
+
+
+    def backwards(self, orm):
+        # Deleting model 'PendingEvent'
+        db.delete_table('flow_control_pendingevent')
+
+        # Deleting model 'DebounceWindow'
+        db.delete_table('flow_control_debouncewindow')
+
+
+    models = {
+        'flow_control.debouncewindow': {
+            'Meta': {'object_name': 'DebounceWindow'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '200'}),
+            'scheduled': ('django.db.models.fields.BooleanField', [], {'default': 'False'})
+        },
+        'flow_control.pendingevent': {
+            'Meta': {'object_name': 'PendingEvent'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'kwargs': ('django.db.models.fields.TextField', [], {}),
+            'window': ('django.db.models.fields.CharField', [], {'max_length': '200', 'db_index': 'True'})
+        }
+    }
+
+    complete_apps = ['flow_control']
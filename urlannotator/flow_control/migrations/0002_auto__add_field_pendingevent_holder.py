@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding field 'PendingEvent.holder'
+        db.add_column('flow_control_pendingevent', 'holder',
+                      self.gf('django.db.models.fields.CharField')(default='', max_length=32, db_index=True, blank=True),
+                      keep_default=False)
+
+
+    def backwards(self, orm):
+        # Deleting field 'PendingEvent.holder'
+        db.delete_column('flow_control_pendingevent', 'holder')
+
+
+    models = {
+        'flow_control.debouncewindow': {
+            'Meta': {'object_name': 'DebounceWindow'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '200'}),
+            'scheduled': ('django.db.models.fields.BooleanField', [], {'default': 'False'})
+        },
+        'flow_control.pendingevent': {
+            'Meta': {'object_name': 'PendingEvent'},
+            'holder': ('django.db.models.fields.CharField', [], {'default': "''", 'max_length': '32', 'db_index': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'kwargs': ('django.db.models.fields.TextField', [], {}),
+            'window': ('django.db.models.fields.CharField', [], {'max_length': '200', 'db_index': 'True'})
+        }
+    }
+
+    complete_apps = ['flow_control']
@@ -0,0 +1,69 @@
+import json
+import uuid
+
+from django.db import models, IntegrityError
+
+from urlannotator.tools.utils import savepoint
+
+
+class PendingEventManager(models.Manager):
+    def add(self, window, kwargs):
+        self.create(window=window, kwargs=json.dumps(kwargs))
+
+    def take(self, window):
+        """
+            Removes events pending in `window` and returns their kwargs, in
+            order they came in. Events are claimed by a single update first,
+            so that concurrent flushes never return the same event.
+        """
+        holder = uuid.uuid4().hex
+        self.filter(window=window, holder='').update(holder=holder)
+        claimed = self.filter(holder=holder)
+        events = list(claimed.order_by('id').values_list('kwargs', flat=True))
+        claimed.delete()
+        return [json.loads(kwargs) for kwargs in events]
+
+
+class PendingEvent(models.Model):
+    """
+        Keyword arguments of an event waiting for its debounced handler.
+        `holder` is set by the flush that has claimed the event.
+    """
+    window = models.CharField(max_length=200, db_index=True)
+    kwargs = models.TextField()
+    holder = models.CharField(max_length=32, blank=True, default='',
+        db_index=True)
+
+    objects = PendingEventManager()
+
+
+class DebounceWindowManager(models.Manager):
+    def try_schedule(self, name):
+        """
+            Marks window `name` as scheduled for flush, unless it already is.
+            Returns whether it has been marked.
+        """
+        if not self.filter(name=name).exists():
+            try:
+                with savepoint():
+                    self.get_or_create(name=name)
+            except IntegrityError:
+                # Created by another process in the meantime.
+                pass
+
+        return bool(self.filter(name=name, scheduled=False).update(
+            scheduled=True))
+
+    def unschedule(self, name):
+        self.filter(name=name).update(scheduled=False)
+
+
+class DebounceWindow(models.Model):
+    """
+        Window collecting events of a debounced handler with the same key.
+        `scheduled` is set while the window's flush is scheduled.
+    """
+    name = models.CharField(max_length=200, unique=True)
+    scheduled = models.BooleanField(default=False)
+
+    objects = DebounceWindowManager()
@@ -49,7 +49,7 @@ class FlowControlMixin(object):
         self._original_registered = bus_sender.registered
 
         # Switching configuration for new one.
-        bus_sender.registered = list(self._new_registered())
+        bus_sender.set_registered(list(self._new_registered()))
 
         return res
 
@@ -59,7 +59,7 @@ class FlowControlMixin(object):
 
         from event_system import EventBusSender
         bus_sender = registry.tasks[EventBusSender.name]
-        bus_sender.registered = self._original_registered
+        bus_sender.set_registered(self._original_registered)
 
         super(FlowControlMixin, self)._post_teardown()
 
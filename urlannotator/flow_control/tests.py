@@ -1,14 +1,31 @@
 import os
+import re
 
+import mock
+
+from celery import registry
 from django.test import TestCase
+from django.test.utils import override_settings
 from django.contrib.auth.models import User
 
-from urlannotator.flow_control import send_event
+from urlannotator.flow_control import send_event, event_transaction
 from urlannotator.flow_control.test import (FlowControlMixin,
     ToolsMockedMixin, ToolsMocked)
-from urlannotator.flow_control.event_handlers import test_task_2
+from urlannotator.flow_control.event_handlers import test_task, test_task_2
+from urlannotator.flow_control.event_system import (EventBusSender,
+    DispatchIndex, get_literal)
+from urlannotator.flow_control.debounce import (debounce, flush_events,
+    merge_kwargs)
+from urlannotator.flow_control.models import PendingEvent
 from urlannotator.main.models import Sample, Job, LABEL_YES
 
+debounced_calls = []
+
+
+@debounce(key=lambda job_id, value: job_id)
+def debounced_handler(job_id, value):
+    debounced_calls.append((job_id, value))
+
 
 class TestEventBusSender(TestCase):
 
@@ -26,6 +43,205 @@ class TestEventBusSender(TestCase):
         os.remove(file_name)
 
 
+@override_settings(EVENT_DISPATCH_MODE='direct')
+class TestDirectDispatch(TestCase):
+
+    def test_direct_dispatch(self):
+        event_name, file_name, file_content = \
+            'TestEvent', "test_file_name", "success"
+
+        bus_sender = registry.tasks[EventBusSender.name]
+        with mock.patch.object(bus_sender, 'apply_async') as apply_async:
+            send_event(event_name,
+                fname=file_name,
+                content=file_content)
+            self.assertFalse(apply_async.called)
+
+        with open(file_name, 'r') as f:
+            self.assertEqual(file_content, f.readline())
+        os.remove(file_name)
+
+    def test_unmatched(self):
+        self.assertEqual(send_event('UnknownTestEvent'), [])
+
+
+@override_settings(EVENT_DISPATCH_MODE='direct')
+class TestDirectFlowAltering(FlowControlMixin, TestCase):
+
+    flow_definition = [
+        (r'^TestEvent$', test_task_2),
+    ]
+
+    def test_altering(self):
+        event_name, file_name, file_content = \
+            'TestEvent', "test_file_name", "success"
+
+        send_event(event_name,
+            fname=file_name,
+            content=file_content)
+
+        with open(file_name, 'r') as f:
+            self.assertEqual(file_content[::-1], f.readline())
+        os.remove(file_name)
+
+
+class TestDebounce(TestCase):
+
+    def setUp(self):
+        del debounced_calls[:]
+
+    def test_merge_kwargs(self):
+        self.assertEqual(merge_kwargs([{'a': 1, 'b': 2}, {'a': 3, 'b': 2}]),
+            {'a': [1, 3], 'b': [2]})
+
+    def test_debounce(self):
+        with mock.patch.object(flush_events, 'apply_async') as apply_async:
+            debounced_handler(job_id=1, value='a')
+            debounced_handler(job_id=1, value='b')
+            debounced_handler(job_id=1, value='a')
+            debounced_handler(job_id=2, value='c')
+
+        # One flush per key is scheduled.
+        self.assertEqual(apply_async.call_count, 2)
+        self.assertEqual(debounced_calls, [])
+        for args, kwargs in apply_async.call_args_list:
+            flush_events(*kwargs['args'])
+        self.assertEqual(debounced_calls, [([1], ['a', 'b']), ([2], ['c'])])
+        self.assertFalse(PendingEvent.objects.exists())
+
+        # Flushed window is opened again by the next event. Eager flush runs
+        # at once.
+        debounced_handler(job_id=1, value='d')
+        self.assertEqual(debounced_calls[-1], ([1], ['d']))
+
+        # Events without a key aren't debounced.
+        debounced_handler(job_id=None, value='e')
+        self.assertEqual(debounced_calls[-1], ([None], ['e']))
+
+    def test_take_claimed(self):
+        PendingEvent.objects.add('window', {'value': 'a'})
+        PendingEvent.objects.add('window', {'value': 'b'})
+        PendingEvent.objects.add('other', {'value': 'c'})
+        # Claimed by a concurrent flush.
+        PendingEvent.objects.filter(kwargs__contains='b').update(
+            holder='other-flush')
+
+        self.assertEqual(PendingEvent.objects.take('window'), [{'value': 'a'}])
+        self.assertEqual(PendingEvent.objects.take('window'), [])
+        self.assertEqual(PendingEvent.objects.filter(holder='other-flush')
+            .count(), 1)
+        self.assertEqual(PendingEvent.objects.take('other'), [{'value': 'c'}])
+
+
+class TestEventTransaction(TestCase):
+    def testSentAfterCommit(self):
+        with mock.patch('urlannotator.flow_control.send_events') as send:
+            with event_transaction():
+                send_event('TestEvent', fname='a')
+                with event_transaction():
+                    send_event('TestEvent', fname='b')
+                # Nested block doesn't send the events.
+                self.assertFalse(send.called)
+
+            send.assert_called_once_with([
+                ('TestEvent', {'fname': 'a'}),
+                ('TestEvent', {'fname': 'b'}),
+            ])
+
+    def testDroppedOnRollback(self):
+        with mock.patch('urlannotator.flow_control.send_events') as send:
+            with self.assertRaises(ValueError):
+                with event_transaction():
+                    send_event('TestEvent', fname='a')
+                    raise ValueError
+
+            self.assertFalse(send.called)
+
+            # The outbox is empty for the next transaction.
+            with event_transaction():
+                send_event('TestEvent', fname='b')
+            send.assert_called_once_with([('TestEvent', {'fname': 'b'})])
+
+    def testOutermostCommits(self):
+        target = 'urlannotator.flow_control.transaction'
+        with mock.patch(target) as transaction, \
+                mock.patch('urlannotator.flow_control.send_events') as send:
+            transaction.is_managed.return_value = False
+            with event_transaction():
+                with event_transaction():
+                    send_event('TestEvent', fname='a')
+                self.assertFalse(send.called)
+            send.assert_called_once_with([('TestEvent', {'fname': 'a'})])
+            # Nested block doesn't commit the transaction.
+            self.assertEqual(transaction.commit_on_success.call_count, 1)
+
+            # Caller's transaction is left for the caller to commit.
+            transaction.reset_mock()
+            transaction.is_managed.return_value = True
+            with event_transaction():
+                send_event('TestEvent', fname='b')
+            self.assertFalse(transaction.commit_on_success.called)
+            send.assert_called_with([('TestEvent', {'fname': 'b'})])
+
+    def testBatchDispatched(self):
+        file_names = ['test_file_a', 'test_file_b']
+        with event_transaction():
+            for file_name in file_names:
+                send_event('TestEvent', fname=file_name, content='success')
+                self.assertFalse(os.path.isfile(file_name))
+
+        for file_name in file_names:
+            with open(file_name, 'r') as f:
+                self.assertEqual(f.readline(), 'success')
+            os.remove(file_name)
+
+
+class TestDispatchIndex(TestCase):
+
+    def test_literals(self):
+        self.assertEqual(get_literal(re.compile(r'^EventNewSample$')),
+            'EventNewSample')
+        self.assertEqual(get_literal(re.compile(r'^EventNew.*$')), None)
+        self.assertEqual(get_literal(re.compile(r'^EventNewSample')), None)
+        self.assertEqual(get_literal(re.compile(r'^EventNewSample$', re.I)),
+            None)
+
+    def test_handlers(self):
+        registered = [
+            (re.compile(r'^TestEvent$'), test_task, 'first'),
+            (re.compile(r'^Test.*'), test_task_2, 'second'),
+            (re.compile(r'^OtherEvent$'), test_task, 'first'),
+        ]
+        index = DispatchIndex(registered)
+
+        # Handlers keep the order of registration.
+        self.assertEqual(index.handlers('TestEvent'),
+            ((test_task, 'first'), (test_task_2, 'second')))
+        self.assertEqual(index.handlers('TestOther'),
+            ((test_task_2, 'second'), ))
+        self.assertEqual(index.handlers('OtherEvent'),
+            ((test_task, 'first'), ))
+        self.assertEqual(index.handlers('Unknown'), ())
+        self.assertEqual(index.memo['TestOther'],
+            ((test_task_2, 'second'), ))
+
+    def test_replaced_handlers(self):
+        bus_sender = registry.tasks[EventBusSender.name]
+        original = bus_sender.registered
+        self.assertEqual([task_func for task_func, queue
+            in bus_sender.get_handlers('TestEvent')], [test_task])
+
+        # Same-size replacement of handlers isn't served stale ones.
+        replaced = [(matcher, test_task_2, queue)
+            for matcher, task_func, queue in original]
+        try:
+            bus_sender.set_registered(replaced)
+            self.assertEqual([task_func for task_func, queue
+                in bus_sender.get_handlers('TestEvent')], [test_task_2])
+        finally:
+            bus_sender.set_registered(original)
+
+
 class TestEventFlowSuppressing(FlowControlMixin, TestCase):
 
     suppress_events = ['TestEvent', ]
@@ -40,6 +256,10 @@ class TestEventFlowSuppressing(FlowControlMixin, TestCase):
 
         self.assertFalse(os.path.isfile(file_name))
 
+        # Index of replaced handlers is rebuilt.
+        bus_sender = registry.tasks[EventBusSender.name]
+        self.assertEqual(bus_sender.get_handlers(event_name), ())
+
 
 class TestEventFlowAltering(FlowControlMixin, TestCase):
 
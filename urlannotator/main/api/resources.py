@@ -358,22 +358,17 @@ class ClassifierResource(Resource):
 
         classify_urls = request.POST.get('urls', None)
         if classify_urls:
-            classify_urls = json.loads(classify_urls)
-            request_ids = []
-            for class_url in classify_urls:
-                # Empty url case
-                if not class_url:
-                    continue
-
-                classified_sample = ClassifiedSample.objects.create_by_owner(
-                    job=job,
-                    url=class_url,
-                    label=''
-                )
-                request_ids.append({
-                    'id': classified_sample.id,
-                    'url': class_url,
-                })
+            # Empty urls are skipped.
+            classify_urls = filter(None, json.loads(classify_urls))
+            class_samples = ClassifiedSample.objects.create_many_by_owner(
+                job=job,
+                urls=classify_urls,
+            )
+            request_ids = [{
+                'id': classified_sample.id,
+                'url': class_url,
+            } for class_url, classified_sample in zip(classify_urls,
+                class_samples)]
         else:
             classify_url = request.POST.get('url', None)
             if not classify_url:
@@ -3,9 +3,10 @@ from factories import SampleFactory, JobFactory
 
 from django.db.models import F
 
-from urlannotator.classification.models import TrainingSample, TrainingSet
+from urlannotator.classification.models import TrainingSet
 from urlannotator.main.models import GoldSample, LABEL_BROKEN, Job, Sample
 from urlannotator.flow_control import send_event
+from urlannotator.flow_control.debounce import debounce
 from urlannotator.tools.synchronization import POSIXLock
 
 
@@ -57,11 +58,7 @@ class GoldSamplesMonitor(Task):
 
         if gold_sample.label != LABEL_BROKEN:
             training_set = TrainingSet.objects.newest_for_job(job)
-            TrainingSample.objects.create(
-                set=training_set,
-                sample=gold_sample.sample,
-                label=gold_sample.label
-            )
+            training_set.set_labels({gold_sample.sample_id: gold_sample.label})
 
         Job.objects.filter(id=job.id, gold_left__gte=0)\
             .update(gold_left=F('gold_left') - 1)
@@ -69,21 +66,37 @@ class GoldSamplesMonitor(Task):
 new_gold_sample_task = registry.tasks[GoldSamplesMonitor.name]
 
 
+def get_sample_job_id(job_id=None, **kwargs):
+    """
+        Returns id of new sample's job, sent with the event.
+    """
+    return job_id
+
+
 @task(ignore_result=True)
-def update_job_urls_gathered(job_id, sample_id):
-    job = Job.objects.get(id=job_id)
-    sample = Sample.objects.get(id=sample_id)
+@debounce(key=get_sample_job_id)
+def update_job_urls_gathered(job_id, sample_id, **kwargs):
+    """
+        Updates caches of the job and workers that sent new samples. Samples
+        are debounced per job - `job_id` and `sample_id` are lists of ids of
+        all samples that came within the window.
+    """
+    job = Job.objects.get(id=job_id[0])
 
-    # A sample has been created.
+    # Samples have been created.
     job.get_progress(cache=False)
-    # If it was created by a worker - update top workers too.
+    # If they were created by workers - update top workers too.
     job.get_top_workers(cache=False)
     job.get_display_samples(cache=False)
     job.get_urls_collected(cache=False)
 
-    worker = sample.get_source_worker()
-    if worker is not None:
-        job.workerjobassociation_set.get(worker=worker).get_urls_collected()
+    workers = set()
+    for sample in Sample.objects.filter(id__in=sample_id):
+        worker = sample.get_source_worker()
+        if worker is not None and worker.id not in workers:
+            workers.add(worker.id)
+            job.workerjobassociation_set.get(
+                worker=worker).get_urls_collected()
 
 
 @task(ignore_result=True)
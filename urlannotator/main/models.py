@@ -7,7 +7,7 @@ import urlparse
 from django.db import models
 from django.db.models import F, Sum
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.utils.timezone import now
 from django.utils.http import urlencode
 from django.conf import settings
@@ -17,8 +17,9 @@ from django.template import Context
 from itertools import ifilter
 from tenclouds.django.jsonfield.fields import JSONField
 
-from urlannotator.flow_control import send_event
-from urlannotator.tools.synchronization import POSIXLock
+from urlannotator.flow_control import send_event, event_transaction
+from urlannotator.tools.synchronization import (get_lock, unlink_locks,
+    unlink_singletons)
 from urlannotator.tools.utils import cached
 from urlannotator.settings import imagescale2
 from urlannotator.crowdsourcing.tagasauris_helper import (stop_job,
@@ -132,9 +133,10 @@ class JobManager(models.Manager):
     def create_active(self, **kwargs):
         kwargs['status'] = 4
         kwargs['remaining_urls'] = kwargs.get('no_of_urls', 0)
-        job = self.create(**kwargs)
-        send_event('EventNewJobInitialization',
-            job_id=job.id)
+        with event_transaction():
+            job = self.create(**kwargs)
+            send_event('EventNewJobInitialization',
+                job_id=job.id)
         return job
 
     def create_draft(self, **kwargs):
@@ -373,8 +375,7 @@ class Job(models.Model):
             classifier on it.
         """
         from urlannotator.crowdsourcing.factories import quality_factory
-        from urlannotator.classification.models import (TrainingSet,
-            TrainingSample)
+        from urlannotator.classification.models import TrainingSet
 
         if not self.has_new_votes() and not force:
             return
@@ -384,41 +385,35 @@ class Job(models.Model):
         if not decisions:
             return
 
-        ts = TrainingSet.objects.create(job=self)
+        labels = {}
         for sample_id, label in decisions:
             if label == LABEL_BROKEN:
                 log.info(
                     'Job %d: Skipped broken training sample %d.' % (self.id, sample_id)
                 )
                 continue
-            sample = Sample.objects.get(id=sample_id)
             log.info(
                 'Job %d: Added training sample %d %s.' % (self.id, sample_id, label)
             )
-            TrainingSample.objects.create(
-                set=ts,
-                sample=sample,
-                label=label,
-            )
+            labels[sample_id] = label
 
-        for sample in self.sample_set.all().iterator():
-            if sample.is_gold_sample():
-                ts_sample, created = TrainingSample.objects.get_or_create(
-                    set=ts,
-                    sample=sample,
+        gold_samples = self.sample_set.filter(goldsample__isnull=False).\
+            values_list('id', 'goldsample__label')
+        for sample_id, label in gold_samples:
+            if sample_id in labels:
+                log.info(
+                    'Job %d: Overriden gold sample %d.' % (self.id, sample_id)
                 )
-                if not created:
-                    log.info(
-                        'Job %d: Overriden gold sample %d.' % (self.id, sample.id)
-                    )
-                ts_sample.label = sample.goldsample.label
-                ts_sample.save()
+            labels[sample_id] = label
 
-        send_event(
-            'EventTrainingSetCompleted',
-            set_id=ts.id,
-            job_id=self.id,
-        )
+        with event_transaction():
+            ts = TrainingSet.objects.create_revision(job=self, labels=labels)
+
+            send_event(
+                'EventTrainingSetCompleted',
+                set_id=ts.id,
+                job_id=self.id,
+            )
 
     @cached
     def _get_display_samples(self, cache):
@@ -557,10 +552,12 @@ class Job(models.Model):
 
     def reclassify_samples(self):
         """
-            Asynchronously reclassifies all samples.
+            Asynchronously reclassifies all samples, in batches.
         """
-        for sample in self.sample_set.all().iterator():
-            sample.reclassify()
+        # Possible loop imports here
+        from urlannotator.classification.models import ClassifiedSample
+        ClassifiedSample.objects.create_many_by_owner(job=self,
+            urls=self.sample_set.values_list('url', flat=True))
 
     def has_new_votes(self):
         """
@@ -708,7 +705,7 @@ class Job(models.Model):
             inbetween, then if `force` is True the job is activated forcefully.
             Otherwise nothing happens.
         """
-        with POSIXLock(name='job-%d-mutex' % self.id):
+        with get_lock(name='job-%d-mutex' % self.id):
             job = Job.objects.get(id=self.id)
             if job.status != self.status and not force:
                 return
@@ -731,7 +728,7 @@ class Job(models.Model):
             changes then if `force` is True initialization is performed.
             Otherwise the call does nothing.
         """
-        with POSIXLock(name='job-%d-mutex' % self.id):
+        with get_lock(name='job-%d-mutex' % self.id):
             job = Job.objects.get(id=self.id)
             if job.status != self.status and not force:
                 return
@@ -924,6 +921,22 @@ class Job(models.Model):
         self.status = JOB_STATUS_COMPLETED
         self.save()
 
+    def unlink_locks(self):
+        """
+            Removes locks of the job, so that they don't pile up in the system.
+            Only for deleted jobs - finished ones are still read and their
+            locks may be held.
+        """
+        # Possible loop imports here
+        from urlannotator.crowdsourcing.job_handlers import JOB_HANDLER_LOCKS
+        from urlannotator.classification.event_handlers import \
+            CLASSIFY_PENDING_JOB_SINGLETON
+
+        names = ['job-%d-mutex' % self.id]
+        names.extend(template % self.id for template in JOB_HANDLER_LOCKS)
+        unlink_locks(names)
+        unlink_singletons([CLASSIFY_PENDING_JOB_SINGLETON % self.id])
+
     def is_stopped(self):
         return self.status == JOB_STATUS_STOPPED
 
@@ -933,7 +946,7 @@ class Job(models.Model):
             no matter if during concurrent status change job's status has
             changed. Otherwise the call will do nothing.
         """
-        with POSIXLock(name='job-%d-mutex' % self.id):
+        with get_lock(name='job-%d-mutex' % self.id):
             job = Job.objects.get(id=self.id)
             if job.status != self.status and not force:
                 return
@@ -965,7 +978,7 @@ class Job(models.Model):
         return self.status == JOB_STATUS_INIT
 
     def set_flag(self, flag):
-        with POSIXLock(name='job-%d-mutex' % self.id):
+        with get_lock(name='job-%d-mutex' % self.id):
             self.initialization_status = F('initialization_status') | flag
             self.save()
 
@@ -1032,6 +1045,12 @@ SAMPLE_SOURCE_OWNER = 'owner'
 SAMPLE_TAGASAURIS_WORKER = 'tagasauris_worker'
 
 
+def unlink_job_locks(sender, instance, **kwargs):
+    instance.unlink_locks()
+
+post_delete.connect(unlink_job_locks, sender=Job)
+
+
 class SampleManager(models.Manager):
 
     def _domain(self, url):
@@ -1347,16 +1366,11 @@ class Sample(models.Model):
             Returns whether this sample has been classified at least once.
         """
         # Check if we have been voted down as BROKEN
-        from urlannotator.classification.models import (TrainingSet,
-            TrainingSample)
+        from urlannotator.classification.models import TrainingSet
         ts = TrainingSet.objects.newest_for_job(self.job)
-        count = TrainingSample.objects.filter(
-            sample=self,
-            set=ts,
-        ).count()
 
         # We are not adding broken samples to training sets
-        if not count:
+        if ts is None or ts.get_label(self.id) is None:
             return False
 
         yes_prob = self.get_yes_probability()
@@ -963,7 +963,7 @@ def project_classifier_data(request, id):
 
     writer = csv.writer(response)
     training_set = TrainingSet.objects.newest_for_job(job=job)
-    for sample in training_set.training_samples.all():
+    for sample in training_set.get_samples():
         writer.writerow([sample.sample.url, sample.label])
 
     return response
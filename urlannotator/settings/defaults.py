@@ -45,6 +45,60 @@ STATIC_URL = '/statics/'
 JOB_DEFAULT_CLASSIFIER = 'Classifier247'
 TWENTYFOUR_DEFAULT_CLASSIFIER = 'GooglePredictionClassifier'
 VOTES_STORAGE = 'TroiaVotesStorage'
+
+# Memory budget (in bytes) of every process's cache of loaded classifier models.
+CLASSIFIER_CACHE_SIZE = 256 * 1024 * 1024
+
+# Classifiers supporting incremental updates are retrained from scratch if the
+# training set changed by more than this fraction of its size.
+CLASSIFIER_UPDATE_MAX_DELTA = 0.2
+
+# Maximum number of revisions a training set is built of before a full
+# snapshot is stored.
+TRAINING_SET_MAX_DEPTH = 20
+
+# Number of folds classifiers are cross-validated with, and number of
+# processes folds are evaluated in (None - one per CPU).
+CLASSIFIER_CV_FOLDS = 5
+CLASSIFIER_CV_PROCESSES = None
+
+# Feature space new classifiers are created with. Stored in classifier's
+# parameters, where it can be changed per classifier. Options: 'dimension' -
+# number of buckets words are hashed into, 'ngrams' - maximum length of word
+# n-grams, 'min_df' - minimum number of training samples a feature has to
+# occur in, 'max_features' - maximum number of features kept.
+CLASSIFIER_FEATURES = {}
+
+# Classifiers are trained by a fixed-size pool of workers, started with
+# `./manage.py training_pool`. Set TRAINING_SCHEDULER to 'process' to train
+# every training set in a new process instead.
+TRAINING_SCHEDULER = 'pool'
+TRAINING_WORKERS = 2
+TRAINING_WORKER_MAX_TASKS = 50
+# Number of workers a training may kill (e.g. by running out of memory) before
+# it's given up and logged as a fatal training error.
+TRAINING_MAX_ATTEMPTS = 3
+
+# Strategy picking samples sent for voting: 'UncertaintySelection' sends
+# samples the current model is least certain of (by 'margin' or 'entropy' of
+# label probabilities), taking turns between jobs. 'FirstComeSelection' sends
+# the oldest samples, job by job.
+VOTING_SELECTION_STRATEGY = 'UncertaintySelection'
+VOTING_UNCERTAINTY_MEASURE = 'margin'
+
+# Cache classification results are reused from, and number of seconds they're
+# kept for. Results are keyed by classifier's version.
+CLASSIFICATION_RESULT_CACHE = 'memcache'
+CLASSIFICATION_RESULT_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Classification server keeping models in memory, started with
+# `./manage.py classification_server`. Classification tasks fall back to
+# in-process classification if it's unavailable.
+CLASSIFICATION_SERVER_ENABLED = True
+CLASSIFICATION_SERVER_HOST = '127.0.0.1'
+CLASSIFICATION_SERVER_PORT = 12346
+CLASSIFICATION_SERVER_TIMEOUT = 10
+
 QUALITY_ALGORITHM = 'DawidSkeneAlgorithm'
 
 SITE_URL = 'devel.urlannotator.10clouds.com'
@@ -141,6 +195,44 @@ CACHES = {
     },
 
 }
+
+# Where readers/writers counters of POSIX RW locks are kept: 'shm' - POSIX
+# shared memory of the host, 'memcache' - memcache (legacy).
+LIGHT_SWITCH_BACKEND = 'shm'
+
+# Backend of locks guarding singleton tasks, jobs and classifier switches:
+# 'posix' - POSIX semaphores, shared by processes on a single host,
+# 'database' - database rows, shared by workers on all hosts.
+LOCK_BACKEND = 'posix'
+
+# Alias of the database locks of the 'database' backend are kept in. Updates
+# taking locks have to commit at once to be seen by other hosts, so it should
+# be a second alias of the default database, with a connection of its own.
+LOCK_DATABASE = 'default'
+
+# Number of seconds a singleton task's lease lasts unless its heartbeat renews
+# it. A killed worker's lease is taken over after it expires.
+SINGLETON_LEASE_TTL = 60
+
+# Number of seconds classification tasks wait for a classifier switch, and
+# after which they are retried if it hasn't finished.
+CLASSIFY_LOCK_TIMEOUT = 5
+CLASSIFY_LOCKED_COUNTDOWN = 30
+
+# Number of seconds after which pending classification requests are picked up
+# by the periodic classify_pending sweep, if no task has classified them.
+CLASSIFY_SWEEP_AGE = 120
+
+# Whether acquire-wait and hold times of locks are measured. Every process
+# dumps them to a JSON file in LOCK_STATS_DIR and to the log every
+# LOCK_STATS_FLUSH_INTERVAL seconds. See the lock_stats command.
+LOCK_STATS_ENABLED = False
+LOCK_STATS_FLUSH_INTERVAL = 60
+LOCK_STATS_DIR = os.path.join(_tempdir, 'urlannotator_lock_stats')
+# Stats of processes that haven't dumped them for this many seconds (finished
+# ones) are removed.
+LOCK_STATS_MAX_AGE = 24 * 60 * 60
+
 #SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
 
 BASE_APPS = (
@@ -276,6 +368,7 @@ djcelery.setup_loader()
 CELERY_IMPORTS = (
     'urlannotator.flow_control.event_system',
     'urlannotator.flow_control.event_handlers',
+    'urlannotator.flow_control.debounce',
     'urlannotator.main.event_handlers',
     'urlannotator.statistics.monitor_tasks',
 )
@@ -325,6 +418,15 @@ def register_to_queues(tasks, queue_name):
 
 register_to_queues(long_common, 'long-common-tasks')
 
+# How events are sent to their handlers: 'bus' - through EventBusSender task
+# on CELERY_REALTIME_QUEUE, 'direct' - handlers' tasks are sent straight to
+# their queues by the process sending the event.
+EVENT_DISPATCH_MODE = 'bus'
+
+# Number of seconds events of debounced handlers, like job's cache updates on
+# new votes and samples, are collected for before the handler runs once.
+EVENT_DEBOUNCE_WINDOW = 5
+
 # Interval between a job monitor check. Defaults to 15 minutes.
 JOB_MONITOR_INTERVAL = crontab(minute=0, hour='*')
 WORKER_MONITOR_INTERVAL = crontab(minute=0, hour=0)
@@ -399,6 +501,30 @@ CELERYBEAT_SCHEDULE = {
             'queue': CELERY_LONGSCARCE_QUEUE,
         },
     },
+    'classify_pending': {
+        'task': 'urlannotator.classification.event_handlers.ClassifyPendingManager',
+        'schedule': datetime.timedelta(seconds=3 * 60),
+        'args': [],
+        'options': {
+            'queue': CELERY_LONGSCARCE_QUEUE,
+        },
+    },
+    'finish_training': {
+        'task': 'urlannotator.classification.event_handlers.FinishTrainingManager',
+        'schedule': datetime.timedelta(seconds=30),
+        'args': [],
+        'options': {
+            'queue': CELERY_LONGSCARCE_QUEUE,
+        },
+    },
+    'resume_reclassification': {
+        'task': 'urlannotator.classification.event_handlers.ResumeReclassificationManager',
+        'schedule': datetime.timedelta(seconds=5 * 60),
+        'args': [],
+        'options': {
+            'queue': CELERY_LONGSCARCE_QUEUE,
+        },
+    },
     'samplegather_hit': {
         'task': 'urlannotator.classification.event_handlers.SampleGatheringHITMonitor',
         'schedule': datetime.timedelta(seconds=3 * 60),
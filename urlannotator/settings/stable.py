@@ -109,6 +109,10 @@ DATABASES = {
     }
 }
 
+# Locks are taken on a connection of their own, outside of transactions.
+DATABASES['locks'] = dict(DATABASES['default'])
+LOCK_DATABASE = 'locks'
+
 # Tagasauris settings
 TAGASAURIS_HOST = 'http://stable.tagasauris.com'
 TAGASAURIS_USE_SANDBOX = False
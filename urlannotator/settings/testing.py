@@ -34,6 +34,15 @@ JENKINS_TASKS = (
     'django_jenkins.tasks.with_local_celery',
 )
 
+# Classify in-process in testing
+CLASSIFICATION_SERVER_ENABLED = False
+
+# Train in a new process, which is mocked to train eagerly
+TRAINING_SCHEDULER = 'process'
+
+# Cross-validate classifiers in the test process
+CLASSIFIER_CV_PROCESSES = 1
+
 # Don't use memcache in testing
 CACHES['memcache']['BACKEND'] = 'django.core.cache.backends.dummy.DummyCache'
 
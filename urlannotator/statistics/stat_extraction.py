@@ -165,6 +165,11 @@ def update_classifier_stats(classifier, job):
                 '%s error while computing metric %s with data %s'
                 % (e.message, metric, json.dumps(analyze))
             )
+    # Cross-validated classifiers give ROC AUC of predicted probabilities,
+    # which is more accurate than the one estimated from the matrix.
+    auc = analyze['modelDescription'].get('rocAuc')
+    if auc is not None:
+        stats['AUC'] = round(100.0 * auc, 4)
     stats['matrix'] = matrix
 
     ClassifierPerformance.objects.create(
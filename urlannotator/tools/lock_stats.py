@@ -0,0 +1,265 @@
+import atexit
+import bisect
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from urlannotator.tools.utils import setting
+
+import logging
+log = logging.getLogger(__name__)
+
+# Upper bounds of histograms' buckets, in seconds - from 10 microseconds to
+# 100 seconds, in half-decade steps. The last bucket counts everything above.
+BUCKETS = tuple(10 ** (exponent / 2.0) for exponent in xrange(-10, 5))
+
+# Default number of seconds between dumps of process's statistics.
+DEFAULT_FLUSH_INTERVAL = 60
+
+DEFAULT_STATS_DIR = os.path.join(tempfile.gettempdir(),
+    'urlannotator_lock_stats')
+
+# Default number of seconds after which statistics of a process that hasn't
+# dumped them since are removed. Live processes dump theirs every flush
+# interval, so only those of finished processes age out.
+DEFAULT_STATS_MAX_AGE = 24 * 60 * 60
+
+# Counters of lock events breakdown:
+# COUNTER_SKIPPED - singleton function skipped, because it was already running,
+# COUNTER_TIMEOUTS - lock not taken before the timeout.
+COUNTER_SKIPPED = 'skipped'
+COUNTER_TIMEOUTS = 'timeouts'
+
+
+class Histogram(object):
+    """
+        Durations counted in exponential buckets.
+    """
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def merge(self, entry):
+        """
+            Adds counts of a histogram dumped with `to_dict`.
+        """
+        for idx, count in enumerate(entry['counts']):
+            self.counts[idx] += count
+        self.count += entry['count']
+        self.total += entry['total']
+        self.max = max(self.max, entry['max'])
+
+    def percentile(self, fraction):
+        """
+            Returns upper bound of the bucket holding given fraction of
+            durations, or None if there are none.
+        """
+        if not self.count:
+            return None
+
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if seen >= fraction * self.count:
+                break
+        if idx < len(BUCKETS):
+            return min(BUCKETS[idx], self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'counts': list(self.counts),
+            'count': self.count,
+            'total': self.total,
+            'max': self.max,
+        }
+
+
+class LockStats(object):
+    """
+        Acquire-wait and hold-time histograms, and event counters, of locks
+        used in this process, by lock name. Disabled unless LOCK_STATS_ENABLED
+        setting is set - locks check `enabled` before taking any measurement.
+
+        Statistics are dumped every LOCK_STATS_FLUSH_INTERVAL seconds, and at
+        exit, to a per-process JSON file in LOCK_STATS_DIR and to the log.
+    """
+    def __init__(self):
+        self.enabled = setting('LOCK_STATS_ENABLED', False)
+        self.flush_interval = setting('LOCK_STATS_FLUSH_INTERVAL',
+            DEFAULT_FLUSH_INTERVAL)
+        self.lock = threading.Lock()
+        self.reset()
+        if self.enabled:
+            atexit.register(self.flush)
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.waits = {}
+        self.holds = {}
+        self.counters = {}
+        self.flushed = time.time()
+
+    def check_process(self):
+        # Statistics inherited from the parent process aren't ours.
+        if os.getpid() != self.pid:
+            self.reset()
+
+    def is_due(self):
+        """
+            Returns whether statistics should be dumped now. Has to be called
+            with `lock` held, so that only one thread dumps them.
+        """
+        current = time.time()
+        if current - self.flushed < self.flush_interval:
+            return False
+        self.flushed = current
+        return True
+
+    def add(self, histograms, name, duration):
+        with self.lock:
+            self.check_process()
+            histogram = histograms.get(name)
+            if histogram is None:
+                histogram = histograms[name] = Histogram()
+            histogram.add(duration)
+            due = self.is_due()
+        if due:
+            self.flush()
+
+    def record_wait(self, name, duration):
+        self.add(self.waits, name, duration)
+
+    def record_hold(self, name, duration):
+        self.add(self.holds, name, duration)
+
+    def count(self, name, counter):
+        with self.lock:
+            self.check_process()
+            counters = self.counters.setdefault(name, {})
+            counters[counter] = counters.get(counter, 0) + 1
+            due = self.is_due()
+        if due:
+            self.flush()
+
+    def to_dict(self):
+        with self.lock:
+            names = set(self.waits) | set(self.holds) | set(self.counters)
+            locks = {}
+            for name in names:
+                entry = {'counters': dict(self.counters.get(name, {}))}
+                if name in self.waits:
+                    entry['wait'] = self.waits[name].to_dict()
+                if name in self.holds:
+                    entry['hold'] = self.holds[name].to_dict()
+                locks[name] = entry
+
+        return {
+            'host': socket.gethostname(),
+            'pid': self.pid,
+            'time': time.time(),
+            'buckets': BUCKETS,
+            'locks': locks,
+        }
+
+    def get_file_name(self):
+        return os.path.join(get_stats_dir(), '%s-%d.json' % (socket.gethostname(), self.pid))
+
+    def flush(self):
+        """
+            Dumps statistics gathered since the process started.
+        """
+        stats = self.to_dict()
+        if not stats['locks']:
+            return
+
+        dump = json.dumps(stats)
+        log.info('Lock stats: %s' % dump)
+        file_name = self.get_file_name()
+        try:
+            if not os.path.isdir(os.path.dirname(file_name)):
+                os.makedirs(os.path.dirname(file_name))
+            tmp_name = '%s.tmp' % file_name
+            with open(tmp_name, 'w') as f:
+                f.write(dump)
+            os.rename(tmp_name, file_name)
+        except (IOError, OSError):
+            log.exception('Failed to write lock stats to %s' % file_name)
+        prune_stats(os.path.dirname(file_name))
+
+
+def get_stats_dir():
+    return setting('LOCK_STATS_DIR', DEFAULT_STATS_DIR)
+
+
+def prune_stats(stats_dir=None, max_age=None):
+    """
+        Removes statistics that haven't been dumped for `max_age` seconds
+        (LOCK_STATS_MAX_AGE setting by default), left by finished processes.
+        Returns names of the remaining files.
+    """
+    stats_dir = stats_dir or get_stats_dir()
+    if max_age is None:
+        max_age = setting('LOCK_STATS_MAX_AGE', DEFAULT_STATS_MAX_AGE)
+    if not os.path.isdir(stats_dir):
+        return []
+
+    oldest = time.time() - max_age
+    remaining = []
+    for file_name in sorted(os.listdir(stats_dir)):
+        if not file_name.endswith('.json'):
+            continue
+        path = os.path.join(stats_dir, file_name)
+        try:
+            if os.path.getmtime(path) < oldest:
+                os.remove(path)
+                continue
+        except OSError:
+            # Removed by another process in the meantime.
+            continue
+        remaining.append(file_name)
+    return remaining
+
+
+def read_stats(stats_dir=None):
+    """
+        Returns statistics dumped by processes, merged by lock name. Stats
+        older than LOCK_STATS_MAX_AGE are removed instead.
+
+        :rtype: A dictionary name -> {'wait': Histogram, 'hold': Histogram,
+                'counters': dict}
+    """
+    stats_dir = stats_dir or get_stats_dir()
+    merged = {}
+    for file_name in prune_stats(stats_dir):
+        try:
+            with open(os.path.join(stats_dir, file_name)) as f:
+                stats = json.load(f)
+        except (IOError, ValueError):
+            log.warning('Skipping unreadable lock stats %s' % file_name)
+            continue
+
+        for name, entry in stats['locks'].iteritems():
+            lock = merged.setdefault(name, {'wait': Histogram(),
+                'hold': Histogram(), 'counters': {}})
+            for kind in ('wait', 'hold'):
+                if kind in entry:
+                    lock[kind].merge(entry[kind])
+            for counter, value in entry['counters'].iteritems():
+                lock['counters'][counter] = \
+                    lock['counters'].get(counter, 0) + value
+    return merged
+
+
+lock_stats = LockStats()
@@ -0,0 +1,113 @@
+import time
+from multiprocessing import Process, Queue, Event
+from optparse import make_option
+
+import numpy
+from django.core.management.base import BaseCommand, CommandError
+
+from urlannotator.tools.synchronization import (POSIXRWLock,
+    memcache_client, COUNTER_BACKENDS, COUNTER_BACKEND_MEMCACHE)
+
+
+def reader(name, backend, iterations, start, results):
+    """
+        Enters and leaves the read lock `iterations` times, reporting every
+        acquire's latency.
+    """
+    lock = POSIXRWLock(name=name, backend=backend)
+    latencies = []
+    start.wait()
+    for _ in xrange(iterations):
+        begin = time.time()
+        lock.reader_acquire()
+        latencies.append(time.time() - begin)
+        lock.reader_release()
+    results.put(latencies)
+
+
+def writer(name, backend, interval, start, done):
+    """
+        Takes the write lock every `interval` seconds, like classifier
+        switches do.
+    """
+    lock = POSIXRWLock(name=name, backend=backend)
+    start.wait()
+    while not done.is_set():
+        lock.writer_acquire()
+        lock.writer_release()
+        time.sleep(interval)
+
+
+class Command(BaseCommand):
+    args = ''
+    help = """
+        Measures throughput and acquire latency of POSIXRWLock readers
+        contending for the lock, with light switch counters kept by every
+        backend. Example:
+        ./manage.py benchmark_light_switch --readers 16 --iterations 2000
+    """
+
+    option_list = BaseCommand.option_list + (
+        make_option('--readers', type='int', dest='readers', default=8,
+            help='Number of reader processes.'),
+        make_option('--iterations', type='int', dest='iterations',
+            default=1000, help='Number of lock entries per reader.'),
+        make_option('--writer-interval', type='float', dest='interval',
+            default=0.01, help='Seconds between writer entries. 0 disables '
+            'the writer.'),
+        make_option('-b', '--backend', dest='backend', default=None,
+            help='Only run given backend (%s).' % ', '.join(
+                sorted(COUNTER_BACKENDS))),
+    )
+
+    def run_backend(self, backend, options):
+        name = 'benchmark-light-switch-%s' % backend
+        start = Event()
+        done = Event()
+        results = Queue()
+        readers = [Process(target=reader, args=(name, backend,
+            options['iterations'], start, results))
+            for _ in xrange(options['readers'])]
+        writers = []
+        if options['interval']:
+            writers.append(Process(target=writer, args=(name, backend,
+                options['interval'], start, done)))
+
+        for process in readers + writers:
+            process.start()
+
+        begin = time.time()
+        start.set()
+        latencies = []
+        try:
+            for _ in readers:
+                latencies.extend(results.get())
+        finally:
+            elapsed = time.time() - begin
+            done.set()
+            for process in readers + writers:
+                process.join()
+
+        latencies = numpy.array(latencies) * 1000
+        self.stdout.write('%-10s %12.0f %10.3f %10.3f %10.3f\n' % (
+            backend, len(latencies) / elapsed,
+            numpy.percentile(latencies, 50), numpy.percentile(latencies, 99),
+            latencies.max()))
+
+    def handle(self, *args, **options):
+        backends = sorted(COUNTER_BACKENDS)
+        if options['backend']:
+            if options['backend'] not in COUNTER_BACKENDS:
+                raise CommandError('Unknown backend %s.' % options['backend'])
+            backends = [options['backend']]
+
+        self.stdout.write('%d readers, %d entries each.\n' % (
+            options['readers'], options['iterations']))
+        self.stdout.write('%-10s %12s %10s %10s %10s\n' % ('backend',
+            'entries/s', 'p50 ms', 'p99 ms', 'max ms'))
+        for backend in backends:
+            if backend == COUNTER_BACKEND_MEMCACHE and \
+                    not memcache_client.set('benchmark-light-switch', 1):
+                self.stdout.write('%-10s memcache is unavailable\n' % backend)
+                continue
+            self.run_backend(backend, options)
@@ -0,0 +1,104 @@
+import json
+import os
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from urlannotator.tools.lock_stats import (read_stats, DEFAULT_STATS_DIR,
+    COUNTER_SKIPPED, COUNTER_TIMEOUTS)
+from urlannotator.tools.utils import setting
+
+
+def format_ms(value):
+    if value is None:
+        return '-'
+    return '%.3f' % (value * 1000)
+
+
+def summarize(histogram):
+    return {
+        'count': histogram.count,
+        'total_ms': histogram.total * 1000,
+        'p50_ms': None if not histogram.count else
+            histogram.percentile(0.5) * 1000,
+        'p99_ms': None if not histogram.count else
+            histogram.percentile(0.99) * 1000,
+        'max_ms': histogram.max * 1000,
+    }
+
+
+class Command(BaseCommand):
+    args = ''
+    help = """
+        Prints acquire-wait and hold times of locks, and numbers of skipped
+        singleton runs, dumped by processes running with LOCK_STATS_ENABLED.
+        Percentiles are upper bounds of histograms' buckets. Example:
+        ./manage.py lock_stats --sort hold
+
+        Every process dumps its totals since it started. Stats of processes
+        that haven't dumped them for LOCK_STATS_MAX_AGE seconds are removed.
+        --reset removes all dumped stats - processes still running dump their
+        totals since start again on their next flush, so restart workers to
+        measure from scratch.
+    """
+
+    option_list = BaseCommand.option_list + (
+        make_option('--dir', dest='dir', default=None,
+            help='Directory with dumped stats. Defaults to LOCK_STATS_DIR.'),
+        make_option('--sort', dest='sort', default='wait',
+            help='Sort locks by total wait or hold time (wait, hold).'),
+        make_option('--json', action='store_true', dest='json',
+            default=False, help='Print stats as JSON.'),
+        make_option('--reset', action='store_true', dest='reset',
+            default=False, help='Remove dumped stats. Running processes '
+            'dump their totals again on their next flush.'),
+    )
+
+    def reset(self, stats_dir):
+        if not os.path.isdir(stats_dir):
+            return
+        for file_name in os.listdir(stats_dir):
+            if file_name.endswith('.json'):
+                os.remove(os.path.join(stats_dir, file_name))
+        self.stdout.write('Lock stats removed.\n')
+
+    def handle(self, *args, **options):
+        stats_dir = options['dir'] or setting('LOCK_STATS_DIR',
+            DEFAULT_STATS_DIR)
+        if options['reset']:
+            self.reset(stats_dir)
+            return
+
+        stats = read_stats(stats_dir)
+        sort = options['sort'] if options['sort'] in ('wait', 'hold') \
+            else 'wait'
+        names = sorted(stats, key=lambda name: -stats[name][sort].total)
+
+        if options['json']:
+            report = dict((name, {
+                'wait': summarize(stats[name]['wait']),
+                'hold': summarize(stats[name]['hold']),
+                'counters': stats[name]['counters'],
+            }) for name in names)
+            self.stdout.write(json.dumps(report, indent=2, sort_keys=True)
+                + '\n')
+            return
+
+        self.stdout.write('%-50s %8s %10s %10s %10s %10s %10s %8s %8s\n' % (
+            'lock', 'acquires', 'wait p50', 'wait p99', 'wait max',
+            'hold p50', 'hold p99', 'skipped', 'timeouts'))
+        for name in names:
+            wait = stats[name]['wait']
+            hold = stats[name]['hold']
+            counters = stats[name]['counters']
+            self.stdout.write(
+                '%-50s %8d %10s %10s %10s %10s %10s %8d %8d\n' % (
+                name, wait.count or hold.count,
+                format_ms(wait.percentile(0.5)),
+                format_ms(wait.percentile(0.99)),
+                format_ms(wait.max if wait.count else None),
+                format_ms(hold.percentile(0.5)),
+                format_ms(hold.percentile(0.99)),
+                counters.get(COUNTER_SKIPPED, 0),
+                counters.get(COUNTER_TIMEOUTS, 0)))
+        self.stdout.write('Times in milliseconds.\n')
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'LockReader'
+        db.create_table('tools_lockreader', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('name', self.gf('django.db.models.fields.CharField')(max_length=200, db_index=True)),
+            ('holder', self.gf('django.db.models.fields.CharField')(max_length=200)),
+            ('expires', self.gf('django.db.models.fields.DateTimeField')()),
+        ))
+        db.send_create_signal('tools', ['LockReader'])
+
+        # Deleting field 'Lock.readers'
+        db.delete_column('tools_lock', 'readers')
+
+
+    def backwards(self, orm):
+        # Deleting model 'LockReader'
+        db.delete_table('tools_lockreader')
+
+        # Adding field 'Lock.readers'
+        db.add_column('tools_lock', 'readers',
+                      self.gf('django.db.models.fields.IntegerField')(default=0),
+                      keep_default=False)
+
+
+    models = {
+        'tools.lock': {
+            'Meta': {'object_name': 'Lock'},
+            'expires': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'holder': ('django.db.models.fields.CharField', [], {'default': "''", 'max_length': '200', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '200'}),
+            'version': ('django.db.models.fields.BigIntegerField', [], {'default': '0'})
+        },
+        'tools.lockreader': {
+            'Meta': {'object_name': 'LockReader'},
+            'expires': ('django.db.models.fields.DateTimeField', [], {}),
+            'holder': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '200', 'db_index': 'True'})
+        }
+    }
+
+    complete_apps = ['tools']
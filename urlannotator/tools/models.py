@@ -0,0 +1,153 @@
+import time
+
+from django.db import models, IntegrityError, DEFAULT_DB_ALIAS
+from django.db.models import F, Q
+
+from urlannotator.tools.utils import savepoint, setting
+
+
+def get_lock_database():
+    """
+        Returns alias of the database locks are kept in. Updates taking locks
+        have to be committed at once to be seen by other hosts, so locks
+        should use a separate connection (a second alias of the same
+        database) that isn't part of callers' transactions.
+    """
+    return setting('LOCK_DATABASE', DEFAULT_DB_ALIAS)
+
+
+class LockManager(models.Manager):
+    def get_query_set(self):
+        return super(LockManager, self).get_query_set().using(
+            get_lock_database())
+
+    def ensure(self, name):
+        """
+            Creates lock `name` unless it exists.
+        """
+        if self.filter(name=name).exists():
+            return
+
+        try:
+            with savepoint(using=get_lock_database()):
+                self.get_or_create(name=name)
+        except IntegrityError:
+            # Created by another process in the meantime.
+            pass
+
+    def try_lease(self, name, holder, expires, now):
+        """
+            Leases lock `name` to `holder` until `expires`, if it's free or
+            its lease has expired by `now`. Returns whether it has been
+            leased.
+        """
+        return bool(self.filter(name=name).filter(Q(holder='') |
+            Q(expires__lt=now) | Q(expires__isnull=True)).update(
+            holder=holder, expires=expires))
+
+    def is_leased(self, name, now):
+        """
+            Returns whether lock `name` is leased to someone at `now`.
+        """
+        return self.filter(name=name, expires__gte=now).exclude(
+            holder='').exists()
+
+    def renew(self, name, holder, expires):
+        """
+            Extends `holder`'s lease of lock `name`. Returns whether
+            the holder still has it.
+        """
+        return bool(self.filter(name=name, holder=holder).update(
+            expires=expires))
+
+    def release_lease(self, name, holder):
+        self.filter(name=name, holder=holder).update(holder='', expires=None)
+
+    def get_version(self, name):
+        """
+            Returns version counter of lock `name`. A new counter starts from
+            the current time, so that it differs from any version of a removed
+            lock of the same name.
+        """
+        versions = self.filter(name=name).values_list('version', flat=True)
+        if versions and versions[0]:
+            return versions[0]
+
+        self.ensure(name)
+        self.filter(name=name, version=0).update(
+            version=int(time.time() * 1000))
+        return self.filter(name=name).values_list('version', flat=True)[0]
+
+    def bump_version(self, name):
+        self.filter(name=name).update(version=F('version') + 1)
+
+
+class Lock(models.Model):
+    """
+        A lock kept in the database, shared by processes on all hosts.
+        `holder` identifies the thread holding the lock (the writer of
+        a readers/writers lock), readers are kept as LockReader entries.
+        Leased locks are taken over by others once `expires` has passed.
+        `version` is a counter changed with the guarded resource.
+
+        Locks are taken with conditional updates, not row locks, so that they
+        don't depend on transactions and survive commits made while they're
+        held.
+    """
+    name = models.CharField(max_length=200, unique=True)
+    holder = models.CharField(max_length=200, blank=True, default='')
+    expires = models.DateTimeField(null=True, blank=True)
+    version = models.BigIntegerField(default=0)
+
+    objects = LockManager()
+
+
+class LockReaderManager(models.Manager):
+    def get_query_set(self):
+        return super(LockReaderManager, self).get_query_set().using(
+            get_lock_database())
+
+    def try_enter(self, name, holder, expires, now):
+        """
+            Adds reader `holder` of lock `name` until `expires`, unless
+            a writer holds the lock at `now`. Returns id of reader's entry,
+            or None if it hasn't been added.
+
+            The entry is added before the writer is checked, and the writer
+            checks readers after taking the lock, so they can't both get in.
+        """
+        reader = self.create(name=name, holder=holder, expires=expires)
+        if Lock.objects.is_leased(name, now):
+            self.filter(id=reader.id).delete()
+            return None
+        return reader.id
+
+    def renew(self, reader_id, expires):
+        """
+            Extends reader's entry. Returns whether it's still there.
+        """
+        return bool(self.filter(id=reader_id).update(expires=expires))
+
+    def leave(self, reader_id):
+        self.filter(id=reader_id).delete()
+
+    def has_readers(self, name, now):
+        """
+            Returns whether lock `name` has readers at `now`. Entries that
+            have expired, left by readers that are gone, are removed.
+        """
+        self.filter(name=name, expires__lt=now).delete()
+        return self.filter(name=name).exists()
+
+
+class LockReader(models.Model):
+    """
+        A reader holding a readers/writers lock kept in the database, until
+        `expires` unless it renews the entry. `holder` identifies the reader's
+        thread.
+    """
+    name = models.CharField(max_length=200, db_index=True)
+    holder = models.CharField(max_length=200)
+    expires = models.DateTimeField()
+
+    objects = LockReaderManager()
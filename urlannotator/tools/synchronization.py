@@ -1,9 +1,23 @@
+import datetime
+import errno
+import mmap
+import os
 import posix_ipc
 import memcache
+import random
+import socket
+import struct
+import thread
 import threading
+import time
 import weakref
 
+from django.db import connections
+from django.utils import timezone
 from tenclouds.lock.rwlock import RWLock
+from urlannotator.tools.lock_stats import (lock_stats, COUNTER_SKIPPED,
+    COUNTER_TIMEOUTS)
+from urlannotator.tools.models import Lock, LockReader
 from urlannotator.tools.utils import setting
 
 import logging
@@ -14,6 +28,75 @@ memcache_client = memcache.Client(['127.0.0.1:11211'], debug=0)
 
 _posix_sem_prefix = setting('POSIX_PREFIX', setting('SITE_URL', 'testing'))
 
+# Light switch counters' backends breakdown:
+# COUNTER_BACKEND_SHM - counters are kept in POSIX shared memory of the host,
+# COUNTER_BACKEND_MEMCACHE - counters are kept in memcache (legacy).
+COUNTER_BACKEND_SHM = 'shm'
+COUNTER_BACKEND_MEMCACHE = 'memcache'
+
+_counter_struct = struct.Struct('=q')
+
+# Lock backends breakdown:
+# LOCK_BACKEND_POSIX - POSIX semaphores, shared by processes on a single host,
+# LOCK_BACKEND_DATABASE - database rows, shared by processes on all hosts.
+LOCK_BACKEND_POSIX = 'posix'
+LOCK_BACKEND_DATABASE = 'database'
+
+# Number of seconds between attempts to take a database lock.
+DATABASE_LOCK_POLL_INTERVAL = 0.05
+
+# Default number of seconds a lease lasts unless it's renewed.
+DEFAULT_LEASE_TTL = 60
+
+# Fraction of lease's TTL after which it's renewed by its heartbeat.
+LEASE_RENEW_FRACTION = 1 / 3.0
+
+# Holder's pid, holder's token and expiry time of a POSIX lease. Token 0 means
+# the lease is free.
+_lease_struct = struct.Struct('=qqd')
+
+# Lease tokens have to differ between forked processes, which share the state
+# of the `random` module.
+_token_random = random.SystemRandom()
+
+
+def get_deadline(timeout):
+    """
+        Returns time `timeout` seconds from now, or None if there's no
+        timeout.
+    """
+    if timeout is None:
+        return None
+    return time.time() + timeout
+
+
+def get_remaining(deadline):
+    """
+        Returns number of seconds left until `deadline`, or None if there's
+        no deadline.
+    """
+    if deadline is None:
+        return None
+    return max(deadline - time.time(), 0)
+
+
+def is_expired(deadline):
+    return deadline is not None and time.time() >= deadline
+
+
+def _unlink_semaphore(name):
+    try:
+        posix_ipc.unlink_semaphore('/%s-%s' % (_posix_sem_prefix, name))
+    except posix_ipc.ExistentialError:
+        pass
+
+
+def _unlink_shared_memory(path):
+    try:
+        posix_ipc.unlink_shared_memory(path)
+    except posix_ipc.ExistentialError:
+        pass
+
 
 class _POSIXSemProxy(object):
     """
@@ -38,6 +121,17 @@ class _POSIXSemProxy(object):
     def acquire(self):
         self.semaphore.acquire()
 
+    def try_acquire(self, timeout=0):
+        """
+            Acquires the semaphore, waiting at most `timeout` seconds for it,
+            or forever if it's None. Returns whether it has been acquired.
+        """
+        try:
+            self.semaphore.acquire(timeout)
+            return True
+        except posix_ipc.BusyError:
+            return False
+
     def release(self):
         self.semaphore.release()
 
@@ -92,6 +186,14 @@ class POSIXLockCache(object):
 
             self.cache.pop(posix_sem.name, None)
 
+    def discard(self, name):
+        """
+            Thread-safely forgets lock `name`, so that it's opened again by
+            the next call to get it.
+        """
+        with self.lock:
+            self.cache.pop(name, None)
+
     def _add_lock(self, name):
         """
             Creates and adds a lock to the cache. This is not thread-safe.
@@ -138,18 +240,52 @@ class POSIXLock(object):
         proxy in process's scope for underlying semaphore guaranteeing that
         when finalized, the semaphore will be properly closed.
 
-        Instances of this class can be used with `with` statements.
+        Instances of this class can be used with `with` statements. Waits
+        for and holds of the lock are measured if lock stats are enabled.
     """
     def __init__(self, name):
         self.name = name
+        self.acquired = None
         global _posix_lock_cache
         self.lock = _posix_lock_cache.get_lock(name=name)
 
     def acquire(self):
+        if not lock_stats.enabled:
+            self.lock.acquire()
+            return
+
+        start = time.time()
         self.lock.acquire()
+        self.acquired = time.time()
+        lock_stats.record_wait(self.name, self.acquired - start)
+
+    def try_acquire(self, timeout=0):
+        if not lock_stats.enabled:
+            return self.lock.try_acquire(timeout)
+
+        start = time.time()
+        if not self.lock.try_acquire(timeout):
+            if timeout != 0:
+                lock_stats.count(self.name, COUNTER_TIMEOUTS)
+            return False
+        self.acquired = time.time()
+        lock_stats.record_wait(self.name, self.acquired - start)
+        return True
 
     def release(self):
+        acquired = self.acquired
+        self.acquired = None
         self.lock.release()
+        if acquired is not None:
+            lock_stats.record_hold(self.name, time.time() - acquired)
+
+    def unlink(self):
+        """
+            Removes the semaphore from the system. Processes that have it
+            open keep using it, the rest will create a new one.
+        """
+        _posix_lock_cache.discard(self.name)
+        _unlink_semaphore(self.name)
 
     def __enter__(self):
         self.acquire()
@@ -158,73 +294,467 @@ class POSIXLock(object):
         self.release()
 
 
-def singleton(name=None, return_value=None):
+def get_holder_id():
+    """
+        Returns identifier of the current thread, unique across hosts.
+    """
+    return '%s:%d:%d' % (socket.gethostname(), os.getpid(), thread.get_ident())
+
+
+def get_lock(name, backend=None):
+    """
+        Returns lock `name` of given backend, or the one configured with
+        LOCK_BACKEND setting.
+    """
+    backend = backend or setting('LOCK_BACKEND', LOCK_BACKEND_POSIX)
+    if backend == LOCK_BACKEND_DATABASE:
+        return DatabaseLock(name)
+    return POSIXLock(name)
+
+
+def unlink_locks(names, backend=None):
+    """
+        Removes locks of given names. Used when whatever they guarded is
+        gone, so that they don't pile up in the system.
+    """
+    for name in names:
+        get_lock(name, backend=backend).unlink()
+
+
+def is_process_alive(pid):
+    """
+        Returns whether process `pid` runs on this host.
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class POSIXLease(object):
+    """
+        A lock leased for `ttl` seconds, shared by processes on a single host.
+        Holder's pid, a token of its lease and the expiry time are kept in
+        POSIX shared memory, guarded by a POSIX lock. The lease is taken over
+        once it expires or its holder is gone, so a killed worker doesn't
+        keep it forever.
+    """
+    def __init__(self, name, ttl=DEFAULT_LEASE_TTL):
+        self.name = name
+        self.ttl = ttl
+        self.token = 0
+        self.mutex = POSIXLock(name='%s-lease-mutex' % name)
+        memory = posix_ipc.SharedMemory(
+            name=self.get_path(),
+            flags=posix_ipc.O_CREAT,
+            size=_lease_struct.size,
+        )
+        try:
+            self.map = mmap.mmap(memory.fd, _lease_struct.size)
+        finally:
+            memory.close_fd()
+
+    def get_path(self):
+        return '/%s-%s-lease' % (_posix_sem_prefix, self.name)
+
+    def read(self):
+        """
+            Returns a tuple (pid, token, expires) of the current lease.
+        """
+        return _lease_struct.unpack_from(self.map, 0)
+
+    def write(self, pid, token, expires):
+        _lease_struct.pack_into(self.map, 0, pid, token, expires)
+
+    def try_acquire(self):
+        """
+            Takes the lease if it's free, expired or its holder is gone.
+            Returns whether it has been taken.
+        """
+        with self.mutex:
+            pid, token, expires = self.read()
+            current = time.time()
+            if token:
+                if expires > current and is_process_alive(pid):
+                    return False
+                log.warning('Lease %s of process %d is stale, taking it over'
+                    % (self.name, pid))
+
+            self.token = _token_random.randint(1, 2 ** 62)
+            self.write(os.getpid(), self.token, current + self.ttl)
+            return True
+
+    def renew(self):
+        """
+            Extends the lease by `ttl` seconds. Returns whether it's still
+            held.
+        """
+        with self.mutex:
+            pid, token, expires = self.read()
+            if not self.token or token != self.token:
+                return False
+            self.write(pid, token, time.time() + self.ttl)
+            return True
+
+    def release(self):
+        with self.mutex:
+            if self.token and self.read()[1] == self.token:
+                self.write(0, 0, 0)
+        self.token = 0
+
+    def unlink(self):
+        _unlink_shared_memory(self.get_path())
+        self.mutex.unlink()
+
+
+class DatabaseLease(object):
+    """
+        A lock leased for `ttl` seconds, kept in a database row and shared by
+        processes on all hosts. The lease is taken over once it expires, so
+        hosts' clocks have to agree within a fraction of the TTL.
+    """
+    def __init__(self, name, ttl=DEFAULT_LEASE_TTL):
+        self.name = name
+        self.ttl = ttl
+        self.holder = None
+        Lock.objects.ensure(name)
+
+    def get_expiry(self, current):
+        return current + datetime.timedelta(seconds=self.ttl)
+
+    def try_acquire(self):
+        holder = get_holder_id()
+        current = timezone.now()
+        if not Lock.objects.try_lease(self.name, holder,
+                self.get_expiry(current), current):
+            return False
+        self.holder = holder
+        return True
+
+    def renew(self):
+        if self.holder is None:
+            return False
+        return Lock.objects.renew(self.name, self.holder,
+            self.get_expiry(timezone.now()))
+
+    def release(self):
+        if self.holder is not None:
+            Lock.objects.release_lease(self.name, self.holder)
+        self.holder = None
+
+    def unlink(self):
+        Lock.objects.filter(name=self.name).delete()
+
+
+def get_lease(name, ttl=DEFAULT_LEASE_TTL, backend=None):
+    """
+        Returns lease `name` of given backend, or the one configured with
+        LOCK_BACKEND setting.
+    """
+    backend = backend or setting('LOCK_BACKEND', LOCK_BACKEND_POSIX)
+    if backend == LOCK_BACKEND_DATABASE:
+        return DatabaseLease(name, ttl=ttl)
+    return POSIXLease(name, ttl=ttl)
+
+
+class LeaseHeartbeat(threading.Thread):
+    """
+        Renews a lease in the background while its holder runs, so that long
+        runs don't lose it. A lost lease is only logged - the holder isn't
+        interrupted.
+    """
+    def __init__(self, lease, interval=None):
+        super(LeaseHeartbeat, self).__init__(name='%s-heartbeat' % lease.name)
+        self.daemon = True
+        self.lease = lease
+        self.interval = interval or lease.ttl * LEASE_RENEW_FRACTION
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                try:
+                    renewed = self.lease.renew()
+                except Exception:
+                    log.exception('Failed to renew lease %s' % self.lease.name)
+                    continue
+
+                if not renewed:
+                    log.error('Lease %s has been taken over' % self.lease.name)
+                    return
+        finally:
+            # Database connections are opened per thread.
+            for thread_connection in connections.all():
+                thread_connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def get_singleton_lease_name(name):
+    return '%s-func-lock' % name
+
+
+def unlink_singletons(names, backend=None):
+    """
+        Removes leases of singletons of given names. Used when whatever they
+        processed is gone, so that they don't pile up in the system.
+    """
+    for name in names:
+        get_lease(get_singleton_lease_name(name), backend=backend).unlink()
+
+
+def singleton(name=None, return_value=None, ttl=None):
     """
         Decorator that ensures that the decorated function is called once at
         a time. If the function is already being processed somewhere else, the
         current function returns with specified `return_value`.
 
+        The function holds a lease, renewed while it runs. If its process is
+        killed, the lease is taken over after it expires (or at once, if the
+        process was on the same host and POSIX locks are used).
+
         :param name: - Name of the lock. If not provided, value of
                        function.__name__ is used instead.
         :param return_value: - Return value in case of locked semaphore.
                                Defaults to None.
+        :param ttl: - Number of seconds the lease lasts unless renewed.
+                      Defaults to SINGLETON_LEASE_TTL setting.
     """
     def decorator(func):
         def wrapper(*args, **kwargs):
             func_name = name or func.__name__
-            mutex_name = '%s-mutex-lock' % func_name
-            func_lock_name = '%s-func-lock' % func_name
-            p = POSIXLock(name=func_lock_name)
-
-            with POSIXLock(name=mutex_name):
-                if not p.lock.semaphore.value:
-                    # Lock is taken, function in progress
-                    log.warning(
-                        '%s: Processing already in progress' % func_name
-                    )
-                    return return_value
-                else:
-                    # value != 0
-                    p.acquire()
-
+            lease = get_lease(name=get_singleton_lease_name(func_name),
+                ttl=ttl or setting('SINGLETON_LEASE_TTL', DEFAULT_LEASE_TTL))
+
+            if not lease.try_acquire():
+                # Lock is taken, function in progress
+                log.warning(
+                    '%s: Processing already in progress' % func_name
+                )
+                if lock_stats.enabled:
+                    lock_stats.count(lease.name, COUNTER_SKIPPED)
+                return return_value
+
+            heartbeat = LeaseHeartbeat(lease)
+            heartbeat.start()
+            start = time.time()
             try:
                 return func(*args, **kwargs)
             finally:
-                p.release()
+                heartbeat.stop()
+                lease.release()
+                if lock_stats.enabled:
+                    lock_stats.record_hold(lease.name, time.time() - start)
 
         return wrapper
     return decorator
 
 
-class POSIXLightSwitch(object):
+class DatabaseLock(object):
+    """
+        A lock kept in a database row, shared by processes on all hosts.
+        The lock is leased to its holder and renewed by a heartbeat while it's
+        held, so a lock of a killed worker is taken over once it expires.
+
+        Instances of this class can be used with `with` statements.
+    """
+    def __init__(self, name, poll_interval=DATABASE_LOCK_POLL_INTERVAL,
+            ttl=DEFAULT_LEASE_TTL):
+        self.name = name
+        self.poll_interval = poll_interval
+        self.lease = DatabaseLease(name, ttl=ttl)
+        self.heartbeat = None
+
+    def acquire(self):
+        self.try_acquire(timeout=None)
+
+    def try_acquire(self, timeout=0):
+        """
+            Takes the lock, waiting at most `timeout` seconds for it, or
+            forever if it's None. Returns whether it has been taken.
+        """
+        deadline = get_deadline(timeout)
+        while not self.lease.try_acquire():
+            if is_expired(deadline):
+                return False
+            # Locks of deleted jobs are removed, they might be needed again.
+            Lock.objects.ensure(self.name)
+            time.sleep(self.poll_interval)
+
+        self.heartbeat = LeaseHeartbeat(self.lease)
+        self.heartbeat.start()
+        return True
+
+    def release(self):
+        if self.heartbeat is not None:
+            self.heartbeat.stop()
+            self.heartbeat = None
+        self.lease.release()
+
+    def unlink(self):
+        self.lease.unlink()
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, value, *args, **kwargs):
+        self.release()
+
+
+class DatabaseReader(object):
+    """
+        Reader's entry of a readers/writers lock kept in the database, leased
+        for `ttl` seconds like DatabaseLease.
+    """
+    def __init__(self, name, ttl=DEFAULT_LEASE_TTL):
+        self.name = name
+        self.ttl = ttl
+        self.reader_id = None
+
+    def get_expiry(self, current):
+        return current + datetime.timedelta(seconds=self.ttl)
+
+    def try_acquire(self):
+        current = timezone.now()
+        self.reader_id = LockReader.objects.try_enter(self.name,
+            get_holder_id(), self.get_expiry(current), current)
+        return self.reader_id is not None
+
+    def renew(self):
+        if self.reader_id is None:
+            return False
+        return LockReader.objects.renew(self.reader_id,
+            self.get_expiry(timezone.now()))
+
+    def release(self):
+        if self.reader_id is not None:
+            LockReader.objects.leave(self.reader_id)
+        self.reader_id = None
+
+
+class SharedCounter(object):
     """
-        Simple Readers/Writers counter using POSIX lock and memcache to store
-        counter's value.
+        Integer kept in a POSIX shared memory segment, shared by all processes
+        on the host. Updates aren't synchronized - they have to be guarded by
+        a lock shared by the processes.
+    """
+    def __init__(self, name):
+        self.name = name
+        memory = posix_ipc.SharedMemory(
+            name=self.get_path(),
+            flags=posix_ipc.O_CREAT,
+            size=_counter_struct.size,
+        )
+        try:
+            self.map = mmap.mmap(memory.fd, _counter_struct.size)
+        finally:
+            memory.close_fd()
+
+    def get(self):
+        return _counter_struct.unpack_from(self.map, 0)[0]
+
+    def add(self, delta):
+        """
+            Adds `delta` to the counter and returns its previous value.
+        """
+        value = self.get()
+        _counter_struct.pack_into(self.map, 0, value + delta)
+        return value
+
+    def get_path(self):
+        return '/%s-%s-counter' % (_posix_sem_prefix, self.name)
+
+    def unlink(self):
+        _unlink_shared_memory(self.get_path())
+
+
+class MemcacheCounter(object):
+    """
+        Integer kept in memcache. It costs a network round-trip per access and
+        is lost when evicted. Updates have to be guarded by a lock.
     """
     cache_timeout = 60 * 60 * 12  # 12 hours
 
     def __init__(self, name):
         self.name = name
-        self.mutex = POSIXLock(name='%s-%s' % (name, 'switchcounter'))
 
-    def acquire(self, lock):
+    def get(self):
+        return memcache_client.get(self.name) or 0
+
+    def add(self, delta):
         """
-            Increases counter's value by 1, and acquires lock argument if
-            previous counter's value was 0.
+            Adds `delta` to the counter and returns its previous value.
         """
-        self.mutex.acquire()
         counter = memcache_client.get(self.name)
         if counter is None:
-            memcache_client.add(self.name, 0, time=self.cache_timeout)
-            counter = 0
+            # The counter has been lost. Assume it was in the state that
+            # changes the lock.
+            counter = 0 if delta > 0 else 1
 
-        memcache_client.set(self.name, counter + 1,
+        memcache_client.set(self.name, counter + delta,
             time=self.cache_timeout)
-        if counter == 0:
-            self.mutex.release()
+        return counter
+
+    def unlink(self):
+        memcache_client.delete(self.name)
+
+
+# Counter classes by backend name.
+COUNTER_BACKENDS = {
+    COUNTER_BACKEND_SHM: SharedCounter,
+    COUNTER_BACKEND_MEMCACHE: MemcacheCounter,
+}
+
+
+class POSIXLightSwitch(object):
+    """
+        Simple Readers/Writers counter using POSIX lock to guard counter's
+        value. The value is kept in shared memory, or in memcache in legacy
+        mode (LIGHT_SWITCH_BACKEND setting).
+    """
+    def __init__(self, name, backend=None):
+        self.name = name
+        self.mutex = POSIXLock(name='%s-%s' % (name, 'switchcounter'))
+        backend = backend or setting('LIGHT_SWITCH_BACKEND',
+            COUNTER_BACKEND_SHM)
+        self.counter = COUNTER_BACKENDS[backend](name)
+
+    def acquire(self, lock, timeout=None):
+        """
+            Increases counter's value by 1, and acquires lock argument if
+            previous counter's value was 0. Gives up after `timeout` seconds
+            if it's given. Returns whether the switch has been entered.
+        """
+        if not lock_stats.enabled:
+            return self._acquire(lock, timeout)
+
+        start = time.time()
+        entered = self._acquire(lock, timeout)
+        lock_stats.record_wait(self.name, time.time() - start)
+        if not entered:
+            lock_stats.count(self.name, COUNTER_TIMEOUTS)
+        return entered
+
+    def _acquire(self, lock, timeout):
+        self.mutex.acquire()
+        counter = self.counter.add(1)
+        self.mutex.release()
+        if counter != 0:
+            return True
+
+        if timeout is None:
             lock.acquire()
-        else:
-            self.mutex.release()
+            return True
+
+        if lock.try_acquire(timeout):
+            return True
+
+        with self.mutex:
+            self.counter.add(-1)
+        return False
 
     def release(self, lock):
         """
@@ -232,23 +762,31 @@ class POSIXLightSwitch(object):
             counter is 0.
         """
         with self.mutex:
-            counter = memcache_client.get(self.name)
-            if counter is None:
-                counter = 1
-
-            memcache_client.set(self.name, counter - 1,
-                time=self.cache_timeout)
+            counter = self.counter.add(-1)
             if counter == 1:
                 lock.release()
 
+    def unlink(self):
+        self.mutex.unlink()
+        self.counter.unlink()
+
 
 class POSIXRWLock(RWLock):
-    """ RWLock implemented with posix_ipc.Semaphore and file switch.
+    """ RWLock implemented with posix_ipc.Semaphore and light switches.
+        Waits and holds of readers and writers are measured if lock stats are
+        enabled.
     """
 
-    def __init__(self, name, lock_dir='/tmp/10c/locks'):
-        self.__read_switch = POSIXLightSwitch('%s-%s' % (name, 'read'))
-        self.__write_switch = POSIXLightSwitch('%s-%s' % (name, 'write'))
+    def __init__(self, name, lock_dir='/tmp/10c/locks', backend=None):
+        self.read_name = '%s:read' % name
+        self.write_name = '%s:write' % name
+        # Readers enter and leave the lock in the same thread.
+        self.readers = threading.local()
+        self.writer_acquired = None
+        self.__read_switch = POSIXLightSwitch('%s-%s' % (name, 'read'),
+            backend=backend)
+        self.__write_switch = POSIXLightSwitch('%s-%s' % (name, 'write'),
+            backend=backend)
 
         self.__no_readers = POSIXLock(
             name='%s-%s' % (name, 'no_readers'),
@@ -258,21 +796,214 @@ class POSIXRWLock(RWLock):
             name='%s-%s' % (name, 'readers_queue'),
         )
 
-    def reader_acquire(self):
-        with self.__readers_queue:
-            with self.__no_readers:
-                self.__read_switch.acquire(self.__no_writers)
+    def reader_acquire(self, timeout=None):
+        """
+            Enters the lock as a reader, giving up after `timeout` seconds if
+            it's given. Returns whether the lock has been entered.
+        """
+        if not lock_stats.enabled:
+            return self._reader_acquire(timeout)
+
+        start = time.time()
+        entered = self._reader_acquire(timeout)
+        acquired = time.time()
+        lock_stats.record_wait(self.read_name, acquired - start)
+        if entered:
+            self.readers.acquired = acquired
+        else:
+            lock_stats.count(self.read_name, COUNTER_TIMEOUTS)
+        return entered
+
+    def _reader_acquire(self, timeout):
+        if timeout is None:
+            with self.__readers_queue:
+                with self.__no_readers:
+                    self.__read_switch.acquire(self.__no_writers)
+            return True
+
+        deadline = get_deadline(timeout)
+        if not self.__readers_queue.try_acquire(timeout):
+            return False
+        try:
+            if not self.__no_readers.try_acquire(get_remaining(deadline)):
+                return False
+            try:
+                return self.__read_switch.acquire(self.__no_writers,
+                    timeout=get_remaining(deadline))
+            finally:
+                self.__no_readers.release()
+        finally:
+            self.__readers_queue.release()
 
     def reader_release(self):
         self.__read_switch.release(self.__no_writers)
+        acquired = getattr(self.readers, 'acquired', None)
+        if acquired is not None:
+            self.readers.acquired = None
+            lock_stats.record_hold(self.read_name, time.time() - acquired)
 
     def writer_acquire(self):
+        start = time.time() if lock_stats.enabled else None
         self.__write_switch.acquire(self.__no_readers)
         self.__no_writers.acquire()
+        if start is not None:
+            self.writer_acquired = time.time()
+            lock_stats.record_wait(self.write_name,
+                self.writer_acquired - start)
 
     def writer_release(self):
+        acquired = self.writer_acquired
+        self.writer_acquired = None
         self.__no_writers.release()
         self.__write_switch.release(self.__no_readers)
+        if acquired is not None:
+            lock_stats.record_hold(self.write_name, time.time() - acquired)
+
+    def unlink(self):
+        self.__read_switch.unlink()
+        self.__write_switch.unlink()
+        self.__no_readers.unlink()
+        self.__no_writers.unlink()
+        self.__readers_queue.unlink()
+
+
+class DatabaseRWLock(RWLock):
+    """
+        Readers/writers lock kept in the database, shared by processes on all
+        hosts. The writer holds a lease of the lock's row, readers hold
+        entries of their own. Both are renewed by heartbeats while held, and
+        expire if their holder is gone. A writer waiting for readers to leave
+        keeps new readers out.
+    """
+    def __init__(self, name, poll_interval=DATABASE_LOCK_POLL_INTERVAL,
+            ttl=DEFAULT_LEASE_TTL):
+        self.name = name
+        self.poll_interval = poll_interval
+        self.ttl = ttl
+        # Holds of the current thread - a stack of (reader, heartbeat) and
+        # the writer's (lease, heartbeat).
+        self.held = threading.local()
+        Lock.objects.ensure(name)
+
+    def get_readers(self):
+        if not hasattr(self.held, 'readers'):
+            self.held.readers = []
+        return self.held.readers
+
+    def reader_acquire(self, timeout=None):
+        """
+            Enters the lock as a reader, giving up after `timeout` seconds if
+            it's given. Returns whether the lock has been entered.
+        """
+        reader = DatabaseReader(self.name, ttl=self.ttl)
+        deadline = get_deadline(timeout)
+        while not reader.try_acquire():
+            if is_expired(deadline):
+                return False
+            time.sleep(self.poll_interval)
+
+        heartbeat = LeaseHeartbeat(reader)
+        heartbeat.start()
+        self.get_readers().append((reader, heartbeat))
+        return True
+
+    def reader_release(self):
+        reader, heartbeat = self.get_readers().pop()
+        heartbeat.stop()
+        reader.release()
+
+    def writer_acquire(self):
+        lease = DatabaseLease(self.name, ttl=self.ttl)
+        while not lease.try_acquire():
+            # Locks of deleted jobs are removed, they might be needed again.
+            Lock.objects.ensure(self.name)
+            time.sleep(self.poll_interval)
+
+        heartbeat = LeaseHeartbeat(lease)
+        heartbeat.start()
+        self.held.writer = (lease, heartbeat)
+        while LockReader.objects.has_readers(self.name, timezone.now()):
+            time.sleep(self.poll_interval)
+
+    def writer_release(self):
+        lease, heartbeat = self.held.writer
+        self.held.writer = None
+        heartbeat.stop()
+        lease.release()
+
+    def unlink(self):
+        Lock.objects.filter(name=self.name).delete()
+        LockReader.objects.filter(name=self.name).delete()
+
+
+class POSIXVersion(object):
+    """
+        Version counter kept in POSIX shared memory, shared by processes on
+        the host.
+    """
+    def __init__(self, name):
+        self.counter = SharedCounter(name)
+        self.lock = POSIXLock(name=name + '_counter_lock')
+
+    def get(self):
+        version = self.counter.get()
+        if version:
+            return version
+
+        with self.lock:
+            # A new counter starts from the current time, so that it differs
+            # from any version of a removed one.
+            if not self.counter.get():
+                self.counter.add(int(time.time() * 1000))
+            return self.counter.get()
+
+    def bump(self):
+        with self.lock:
+            self.counter.add(1)
+
+    def unlink(self):
+        self.counter.unlink()
+        self.lock.unlink()
+
+
+class DatabaseVersion(object):
+    """
+        Version counter kept in a database row, shared by processes on all
+        hosts.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def get(self):
+        return Lock.objects.get_version(self.name)
+
+    def bump(self):
+        Lock.objects.bump_version(self.name)
+
+    def unlink(self):
+        Lock.objects.filter(name=self.name).delete()
+
+
+def get_version_counter(name, backend=None):
+    """
+        Returns version counter `name` of given backend, or the one
+        configured with LOCK_BACKEND setting.
+    """
+    backend = backend or setting('LOCK_BACKEND', LOCK_BACKEND_POSIX)
+    if backend == LOCK_BACKEND_DATABASE:
+        return DatabaseVersion(name)
+    return POSIXVersion(name)
+
+
+def get_rwlock(name, backend=None):
+    """
+        Returns readers/writers lock `name` of given backend, or the one
+        configured with LOCK_BACKEND setting.
+    """
+    backend = backend or setting('LOCK_BACKEND', LOCK_BACKEND_POSIX)
+    if backend == LOCK_BACKEND_DATABASE:
+        return DatabaseRWLock(name)
+    return POSIXRWLock(name)
 
 
 class RWSynchronize247(object):
@@ -291,15 +1022,36 @@ class RWSynchronize247(object):
         def __exit__(self, *args, **kwargs):
             self.sync247.end_switch()
 
-    def __init__(self, template_name):
-        self.lock = POSIXLock(name=template_name + '_general_lock')
-        self.rwlock = POSIXRWLock(name=template_name + '_rw_lock')
+    def __init__(self, template_name, backend=None):
+        self.lock = get_lock(name=template_name + '_general_lock',
+            backend=backend)
+        self.rwlock = get_rwlock(name=template_name + '_rw_lock',
+            backend=backend)
+        # Kept with the locks, so that it's seen by every process the locks
+        # are shared with.
+        self.version = get_version_counter(name=template_name + '_version',
+            backend=backend)
+
+    def get_version(self):
+        """
+        Returns version of the synchronized instances, changed by every
+        switch.
+        """
+        return self.version.get()
+
+    def bump_version(self):
+        """
+        Changes version of the synchronized instances. Requires the switch
+        locks.
+        """
+        self.version.bump()
 
-    def reader_lock(self):
+    def reader_lock(self, timeout=None):
         """
-        Locks the reader.
+        Locks the reader. Gives up after `timeout` seconds if it's given.
+        Returns whether the reader has been locked.
         """
-        self.rwlock.reader_acquire()
+        return self.rwlock.reader_acquire(timeout)
 
     def reader_release(self):
         """
@@ -313,6 +1065,13 @@ class RWSynchronize247(object):
         """
         self.lock.acquire()
 
+    def modified_try_lock(self, timeout=0):
+        """
+        Locks the modified instance if it's free within `timeout` seconds.
+        Returns whether it has been locked.
+        """
+        return self.lock.try_acquire(timeout)
+
     def modified_release(self):
         """
         Releases modified instance's lock.
@@ -338,6 +1097,19 @@ class RWSynchronize247(object):
 
     def end_switch(self):
         """
-            Finalizes switch locks.
+            Finalizes switch locks. Version is bumped before readers are let
+            in, so that they see the switched instances.
+        """
+        try:
+            self.bump_version()
+        finally:
+            self.rwlock.writer_release()
+
+    def unlink(self):
+        """
+            Removes all locks of the synchronized instances. They must not be
+            used anymore.
         """
-        self.rwlock.writer_release()
+        self.lock.unlink()
+        self.rwlock.unlink()
+        self.version.unlink()
@@ -1,13 +1,28 @@
+import datetime
+import os
+import shutil
+import tempfile
 import urllib2
 import threading
+import time
 import subprocess
 from Queue import Queue
 
+import mock
+
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.timezone import now
 
 from urlannotator.tools.web_extractors import (get_web_screenshot, get_web_text,
     is_proper_url)
-from urlannotator.tools.synchronization import RWSynchronize247, POSIXLock
+from urlannotator.tools.lock_stats import (lock_stats, read_stats,
+    Histogram, COUNTER_SKIPPED)
+from urlannotator.tools.models import Lock, LockReader
+from urlannotator.tools.synchronization import (RWSynchronize247, POSIXLock,
+    POSIXLightSwitch, POSIXRWLock, SharedCounter, DatabaseLock, DatabaseRWLock,
+    POSIXLease, DatabaseLease, singleton, COUNTER_BACKEND_SHM,
+    LOCK_BACKEND_POSIX, LOCK_BACKEND_DATABASE)
 from urlannotator.tools.webkit2png import BaseWebkitException
 
 
@@ -181,6 +196,272 @@ class POSIXCacheTest(TestCase):
         del lock_two
 
 
+class LightSwitchTest(TestCase):
+    def testSharedCounter(self):
+        counter = SharedCounter('shared-counter-test')
+        other = SharedCounter('shared-counter-test')
+        value = counter.get()
+        self.assertEqual(counter.add(2), value)
+        self.assertEqual(other.get(), value + 2)
+        self.assertEqual(other.add(-2), value + 2)
+        self.assertEqual(counter.get(), value)
+
+    def testLightSwitch(self):
+        lock = mock.Mock()
+        switch = POSIXLightSwitch('light-switch-test',
+            backend=COUNTER_BACKEND_SHM)
+
+        # Only the first one in locks, and only the last one out unlocks.
+        switch.acquire(lock)
+        switch.acquire(lock)
+        self.assertEqual(lock.acquire.call_count, 1)
+        switch.release(lock)
+        self.assertFalse(lock.release.called)
+        switch.release(lock)
+        self.assertEqual(lock.release.call_count, 1)
+
+
+class SwitchVersionTest(TestCase):
+    def assertVersionShared(self, backend):
+        sync = RWSynchronize247('switch-version-test', backend=backend)
+        other = RWSynchronize247('switch-version-test', backend=backend)
+        try:
+            version = sync.get_version()
+            self.assertTrue(version)
+            self.assertEqual(other.get_version(), version)
+
+            sync.bump_version()
+            self.assertEqual(other.get_version(), version + 1)
+        finally:
+            sync.unlink()
+
+    def testPOSIXVersion(self):
+        self.assertVersionShared(LOCK_BACKEND_POSIX)
+
+    def testDatabaseVersion(self):
+        self.assertVersionShared(LOCK_BACKEND_DATABASE)
+
+        sync = RWSynchronize247('switch-version-test',
+            backend=LOCK_BACKEND_DATABASE)
+        version = sync.get_version()
+        self.assertEqual(
+            Lock.objects.get(name='switch-version-test_version').version,
+            version)
+
+
+class DatabaseLockTest(TestCase):
+    def testDatabaseLock(self):
+        lock = DatabaseLock('database-lock-test')
+        other = DatabaseLock('database-lock-test')
+        self.assertTrue(lock.try_acquire())
+        self.assertFalse(other.try_acquire())
+
+        # Only the holder can release the lock.
+        other.release()
+        self.assertFalse(other.try_acquire())
+
+        lock.release()
+        self.assertEqual(Lock.objects.get(name='database-lock-test').holder,
+            '')
+
+        # Lock of a killed worker is taken over once it expires.
+        self.assertTrue(lock.try_acquire())
+        Lock.objects.filter(name='database-lock-test').update(
+            expires=now() - datetime.timedelta(seconds=1))
+        self.assertTrue(other.try_acquire())
+        other.release()
+        lock.release()
+
+    def testDatabaseRWLock(self):
+        lock = DatabaseRWLock('database-rwlock-test', poll_interval=0.01)
+        lock.reader_acquire()
+        lock.reader_acquire()
+        self.assertEqual(
+            LockReader.objects.filter(name='database-rwlock-test').count(), 2)
+
+        # Writer waiting for readers keeps new readers out.
+        writer = DatabaseLease('database-rwlock-test')
+        self.assertTrue(writer.try_acquire())
+        self.assertFalse(lock.reader_acquire(timeout=0))
+        lock.reader_release()
+        lock.reader_release()
+        self.assertFalse(LockReader.objects.has_readers('database-rwlock-test',
+            now()))
+        writer.release()
+
+        lock.writer_acquire()
+        self.assertFalse(lock.reader_acquire(timeout=0))
+        lock.writer_release()
+        self.assertTrue(lock.reader_acquire(timeout=0))
+        lock.reader_release()
+
+    def testDeadReaderExpires(self):
+        lock = DatabaseRWLock('database-rwlock-dead-test', poll_interval=0.01)
+        # Entry of a killed reader, never released.
+        LockReader.objects.create(name='database-rwlock-dead-test',
+            holder='other-host:1:1',
+            expires=now() - datetime.timedelta(seconds=1))
+
+        lock.writer_acquire()
+        self.assertFalse(LockReader.objects.filter(
+            name='database-rwlock-dead-test').exists())
+        lock.writer_release()
+
+    @override_settings(LOCK_BACKEND='database')
+    def testDatabaseSingleton(self):
+        calls = []
+
+        @singleton(name='database-singleton-test', return_value='skipped')
+        def run(depth):
+            calls.append(depth)
+            if depth:
+                return run(depth - 1)
+            return 'done'
+
+        self.assertEqual(run(1), 'skipped')
+        self.assertEqual(run(0), 'done')
+        self.assertEqual(calls, [1, 0])
+        self.assertTrue(Lock.objects.filter(
+            name='database-singleton-test-func-lock').exists())
+
+
+class LeaseTest(TestCase):
+    def testPOSIXLease(self):
+        lease = POSIXLease('posix-lease-test')
+        other = POSIXLease('posix-lease-test')
+        try:
+            self.assertTrue(lease.try_acquire())
+            self.assertFalse(other.try_acquire())
+            self.assertTrue(lease.renew())
+
+            # Lease of a killed process is taken over.
+            target = 'urlannotator.tools.synchronization.is_process_alive'
+            with mock.patch(target, return_value=False):
+                self.assertTrue(other.try_acquire())
+            self.assertFalse(lease.renew())
+            lease.release()
+            self.assertTrue(other.renew())
+
+            other.release()
+            self.assertTrue(lease.try_acquire())
+            lease.release()
+        finally:
+            lease.unlink()
+
+    def testDatabaseLease(self):
+        lease = DatabaseLease('database-lease-test', ttl=60)
+        other = DatabaseLease('database-lease-test', ttl=60)
+        target = 'urlannotator.tools.synchronization.get_holder_id'
+
+        self.assertTrue(lease.try_acquire())
+        with mock.patch(target, new=lambda: 'other-host:1:1'):
+            self.assertFalse(other.try_acquire())
+
+            # Expired lease is taken over.
+            Lock.objects.filter(name='database-lease-test').update(
+                expires=now() - datetime.timedelta(seconds=1))
+            self.assertTrue(other.try_acquire())
+        self.assertFalse(lease.renew())
+        lease.release()
+        self.assertTrue(other.renew())
+
+        other.release()
+        entry = Lock.objects.get(name='database-lease-test')
+        self.assertEqual((entry.holder, entry.expires), ('', None))
+
+    def testReaderTimeout(self):
+        lock = POSIXRWLock('reader-timeout-test')
+        try:
+            lock.writer_acquire()
+            self.assertFalse(lock.reader_acquire(timeout=0.1))
+            lock.writer_release()
+
+            self.assertTrue(lock.reader_acquire(timeout=0.1))
+            self.assertTrue(lock.reader_acquire(timeout=0.1))
+            lock.reader_release()
+            lock.reader_release()
+        finally:
+            lock.unlink()
+
+    def testTryAcquireTimeout(self):
+        lock = DatabaseLock('try-acquire-timeout-test', poll_interval=0.01)
+        self.assertTrue(lock.try_acquire(timeout=0.1))
+        self.assertFalse(lock.try_acquire(timeout=0.05))
+        lock.release()
+
+        # Removed locks are created again when needed.
+        lock.unlink()
+        self.assertTrue(lock.try_acquire(timeout=0.1))
+        lock.release()
+
+
+class LockStatsTest(TestCase):
+    def setUp(self):
+        self.stats_dir = tempfile.mkdtemp()
+        self.enabled = mock.patch.object(lock_stats, 'enabled', True)
+        self.enabled.start()
+        lock_stats.reset()
+
+    def tearDown(self):
+        self.enabled.stop()
+        lock_stats.reset()
+        shutil.rmtree(self.stats_dir)
+
+    def testHistogram(self):
+        histogram = Histogram()
+        self.assertEqual(histogram.percentile(0.5), None)
+        for value in [0.001] * 98 + [0.5, 2.0]:
+            histogram.add(value)
+        self.assertEqual(histogram.percentile(0.5), 0.001)
+        self.assertEqual(histogram.percentile(0.99), 1.0)
+        self.assertEqual(histogram.percentile(1.0), 2.0)
+
+        merged = Histogram()
+        merged.merge(histogram.to_dict())
+        self.assertEqual(merged.counts, histogram.counts)
+        self.assertEqual(merged.max, 2.0)
+
+    def testLockStats(self):
+        lock = POSIXLock('lock-stats-test')
+        with lock:
+            pass
+
+        @singleton(name='lock-stats-singleton-test')
+        def run(depth):
+            if depth:
+                run(depth - 1)
+        run(1)
+
+        self.assertEqual(lock_stats.waits['lock-stats-test'].count, 1)
+        self.assertEqual(lock_stats.holds['lock-stats-test'].count, 1)
+        name = 'lock-stats-singleton-test-func-lock'
+        self.assertEqual(lock_stats.holds[name].count, 1)
+        self.assertEqual(lock_stats.counters[name], {COUNTER_SKIPPED: 1})
+
+        with override_settings(LOCK_STATS_DIR=self.stats_dir):
+            lock_stats.flush()
+            stats = read_stats()
+        self.assertEqual(stats['lock-stats-test']['hold'].count, 1)
+        self.assertEqual(stats[name]['counters'], {COUNTER_SKIPPED: 1})
+
+    def testStaleStatsRemoved(self):
+        with lock_stats.lock:
+            lock_stats.holds['lock-stats-test'] = Histogram()
+        with override_settings(LOCK_STATS_DIR=self.stats_dir):
+            lock_stats.flush()
+            file_name = lock_stats.get_file_name()
+        stale = os.path.join(self.stats_dir, 'other-host-1.json')
+        shutil.copy(file_name, stale)
+        old = time.time() - 2 * 60 * 60
+        os.utime(stale, (old, old))
+
+        with override_settings(LOCK_STATS_MAX_AGE=60 * 60):
+            stats = read_stats(self.stats_dir)
+        self.assertIn('lock-stats-test', stats)
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(file_name))
+
+
 class URLCheckTest(TestCase):
     def testURLCheck(self):
         tests = [
@@ -3,8 +3,10 @@ import urlparse
 import requests
 import json
 import re
+from contextlib import contextmanager
 
 from django.conf import settings
+from django.db import transaction
 
 import logging
 log = logging.getLogger(__name__)
@@ -45,6 +47,43 @@ def setting(name, default):
     return getattr(settings, name, default)
 
 
+def chunks(iterable, size):
+    """
+        Yields consecutive lists of at most `size` elements of `iterable`.
+    """
+    chunk = []
+    for element in iterable:
+        chunk.append(element)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+@contextmanager
+def savepoint(using=None):
+    """
+        Runs the block so that its changes are undone if it fails, without
+        committing or rolling back the transaction it runs in. Inside
+        a managed transaction the block gets a savepoint, otherwise its own
+        transaction, like with `transaction.commit_on_success`.
+    """
+    if not transaction.is_managed(using=using):
+        with transaction.commit_on_success(using=using):
+            yield
+        return
+
+    sid = transaction.savepoint(using=using)
+    try:
+        yield
+    except:
+        transaction.savepoint_rollback(sid, using=using)
+        raise
+    transaction.savepoint_commit(sid, using=using)
+
+
 def sanitize_url(url):
     result = urlparse.urlsplit(url)
     if not result.scheme: